@@ -1,11 +1,11 @@
 import orjson
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 
-from app import settings
+from app.settings import settings
 from app.auth.user_manager import current_active_user
 from app.cache.game_cache import game_cache_manager
-from app.cache.redis import RedisManager
-from app.exceptions import GameIsNotCreated
+from app.cache.redis import RedisManager, parse_lobby_cursor
+from app.exceptions import GameIsBusy, GameIsNotCreated
 from app.operations.statistic import get_statistic
 from app.schemas import GameCreate, GameJoin, GameListRead
 from app.schemas.game import GameRead
@@ -15,12 +15,32 @@ from database.models import User
 router = APIRouter(tags=["games"])
 
 
-@router.get("/games")
-async def main_page(user: User = Depends(current_active_user)) -> GameListRead:
+@router.get("/games", response_model=GameListRead)
+async def main_page(
+    cursor: str | None = None,
+    limit: int = Query(default=settings.LOBBY_PAGE_SIZE, ge=1, le=settings.LOBBY_PAGE_SIZE_MAX),
+    if_none_match: str | None = Header(default=None),
+    user: User = Depends(current_active_user),
+) -> Response:
+    """Page of the lobby. The ETag changes with the lobby version, a poll with the current one gets 304."""
+    if cursor is not None:
+        try:
+            parse_lobby_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     try:
-        return GameListRead(gamesList=await game_cache_manager.get_games_info_data(), userName=user.username)
+        page = await game_cache_manager.get_lobby_page(cursor, limit)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    headers = {"ETag": f'"{page.version}-{cursor}-{limit}"', "Cache-Control": "private, no-cache"}
+    if if_none_match is not None and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=page.render(user.username), media_type="application/json", headers=headers)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
 
 
 @router.post("/games")
@@ -32,15 +52,40 @@ async def game_create(game_data: GameCreate, user: User = Depends(current_active
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
+@router.post("/games/bot")
+async def bot_game_create(game_data: GameCreate, user: User = Depends(current_active_user)) -> GameRead:
+    try:
+        game = await game_cache_manager.create_bot_game(user, game_data)
+        return game.dump_model()
+    except (GameIsNotCreated, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
 @router.get("/games/{game_id}/join")
 async def game_join(game_id: str, user: User = Depends(current_active_user)):
     try:
         await game_cache_manager.join_game(user, game_id)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
+    except GameIsBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     except (GameIsNotCreated, ValueError) as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
+@router.get("/games/{game_id}/events")
+async def game_events(game_id: str, after: str | None = None, user: User = Depends(current_active_user)) -> list[dict]:
+    """Events of the game logged after the `after` event id, e.g. to replay the game. Only the players may read them."""
+    game = await game_cache_manager.get(game_id)
+    if game is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Game is not found")
+    if f"{user.id}" not in game.players_state:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a player of this game")
+    try:
+        return await game_cache_manager.get_game_events(game_id, after)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
 @router.delete("/games/{game_id}")
 async def game_end(game_id: str, user: User = Depends(current_active_user)):
     try:
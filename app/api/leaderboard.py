@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from app.auth.user_manager import current_active_user
+from app.cache.leaderboard import leaderboard
+from app.schemas import LeaderboardEntry, LeaderboardPage
+from app.settings import settings
+from database.models import User
+
+router = APIRouter(tags=["leaderboard"])
+
+
+@router.get("/leaderboard")
+async def leaderboard_page(
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=settings.LEADERBOARD_PAGE_SIZE, ge=1, le=settings.LEADERBOARD_PAGE_SIZE_MAX),
+    user: User = Depends(current_active_user),
+) -> LeaderboardPage:
+    """Users with the highest rating first."""
+    try:
+        entries, total = await leaderboard.top(offset, limit)
+        return LeaderboardPage(entries=entries, total=total)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/users/{username}/rank")
+async def user_rank(username: str, user: User = Depends(current_active_user)) -> LeaderboardEntry:
+    try:
+        entry = await leaderboard.rank(username)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User has no rated games")
+    return entry
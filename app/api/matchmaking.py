@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+
+from app.auth.user_manager import current_active_user
+from app.cache.matchmaking import matchmaker
+from app.exceptions import MatchmakingError
+from app.schemas import MatchmakingTicket
+from database.models import User
+
+router = APIRouter(tags=["matchmaking"])
+
+
+@router.post("/matchmaking", status_code=status.HTTP_202_ACCEPTED)
+async def matchmaking_join(user: User = Depends(current_active_user)) -> MatchmakingTicket:
+    """Put the player into the quick-match queue. The game is sent with the `matchFound` message of the lobby socket."""
+    try:
+        return await matchmaker.join(user)
+    except MatchmakingError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=e.message)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.delete("/matchmaking")
+async def matchmaking_leave(user: User = Depends(current_active_user)):
+    try:
+        if not await matchmaker.leave(user):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="You are not in the matchmaking queue")
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+
+from app.auth.user_manager import current_superuser
+from app.cache.redis_client import redis_metrics
+from database.models import User
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics/redis")
+async def redis_metrics_read(user: User = Depends(current_superuser)) -> dict:
+    """Latencies of the Redis commands and the saturation of the connection pool of this worker.
+
+    The pool is sized by `REDIS_MAX_CONNECTIONS`: `maxInUse` close to it or growing `waits` mean it is too small.
+    """
+    return redis_metrics.to_dict()
@@ -2,9 +2,15 @@ from fastapi import APIRouter
 
 from app.api.auth import router as auth_router
 from app.api.games import router as main_router
+from app.api.leaderboard import router as leaderboard_router
+from app.api.matchmaking import router as matchmaking_router
+from app.api.metrics import router as metrics_router
 from app.settings import settings
 
 router = APIRouter(prefix=settings.API_PREFIX)
 
 router.include_router(main_router)
+router.include_router(matchmaking_router)
+router.include_router(leaderboard_router)
+router.include_router(metrics_router)
 router.include_router(auth_router)
@@ -1,9 +1,11 @@
 import uuid
-from typing import Optional
+from typing import Any, Optional
 
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin
 
+from app.auth.websocket_auth import JWTWebsocketAuth
+from app.cache.leaderboard import leaderboard
 from app.operations.statistic import create_statistic
 from app.settings import settings
 from database import get_user_db
@@ -20,6 +22,25 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
         print(f"User {user.id} has registered.")
         await create_statistic(user.id)
 
+    async def on_after_update(self, user: User, update_dict: dict[str, Any], request: Optional[Request] = None):
+        JWTWebsocketAuth.invalidate_user(user.id)
+        if "username" in update_dict:
+            try:
+                await leaderboard.rename(f"{user.id}", user.username)
+            except ValueError as e:
+                # The leaderboard is repaired by the periodic rebuild
+                print(f"Failed to rename user {user.id} in the leaderboard: {e}")
+
+    async def on_after_reset_password(self, user: User, request: Optional[Request] = None):
+        JWTWebsocketAuth.invalidate_user(user.id)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        JWTWebsocketAuth.invalidate_user(user.id)
+        try:
+            await leaderboard.remove(f"{user.id}")
+        except ValueError as e:
+            print(f"Failed to remove user {user.id} from the leaderboard: {e}")
+
     async def on_after_forgot_password(self, user: User, token: str, request: Optional[Request] = None):
         print(f"User {user.id} has forgot their password. Reset token: {token}")
 
@@ -34,3 +55,4 @@ async def get_user_manager(user_db=Depends(get_user_db)):
 fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [auth_backend])
 
 current_active_user = fastapi_users.current_user(active=True)
+current_superuser = fastapi_users.current_user(active=True, superuser=True)
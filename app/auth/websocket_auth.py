@@ -1,11 +1,23 @@
+import logging
+import time
+
 from fastapi import WebSocketException, status
 from fastapi.security import HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 
-from app.operations.users import get_user_by_id
+from app.cache.statistic_cache import statistic_cache
+from app.cache.ttl_cache import TTLCache
+from app.operations.users import get_user_and_statistic_by_id
 from app.settings import settings
 from database.models import User
 
+logger = logging.getLogger(__name__)
+
+# Decoded tokens: token -> user id, an entry never outlives the token itself
+token_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+# Users: user id -> User, invalidated by `UserManager` when the user is updated or deleted
+user_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
 
 class JWTWebsocketAuth:
     async def decode_jwt(token: str) -> dict | None:
@@ -16,6 +28,33 @@ class JWTWebsocketAuth:
         except JWTError:
             return None
 
+    @classmethod
+    async def get_user_id(cls, token: str) -> str | None:
+        if (user_id := token_cache.get(token)) is not None:
+            return user_id
+        if not (decoded_jwt := await cls.decode_jwt(token)):
+            return None
+        user_id = decoded_jwt["sub"]
+        if expires_at := decoded_jwt.get("exp"):
+            token_cache.set(token, user_id, ttl=expires_at - time.time())
+        return user_id
+
+    @classmethod
+    async def get_user(cls, user_id: str) -> User | None:
+        if (user := user_cache.get(user_id)) is not None:
+            return user
+        # The statistic is read by the same query, the lobby and the games of the user take it from the cache
+        if (loaded := await get_user_and_statistic_by_id(user_id)) is None:
+            return None
+        user, statistic = loaded
+        user_cache.set(user_id, user)
+        try:
+            # The version of the statistic is not known, it is cached for a short time if it is not cached yet
+            await statistic_cache.fill(user_id, statistic)
+        except ValueError as e:
+            logger.warning("Statistic cache is not available: %s", e)
+        return user
+
     @classmethod
     async def validate(cls, token: str) -> User | None:
         scheme, _, param = token.partition(" ")
@@ -23,8 +62,15 @@ class JWTWebsocketAuth:
         if credentials.scheme != "Bearer":
             raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authentication scheme.")
 
-        if decoded_jwt := await cls.decode_jwt(credentials.credentials):
-            user = await get_user_by_id(decoded_jwt["sub"])
-            return user
+        if user_id := await cls.get_user_id(credentials.credentials):
+            return await cls.get_user(user_id)
         else:
             raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authorization code.")
+
+    @staticmethod
+    def invalidate_user(user_id: str) -> None:
+        user_cache.pop(f"{user_id}")
+
+    @staticmethod
+    def cache_stats() -> dict:
+        return {"tokens": token_cache.stats(), "users": user_cache.stats()}
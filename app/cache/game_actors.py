@@ -0,0 +1,503 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+import orjson
+from redis.exceptions import RedisError
+
+from app.cache.pubsub import PubSubDispatcher, SubscriberQueue, pubsub_dispatcher
+from app.cache.redis import RedisCache, game_channel, game_lease_key, game_log_key
+from app.exceptions import BaseGameError, GameIsBusy, GameIsFinished, GameIsNotCreated, MoveIsNotAllowed
+from app.schemas.game import GAME_FORMAT_VERSION, Game
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Changes the game in memory and returns the events as JSON objects and the reply to the sender of the command.
+# The reply must be JSON serializable, the command may be forwarded by another worker.
+CommandHandler = Callable[[Game, dict], Awaitable[tuple[list[bytes], dict]]]
+
+
+def game_commands_channel(game_id: str) -> str:
+    """Channel of the commands forwarded to the worker owning the game."""
+    return f"game:{game_id}:commands"
+
+
+def worker_replies_channel(worker_id: str) -> str:
+    """Channel of the replies to the commands forwarded by the worker."""
+    return f"worker:{worker_id}:replies"
+
+
+# KEYS: lease; ARGV: worker id, lease TTL in ms
+_ACQUIRE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+# The saved game is the one the actor has loaded or saved last: the same flags and players and the same sequence
+# number, see `_saved_game_version`. The games in the legacy JSON format are not compared, the actor rewrites them.
+_SAVED_GAME_LUA = f"""
+local function is_saved_game(data, players, seq)
+    if not data then
+        return false
+    end
+    if string.byte(data, 1) ~= {GAME_FORMAT_VERSION} then
+        return true
+    end
+    return string.sub(data, 2, 2) .. string.sub(data, 11) == players and string.sub(data, 7, 10) == seq
+end
+"""
+
+# Renews the lease, saves the game and appends the events to the log of the game, like `RedisCache.update` does,
+# while the worker owns the game. Nothing is written when the saved game has been changed by someone else, e.g.
+# it is closed or it was joined before the lease was taken.
+# KEYS: lease, game, log, channel
+# ARGV: worker id, lease TTL in ms, max log length, log TTL, players and seq of the saved game, game or '' to keep
+#   the saved one, events (JSON objects)
+# Returns: number of the appended events, -1 when the lease is lost, -2 when the saved game is changed
+_COMMIT_SCRIPT = (
+    _SAVED_GAME_LUA
+    + """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return -1
+end
+if not is_saved_game(redis.call('GET', KEYS[2]), ARGV[5], ARGV[6]) then
+    return -2
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+if ARGV[7] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[7], 'KEEPTTL')
+end
+for i = 8, #ARGV do
+    local event_id = redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[3], '*', 'event', ARGV[i])
+    redis.call('PUBLISH', KEYS[4], '{"eventId":"' .. event_id .. '",' .. string.sub(ARGV[i], 2))
+end
+if #ARGV > 7 then
+    redis.call('EXPIRE', KEYS[3], ARGV[4])
+end
+return #ARGV - 7
+"""
+)
+
+# Saves the game, unless it has been changed by someone else, and releases the lease.
+# KEYS: lease, game; ARGV: worker id, players and seq of the saved game, game or '' to keep the saved one
+_RELEASE_SCRIPT = (
+    _SAVED_GAME_LUA
+    + """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[4] ~= '' and is_saved_game(redis.call('GET', KEYS[2]), ARGV[2], ARGV[3]) then
+    redis.call('SET', KEYS[2], ARGV[4], 'KEEPTTL')
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+)
+
+# Errors of the forwarded commands are replied by the name and raised again by the sender
+_REPLIED_ERRORS = {
+    error.__name__: error for error in (BaseGameError, GameIsBusy, GameIsFinished, GameIsNotCreated, MoveIsNotAllowed)
+}
+
+_STOP = object()
+
+
+class _LeaseLost(Exception):
+    """The game is owned by another worker, the command is sent again."""
+
+
+class _GameChanged(_LeaseLost):
+    """The saved game is changed behind the actor, the command is sent again to the actor loading it anew."""
+
+
+def _saved_game_version(game: Game, saved_seq: int) -> tuple[bytes, bytes]:
+    """Flags and players of the game in the binary format and the sequence number of its saved copy.
+
+    The moves do not change the flags and the players, so they are the same as in the saved game.
+    """
+    data = game.dump_bytes()
+    return data[1:2] + data[10:], saved_seq.to_bytes(4, "big")
+
+
+class _Command:
+    """Command of the local sender."""
+
+    __slots__ = ("data", "done")
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class GameActor:
+    """Game owned by this worker."""
+
+    def __init__(self, game: Game, saved_seq: int, inbox: SubscriberQueue):
+        self.game = game
+        # Local commands and the commands forwarded by the other workers
+        self.inbox = inbox
+        # Sequence number of the game saved in Redis, the log of the game may be ahead of it
+        self.saved_seq = saved_seq
+        self.renewed_at = self.active_at = time.monotonic()
+        self.task: asyncio.Task | None = None
+
+
+class GameActors:
+    """Single writer of every game being played.
+
+    The worker which takes the lease of the game keeps the game in memory, and the commands of the game, e.g. the
+    moves, are applied one by one by the actor of the game. Applying a batch of the queued commands costs one
+    round-trip: the script renewing the lease and appending the events to the log of the game. The game itself is
+    saved by the same script on the first move, every `snapshot_moves` moves and when the game is finished, and when
+    the actor is stopped. The log is ahead of the saved game, see `RedisCache.get_latest`.
+
+    The lobby scripts of `RedisCache` do not join or leave the game while it is owned, and closing the game revokes
+    the lease. The actor stops right after the commands of the game which has no moves yet, so the seats are changed
+    only by the lobby scripts, and its saves check that the saved game is the one it has loaded.
+
+    The other workers forward the commands to the channel of the game and get the replies in their own channels.
+    When the owner crashes, its lease expires and the next command takes the game over.
+    """
+
+    retry_delay = 0.05
+
+    def __init__(
+        self,
+        redis_cache: RedisCache | None = None,
+        dispatcher: PubSubDispatcher = pubsub_dispatcher,
+        lease_ttl: float = settings.GAME_LEASE_TTL,
+        snapshot_moves: int = settings.GAME_SNAPSHOT_MOVES,
+        idle_timeout: float = settings.GAME_ACTOR_IDLE_TIMEOUT,
+        forward_timeout: float = settings.GAME_FORWARD_TIMEOUT,
+    ):
+        self.redis_cache = redis_cache or RedisCache()
+        self.redis = self.redis_cache.redis
+        self.dispatcher = dispatcher
+        self.worker_id = uuid4().hex
+        self.lease_ttl = lease_ttl
+        self.snapshot_moves = snapshot_moves
+        self.idle_timeout = idle_timeout
+        self.forward_timeout = forward_timeout
+        # Called by the actor once the game is finished and its last events are logged
+        self.on_finish: Callable[[Game], Awaitable[None]] | None = None
+        self._handlers: dict[str, CommandHandler] = {}
+        self._actors: dict[str, GameActor] = {}
+        self._lock = asyncio.Lock()
+        # request id -> reply of the forwarded command
+        self._pending: dict[str, asyncio.Future] = {}
+        self._replies: SubscriberQueue | None = None
+        self._reader: asyncio.Task | None = None
+        self._acquire_script = self.redis.register_script(_ACQUIRE_SCRIPT)
+        self._commit_script = self.redis.register_script(_COMMIT_SCRIPT)
+        self._release_script = self.redis.register_script(_RELEASE_SCRIPT)
+
+    def register(self, command_type: str, handler: CommandHandler) -> None:
+        self._handlers[command_type] = handler
+
+    async def start(self) -> None:
+        if self._reader is None:
+            await self._load_scripts()
+            self._replies = await self.dispatcher.subscribe(worker_replies_channel(self.worker_id))
+            self._reader = asyncio.create_task(self._read_replies(), name="game-actors-replies")
+
+    async def _load_scripts(self) -> None:
+        """Load the scripts at startup, so even the first moves are single EVALSHA round-trips."""
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for script in (self._acquire_script, self._commit_script, self._release_script):
+                    pipe.script_load(script.script)
+                await pipe.execute()
+        except RedisError as e:
+            raise ValueError(f"Failed to load scripts to Redis: {e}")
+
+    async def stop(self) -> None:
+        """Stop the actors, the games are saved and their leases are released."""
+        for actor in list(self._actors.values()):
+            actor.inbox.put_nowait(_STOP)
+        await asyncio.gather(*(actor.task for actor in list(self._actors.values())), return_exceptions=True)
+        if self._reader is None:
+            return
+        self._reader.cancel()
+        await asyncio.gather(self._reader, return_exceptions=True)
+        self._reader = None
+        await self.dispatcher.unsubscribe(worker_replies_channel(self.worker_id), self._replies)
+
+    async def execute(self, game_id: str, data: dict) -> dict:
+        """Execute the command of the game on the worker owning the game.
+
+        Args:
+            game_id (str): game id
+            data (dict): command, its `type` selects the registered handler
+
+        Raises:
+            GameIsBusy: the worker owning the game has not replied in `forward_timeout` seconds
+            BaseGameError: raised by the handler
+
+        Returns:
+            dict: reply of the handler
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.forward_timeout
+        while True:
+            if (actor := self._actors.get(game_id) or await self._take(game_id)) is not None:
+                command = _Command(data)
+                actor.inbox.put_nowait(command)
+                try:
+                    return await command.done
+                except _LeaseLost:
+                    pass
+            elif (reply := await self._forward(game_id, data, deadline)) is not None:
+                return reply
+            if loop.time() >= deadline:
+                raise GameIsBusy("The game is not available, try again")
+            await asyncio.sleep(self.retry_delay)
+
+    async def get(self, game_id: str) -> Game | None:
+        """Get the current state of the game."""
+        if (actor := self._actors.get(game_id)) is not None:
+            return Game.load_bytes(actor.game.dump_bytes())
+        return await self.redis_cache.get_latest(game_id)
+
+    async def _take(self, game_id: str) -> GameActor | None:
+        """Start the actor of the game, None if the game is owned by another worker.
+
+        Raises:
+            GameIsNotCreated: the game is not found
+        """
+        async with self._lock:
+            if (actor := self._actors.get(game_id)) is not None:
+                return actor
+            try:
+                acquired = await self._acquire_script(
+                    keys=[game_lease_key(game_id)], args=[self.worker_id, int(self.lease_ttl * 1000)]
+                )
+            except RedisError as e:
+                raise ValueError(f"Failed to take game lease in Redis: {e}")
+            if not acquired:
+                return None
+            try:
+                if (latest := await self.redis_cache.get_latest_and_saved_seq(game_id)) is None:
+                    raise GameIsNotCreated("Game not found")
+                inbox = await self.dispatcher.subscribe(game_commands_channel(game_id))
+            except Exception:
+                await self._release(game_id)
+                raise
+            actor = self._actors[game_id] = GameActor(*latest, inbox)
+            actor.task = asyncio.create_task(self._run(actor), name=f"game-actor-{game_id}")
+            return actor
+
+    async def _run(self, actor: GameActor) -> None:
+        renew_interval = self.lease_ttl / 3
+        lost = changed = False
+        try:
+            stopping = False
+            while not stopping:
+                try:
+                    item = await asyncio.wait_for(actor.inbox.get(), timeout=renew_interval)
+                except asyncio.TimeoutError:
+                    item = None
+                now = time.monotonic()
+                if item is not None and item is not _STOP:
+                    batch = [item]
+                    while not actor.inbox.empty():
+                        if (item := actor.inbox.get_nowait()) is _STOP:
+                            break
+                        batch.append(item)
+                    # The rejected commands, e.g. the moves out of turn, do not keep the actor alive
+                    if await self._handle(actor, batch):
+                        actor.active_at = now
+                # Until the first move the lobby scripts may change the seats of the game, it is not kept
+                if (
+                    item is _STOP
+                    or actor.game.seq == 0
+                    or actor.game.board.is_finished
+                    or now - actor.active_at >= self.idle_timeout
+                ):
+                    stopping = True
+                elif now - actor.renewed_at >= renew_interval:
+                    await self._commit(actor, [])
+        except _GameChanged:
+            changed = True
+            logger.warning("The game %s is changed by another worker", actor.game.id)
+        except _LeaseLost:
+            lost = True
+            logger.warning("The game %s is owned by another worker", actor.game.id)
+        except Exception as e:
+            logger.error("The actor of the game %s failed: %s", actor.game.id, e, exc_info=True)
+        finally:
+            await self._close(actor, lost, changed)
+
+    async def _handle(self, actor: GameActor, batch: list) -> bool:
+        """Apply the commands and log their events in one round-trip, then reply.
+
+        Returns:
+            bool: True if any of the commands is applied
+        """
+        game = actor.game
+        was_finished = game.board.is_finished
+        backup = game.dump_bytes()
+        events, replies = [], []
+        for item in batch:
+            data = item.data if isinstance(item, _Command) else item
+            command_backup = actor.game.dump_bytes()
+            try:
+                if (handler := self._handlers.get(data.get("type"))) is None:
+                    raise BaseGameError("Unknown command")
+                messages, reply = await handler(actor.game, data)
+                events.extend(messages)
+                replies.append((item, reply, None))
+            except Exception as e:
+                # The failed command leaves the game as it was
+                actor.game = Game.load_bytes(command_backup)
+                if not isinstance(e, BaseGameError):
+                    logger.error("Failed to execute the command of the game %s: %s", game.id, e, exc_info=True)
+                replies.append((item, None, e))
+
+        try:
+            await self._commit(actor, events)
+        except _LeaseLost as e:
+            await self._reply(actor, [(item, None, e) for item, _, _ in replies])
+            raise
+        except Exception as e:
+            # The changes are not logged, so they are dropped
+            actor.game = Game.load_bytes(backup)
+            await self._reply(actor, [(item, None, e) for item, _, _ in replies])
+            raise
+
+        await self._reply(actor, replies)
+        if not was_finished and actor.game.board.is_finished and self.on_finish is not None:
+            try:
+                await self.on_finish(actor.game)
+            except Exception as e:
+                logger.error("Failed to finish the game %s: %s", actor.game.id, e, exc_info=True)
+        return any(error is None for _, _, error in replies)
+
+    async def _commit(self, actor: GameActor, events: list[bytes]) -> None:
+        game = actor.game
+        snapshot = b""
+        if game.seq != actor.saved_seq and (
+            actor.saved_seq == 0 or game.seq - actor.saved_seq >= self.snapshot_moves or game.board.is_finished
+        ):
+            # The first move is saved, so the game is not in the lobby anymore, e.g. it can't be left
+            snapshot = game.dump_bytes()
+        try:
+            result = await self._commit_script(
+                keys=[game_lease_key(game.id), game.id, game_log_key(game.id), game_channel(game.id)],
+                args=[
+                    self.worker_id,
+                    int(self.lease_ttl * 1000),
+                    RedisCache.game_log_length,
+                    RedisCache.game_ttl,
+                    *_saved_game_version(game, actor.saved_seq),
+                    snapshot,
+                    *events,
+                ],
+            )
+        except RedisError as e:
+            raise ValueError(f"Failed to save game to Redis: {e}")
+        if result == -2:
+            raise _GameChanged()
+        if result == -1:
+            raise _LeaseLost()
+        actor.renewed_at = time.monotonic()
+        if snapshot:
+            actor.saved_seq = game.seq
+
+    async def _reply(self, actor: GameActor, replies: list[tuple]) -> None:
+        forwarded = []
+        for item, reply, error in replies:
+            if isinstance(item, _Command):
+                if item.done.done():
+                    continue
+                if error is None:
+                    item.done.set_result(reply)
+                else:
+                    item.done.set_exception(error)
+            elif "replyTo" in item and "requestId" in item:
+                if isinstance(error, _LeaseLost):
+                    # The sender sends the command again once the new owner takes the game
+                    continue
+                message = {"requestId": item["requestId"]}
+                if error is None:
+                    message["result"] = reply
+                else:
+                    message["error"] = type(error).__name__
+                    message["message"] = getattr(error, "message", str(error))
+                forwarded.append((worker_replies_channel(item["replyTo"]), orjson.dumps(message)))
+        if not forwarded:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for channel, message in forwarded:
+                    pipe.publish(channel, message)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Failed to reply to the commands of the game %s: %s", actor.game.id, e)
+
+    async def _close(self, actor: GameActor, lost: bool, changed: bool = False) -> None:
+        game_id = actor.game.id
+        async with self._lock:
+            if self._actors.get(game_id) is actor:
+                del self._actors[game_id]
+            await self.dispatcher.unsubscribe(game_commands_channel(game_id), actor.inbox)
+            if not lost:
+                # The changed game is not overwritten, the next command loads it anew
+                snapshot = actor.game.dump_bytes() if not changed and actor.game.seq != actor.saved_seq else b""
+                await self._release(game_id, snapshot, _saved_game_version(actor.game, actor.saved_seq))
+        # The local commands received after the actor has stopped are sent again, the forwarded ones are sent again
+        # by their senders on the timeout
+        while not actor.inbox.empty():
+            if isinstance(item := actor.inbox.get_nowait(), _Command) and not item.done.done():
+                item.done.set_exception(_LeaseLost())
+
+    async def _release(
+        self, game_id: str, snapshot: bytes = b"", version: tuple[bytes, bytes] = (b"", b"")
+    ) -> None:
+        """Release the lease of the game, the snapshot is saved if the saved game has the version, see `_commit`."""
+        try:
+            await self._release_script(
+                keys=[game_lease_key(game_id), game_id], args=[self.worker_id, *version, snapshot]
+            )
+        except RedisError as e:
+            logger.warning("Failed to release the lease of the game %s: %s", game_id, e)
+
+    async def _forward(self, game_id: str, data: dict, deadline: float) -> dict | None:
+        """Send the command to the worker owning the game.
+
+        Returns:
+            dict | None: reply, None if there is no reply in time, e.g. the owner has stopped
+        """
+        loop = asyncio.get_running_loop()
+        request_id = uuid4().hex
+        future = self._pending[request_id] = loop.create_future()
+        try:
+            message = orjson.dumps({**data, "requestId": request_id, "replyTo": self.worker_id})
+            if not await self.redis.publish(game_commands_channel(game_id), message):
+                return None
+            reply = await asyncio.wait_for(future, timeout=max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            return None
+        except RedisError as e:
+            raise ValueError(f"Failed to forward game command to Redis: {e}")
+        finally:
+            self._pending.pop(request_id, None)
+        if "error" in reply:
+            raise _REPLIED_ERRORS.get(reply["error"], BaseGameError)(reply.get("message", ""))
+        return reply.get("result") or {}
+
+    async def _read_replies(self) -> None:
+        while True:
+            reply = await self._replies.get()
+            if isinstance(reply, dict) and (future := self._pending.get(reply.get("requestId"))) is not None:
+                if not future.done():
+                    future.set_result(reply)
+
+
+game_actors = GameActors()
@@ -1,15 +1,18 @@
 import logging
+from dataclasses import dataclass
 
 import orjson
 from redis.asyncio import Redis
 from sqlalchemy import delete
 
+from app.cache.game_actors import GameActors, game_actors
 from app.cache.redis import RedisCache, RedisManager
-from app.exceptions import BaseGameError, GameIsNotCreated
+from app.cache.ttl_cache import TTLCache
+from app.exceptions import BaseGameError, GameIsBusy, GameIsNotCreated
 from app.helpers import is_valid_uuid
-from app.operations.statistic import get_statistic
-from app.schemas import Game, GameCreate
-from app.schemas.game import GameRead
+from app.operations.statistic import get_statistic, update_game_statistic, update_statistic
+from app.schemas import Game, GameCreate, Player
+from app.schemas.game import BOT_PLAYER_ID, GameRead, GameState
 from app.settings import settings
 from app.websockets.helper import WebsocketMessageType
 from database.models import User
@@ -17,78 +20,132 @@ from database.models import User
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True, slots=True)
+class LobbyPage:
+    """Page of the lobby rendered once for the lobby version."""
+
+    version: int
+    games: bytes
+    next_cursor: str | None
+
+    def render(self, username: str) -> bytes:
+        """`GameListRead` JSON of the user."""
+        return b"".join(
+            (
+                b'{"gamesList":',
+                self.games,
+                b',"userName":',
+                orjson.dumps(username),
+                b',"nextCursor":',
+                orjson.dumps(self.next_cursor),
+                b"}",
+            )
+        )
+
+
 class GamesCacheManager:
     error_message = "Incorrect data has been transmitted, it is necessary to transfer the instance of `Game` class"
     _redis_cache = RedisCache()
     _redis_manager = RedisManager()
 
-    def __init__(self):
-        self._user_has_game = set()
+    def __init__(self, actors: GameActors = game_actors):
+        # Moves are applied by the worker owning the game
+        self._actors = actors
+        self._actors.register("move", self._move)
+        self._actors.register("botMove", self._bot_move)
+        self._actors.on_finish = self._on_game_finished
+        # (lobby version, cursor, limit) -> LobbyPage
+        self._lobby_pages = TTLCache(maxsize=settings.LOBBY_PAGE_CACHE_SIZE, ttl=RedisCache.game_ttl)
 
     async def get(self, game_id: str) -> Game | None:
         try:
-            return await self._redis_cache.get(game_id)
+            return await self._actors.get(game_id)
         except Exception as e:
             logger.error("Failed to get game: %s", e, exc_info=True)
             return None
 
+    async def load_scripts(self) -> None:
+        await self._redis_cache.load_scripts()
+
     async def close_game(self, uid: str, user_id: str) -> bool:
         try:
-            game: Game | None = await self._redis_cache.get(uid)
-            if game is None or game.first_player.id != f"{user_id}":
-                return False
-            await self._redis_cache.delete(uid)
-            self._user_has_game.remove(game.first_player.id)
-            await self._redis_manager.publish_to_channel(
-                channel=settings.REDIS_CHANNEL,
-                message=orjson.dumps({"type": WebsocketMessageType.GAME_DELETED, "gameId": uid}),
+            return await self._redis_cache.close(
+                uid, f"{user_id}", orjson.dumps({"type": WebsocketMessageType.GAME_DELETED, "gameId": uid})
             )
-            return True
         except Exception as e:
             logger.error("Failed to close game: %s", e, exc_info=True)
             return False
 
     async def create_game(self, user: User, game_data: GameCreate) -> Game:
         try:
-            if user is not None and user.id in self._user_has_game:
+            game = Game.create(user, game_data)
+            message = orjson.dumps({"type": WebsocketMessageType.GAME_ADDED, "game": game.dump_model_json()})
+            if not await self._redis_cache.create(game, message):
                 raise GameIsNotCreated("You already have a game created")
+            return game
+        except GameIsNotCreated:
+            raise
+        except Exception as e:
+            logger.error("Failed to create game: %s", e, exc_info=True)
+            raise GameIsNotCreated("Failed to create game")
+
+    async def create_bot_game(self, user: User, game_data: GameCreate) -> Game:
+        """Create the game against the built-in bot. Such games are not published to the lobby."""
+        try:
             game = Game.create(user, game_data)
+            game.join_bot()
             await self._redis_cache.set(game.id, game)
-            self._user_has_game.add(user.id)
-            await self._redis_manager.publish_to_channel(
-                channel=settings.REDIS_CHANNEL,
-                message=orjson.dumps({"type": WebsocketMessageType.GAME_ADDED, "game": game.dump_model_json()}),
-            )
             return game
         except Exception as e:
-            logger.error("Failed to create game: %s", e, exc_info=True)
+            logger.error("Failed to create bot game: %s", e, exc_info=True)
             raise GameIsNotCreated("Failed to create game")
 
+    async def create_match_games(
+        self, pairs: list[tuple[Player, Player]], games_ids: list[str] | None = None
+    ) -> list[Game]:
+        """Create the games of the players paired by the matchmaking and notify them, in one round-trip.
+
+        The first player of a pair plays X. The games are not published to the lobby, they already have both players.
+
+        Args:
+            pairs (list[tuple[Player, Player]]): matched players
+            games_ids (list[str] | None): ids of the games of the pairs, the games which already exist are neither
+                created nor announced again, so the creation may be retried. New ids if None.
+
+        Returns:
+            list[Game]: the games of the pairs
+        """
+        games = []
+        for index, (first, second) in enumerate(pairs):
+            game_data = GameCreate(gameName=f"{first.username} vs {second.username}", currentPlayerItem=first.item)
+            game = Game.create(first, game_data)
+            if games_ids is not None:
+                game.id = games_ids[index]
+            await game.join_player(second)
+            message = orjson.dumps(
+                {"type": WebsocketMessageType.MATCH_FOUND, "gameId": game.id, "playersIds": [first.id, second.id]}
+            )
+            games.append((game, message))
+        await self._redis_cache.create_many(games)
+        return [game for game, _ in games]
+
     async def join_game(self, user: User, game_id: str):
         try:
-            game: Game | None = await self._redis_cache.get(game_id)
-            if game is None or not game.is_active:
-                raise GameIsNotCreated("Game not found")
-            if game.first_player.id == user.id:
-                raise GameIsNotCreated("You are the creator of the game")
-            await game.join_player(user)
-            await self._redis_cache.set(game_id, game)
-            await self._redis_manager.publish_to_channel(
-                channel=settings.REDIS_CHANNEL,
-                message=orjson.dumps({"type": WebsocketMessageType.GAME_JOINED, "gameId": game.id}),
-            )
-            # Send invite to the first player
+            # Read before the join, so the game is changed and both messages are published in one round-trip
             statistic = await get_statistic(user.id)
-            data = {
-                "type": WebsocketMessageType.GAME_INVITE,
-                "gameId": game_id,
-                "targetPlayer": game.first_player.username,
-                "senderPlayer": game.second_player.username,
-                "stats": statistic.model_dump(),
-            }
-            await RedisManager.publish_message(settings.REDIS_CHANNEL, orjson.dumps(data))
+            joined = orjson.dumps({"type": WebsocketMessageType.GAME_JOINED, "gameId": game_id})
+            # Send invite to the first player
+            invite = orjson.dumps(
+                {
+                    "type": WebsocketMessageType.GAME_INVITE,
+                    "gameId": game_id,
+                    "senderPlayer": user.username,
+                    "stats": statistic.model_dump(),
+                }
+            )
+            game = await self._redis_cache.join(game_id, f"{user.id}", user.username, joined, invite)
             return game.second_player.item
-        except GameIsNotCreated as e:
+        except (GameIsNotCreated, GameIsBusy) as e:
             raise e
         except Exception as e:
             logger.error("Failed to join game: %s", e, exc_info=True)
@@ -96,22 +153,104 @@ class GamesCacheManager:
 
     async def left_game(self, user: User, game_id: str):
         try:
-            game: Game | None = await self._redis_cache.get(game_id)
-            if game is None or game.second_player.id != user.id:
-                raise GameIsNotCreated("You are not in this game")
-            await game.leave_player(user)
-            await self._redis_cache.set(game_id, game)
-            await self._redis_manager.publish_to_channel(
-                channel=settings.REDIS_CHANNEL,
-                message=orjson.dumps({"type": WebsocketMessageType.GAME_LEFT, "game": game.model_dump()}),
+            await self._redis_cache.leave(
+                game_id, f"{user.id}", orjson.dumps({"type": WebsocketMessageType.GAME_LEFT})
             )
             return True
+        except (GameIsNotCreated, GameIsBusy) as e:
+            raise e
         except Exception as e:
             logger.error("Failed to left game: %s", e, exc_info=True)
             raise BaseGameError("Failed to left game")
 
-    async def get_games_info_data(self) -> list[GameRead]:
-        return await self._redis_cache.get_active_games()
+    async def make_move(self, game_id: str, user: User, cell_index: int) -> GameState:
+        """Make the move and the bot's answer, if it is a bot game, and publish them to the channel of the game.
+
+        Raises:
+            GameIsNotCreated: the game is not found
+            MoveIsNotAllowed: the move is not allowed
+            GameIsFinished: the game is already finished
+            GameIsBusy: the worker owning the game is not available
+        """
+        reply = await self._actors.execute(game_id, {"type": "move", "userId": f"{user.id}", "cellIndex": cell_index})
+        return GameState(**reply["gameState"])
+
+    async def make_bot_move(self, game_id: str) -> None:
+        """Make the bot's move if it is its turn, e.g. the opening move when the bot plays X."""
+        await self._actors.execute(game_id, {"type": "botMove"})
+
+    async def _move(self, game: Game, command: dict) -> tuple[list[bytes], dict]:
+        cell_index = command["cellIndex"]
+        game_state = game.player_id_set_item(command["userId"], cell_index)
+        messages = [self._game_state_message(game, cell_index, game_state)]
+        if not game_state.finished and game.is_bot_turn:
+            bot_cell_index, game_state = await game.bot_set_item()
+            messages.append(self._game_state_message(game, bot_cell_index, game_state))
+        return messages, {"gameState": game_state.to_dict()}
+
+    async def _bot_move(self, game: Game, command: dict) -> tuple[list[bytes], dict]:
+        if not game.is_bot_turn:
+            return [], {}
+        cell_index, game_state = await game.bot_set_item()
+        return [self._game_state_message(game, cell_index, game_state)], {}
+
+    async def publish_game_event(self, game_id: str, data: dict) -> None:
+        """Log the event of the game, e.g. a chat message, and publish it to the channel of the game."""
+        # The id is assigned by the log
+        data.pop("eventId", None)
+        await self._redis_cache.append_events(game_id, [orjson.dumps(data)])
+
+    async def get_game_events(self, game_id: str, after: str | None = None) -> list[dict]:
+        return await self._redis_cache.get_events(game_id, after)
+
+    @staticmethod
+    def _game_state_message(game: Game, cell_index: int, game_state: GameState) -> bytes:
+        return orjson.dumps(
+            {
+                "type": "gameState",
+                "gameId": game.id,
+                "cellIndex": cell_index,
+                "item": game.board.item_at(cell_index),
+                "seq": game.seq,
+                "gameState": game_state.to_dict(),
+            }
+        )
+
+    async def _on_game_finished(self, game: Game) -> None:
+        await self.finish_game(game, game.state)
+
+    async def finish_game(self, game: Game, game_state: GameState) -> None:
+        """Count the finished game in the statistic of the players. The games of two users are rated."""
+        if game.second_player is not None and not game.is_bot_game:
+            await update_game_statistic(game.id, game.first_player.id, game.second_player.id, game_state.winner)
+        else:
+            for player in game.players_state.values():
+                if player.id == BOT_PLAYER_ID:
+                    continue
+                winner = game_state.winner is not None and game_state.winner == player.id
+                looses = game_state.winner is not None and game_state.winner != player.id
+                await update_statistic(player.id, winner=winner, looses=looses)
+        if game.is_bot_game:
+            return
+        # The creator may create a new game. The game is counted already, so a failed release is only logged, the
+        # creator may create a new game once this one expires
+        try:
+            await self._redis_cache.release_owner(game.id, game.first_player.id)
+        except ValueError as e:
+            logger.warning("Failed to release the owner of the game %s: %s", game.id, e)
+
+    async def get_games_info_data(self, cursor: str | None, limit: int) -> tuple[list[GameRead], str | None]:
+        return await self._redis_cache.get_active_games(cursor, limit)
+
+    async def get_lobby_page(self, cursor: str | None, limit: int) -> LobbyPage:
+        """Page of the lobby for the current lobby version, it is rendered once per version in the worker."""
+        version = await self._redis_cache.get_lobby_version()
+        key = (version, cursor, limit)
+        if (page := self._lobby_pages.get(key)) is None:
+            games, next_cursor = await self._redis_cache.get_active_games(cursor, limit)
+            page = LobbyPage(version, orjson.dumps([game.model_dump() for game in games]), next_cursor)
+            self._lobby_pages.set(key, page)
+        return page
 
 
 game_cache_manager = GamesCacheManager()
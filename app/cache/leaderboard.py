@@ -0,0 +1,205 @@
+from typing import AsyncIterator
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.cache.redis import redis
+from app.schemas import LeaderboardEntry
+
+# KEYS: board, ids; ARGV: username
+# Returns: [rank, rating] or nil when the user is not on the board
+_RANK_SCRIPT = """
+local user_id = redis.call('HGET', KEYS[2], ARGV[1])
+if not user_id then
+    return nil
+end
+local rank = redis.call('ZREVRANK', KEYS[1], user_id)
+if not rank then
+    return nil
+end
+return {rank, redis.call('ZSCORE', KEYS[1], user_id)}
+"""
+
+# Sets the ratings of the users. While the board is rebuilt, the updates are recorded too, they are applied to the
+# rebuilt board before it is swapped in, see `_SWAP_SCRIPT`.
+# KEYS: board, names, ids, recorded ratings, recorded names, rebuild marker
+# ARGV: user id, username, rating, ... three per user
+_UPDATE_SCRIPT = """
+local recording = redis.call('EXISTS', KEYS[6]) == 1
+for i = 1, #ARGV, 3 do
+    redis.call('ZADD', KEYS[1], ARGV[i + 2], ARGV[i])
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+    redis.call('HSET', KEYS[3], ARGV[i + 1], ARGV[i])
+    if recording then
+        redis.call('ZADD', KEYS[4], ARGV[i + 2], ARGV[i])
+        redis.call('HSET', KEYS[5], ARGV[i], ARGV[i + 1])
+    end
+end
+return #ARGV / 3
+"""
+
+# Applies the updates recorded during the rebuild to the rebuilt board and swaps it in.
+# KEYS: rebuilt board, names, ids, board, names, ids, recorded ratings, recorded names, rebuild marker
+# Returns: number of the users on the new board
+_SWAP_SCRIPT = """
+local recorded = redis.call('ZRANGE', KEYS[7], 0, -1, 'WITHSCORES')
+for i = 1, #recorded, 2 do
+    local username = redis.call('HGET', KEYS[8], recorded[i])
+    redis.call('ZADD', KEYS[1], recorded[i + 1], recorded[i])
+    redis.call('HSET', KEYS[2], recorded[i], username)
+    redis.call('HSET', KEYS[3], username, recorded[i])
+end
+local count = redis.call('ZCARD', KEYS[1])
+for i = 1, 3 do
+    if count > 0 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 3])
+    else
+        redis.call('DEL', KEYS[i + 3])
+    end
+end
+redis.call('DEL', KEYS[7], KEYS[8], KEYS[9])
+return count
+"""
+
+# KEYS: board, names, ids; ARGV: user id, new username or '' to remove the user
+_RENAME_SCRIPT = """
+local username = redis.call('HGET', KEYS[2], ARGV[1])
+if not username then
+    return 0
+end
+redis.call('HDEL', KEYS[3], username)
+if ARGV[2] == '' then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[1], ARGV[1])
+else
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    redis.call('HSET', KEYS[3], ARGV[2], ARGV[1])
+end
+return 1
+"""
+
+
+class Leaderboard:
+    """Users ranked by the rating.
+
+    The ``board_key`` sorted set maps the user ids to the ratings, so a rank is a single ZREVRANK. The usernames are
+    kept in the ``names_key`` (id -> username) and ``ids_key`` (username -> id) hashes.
+
+    The board is rebuilt in the keys with ``rebuild_suffix`` and swapped in. While the ``rebuild_marker_key`` exists
+    the updates are recorded, so the ratings updated during the rebuild are not lost by the swap.
+    """
+
+    board_key = "leaderboard"
+    names_key = "leaderboard:names"
+    ids_key = "leaderboard:ids"
+    rebuild_suffix = ":rebuild"
+    recorded_ratings_key = "leaderboard:recorded"
+    recorded_names_key = "leaderboard:recorded:names"
+    rebuild_marker_key = "leaderboard:rebuilding"
+    # Seconds the updates are recorded after the last rebuilt chunk, e.g. when the rebuilding worker has crashed
+    rebuild_timeout = 600
+
+    def __init__(self, redis_client: Redis = redis):
+        self.redis = redis_client
+        self._rank_script = self.redis.register_script(_RANK_SCRIPT)
+        self._rename_script = self.redis.register_script(_RENAME_SCRIPT)
+        self._update_script = self.redis.register_script(_UPDATE_SCRIPT)
+        self._swap_script = self.redis.register_script(_SWAP_SCRIPT)
+
+    @property
+    def _keys(self) -> list[str]:
+        return [self.board_key, self.names_key, self.ids_key]
+
+    @property
+    def _recording_keys(self) -> list[str]:
+        return [self.recorded_ratings_key, self.recorded_names_key, self.rebuild_marker_key]
+
+    async def update(self, entries: dict[str, tuple[str, float]]) -> None:
+        """Set the ratings of the users.
+
+        Args:
+            entries (dict[str, tuple[str, float]]): user id -> (username, rating)
+        """
+        if not entries:
+            return
+        args = [value for user_id, (username, rating) in entries.items() for value in (user_id, username, rating)]
+        try:
+            await self._update_script(keys=[*self._keys, *self._recording_keys], args=args)
+        except RedisError as e:
+            raise ValueError(f"Failed to update leaderboard in Redis: {e}")
+
+    async def rename(self, user_id: str, username: str) -> None:
+        try:
+            await self._rename_script(keys=self._keys, args=[user_id, username])
+        except RedisError as e:
+            raise ValueError(f"Failed to rename user in leaderboard in Redis: {e}")
+
+    async def remove(self, user_id: str) -> None:
+        try:
+            await self._rename_script(keys=self._keys, args=[user_id, ""])
+        except RedisError as e:
+            raise ValueError(f"Failed to remove user from leaderboard in Redis: {e}")
+
+    async def top(self, offset: int, limit: int) -> tuple[list[LeaderboardEntry], int]:
+        """Page of the leaderboard, the highest rating first.
+
+        Returns:
+            tuple[list[LeaderboardEntry], int]: entries and the number of the users on the board
+        """
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zrevrange(self.board_key, offset, offset + limit - 1, withscores=True)
+                pipe.zcard(self.board_key)
+                ranked, total = await pipe.execute()
+            if not ranked:
+                return [], total
+            usernames = await self.redis.hmget(self.names_key, [user_id for user_id, _ in ranked])
+        except RedisError as e:
+            raise ValueError(f"Failed to get leaderboard from Redis: {e}")
+        entries = [
+            LeaderboardEntry(rank=offset + index + 1, username=(username or b"").decode(), rating=rating)
+            for index, ((_, rating), username) in enumerate(zip(ranked, usernames))
+        ]
+        return entries, total
+
+    async def rank(self, username: str) -> LeaderboardEntry | None:
+        """Rank of the user, None if the user is not on the board."""
+        try:
+            result = await self._rank_script(keys=[self.board_key, self.ids_key], args=[username])
+        except RedisError as e:
+            raise ValueError(f"Failed to get rank from Redis: {e}")
+        if result is None:
+            return None
+        rank, rating = result
+        return LeaderboardEntry(rank=rank + 1, username=username, rating=float(rating))
+
+    async def replace(self, chunks: AsyncIterator[list[tuple[str, str, float]]]) -> int:
+        """Rebuild the board from the chunks of (user id, username, rating) and swap it in atomically.
+
+        The ratings updated since the rebuild has started are applied to the new board before the swap.
+
+        Returns:
+            int: number of the users on the new board
+        """
+        rebuild_keys = [f"{key}{self.rebuild_suffix}" for key in self._keys]
+        board, names, ids = rebuild_keys
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(*rebuild_keys, self.recorded_ratings_key, self.recorded_names_key)
+                pipe.set(self.rebuild_marker_key, 1, ex=self.rebuild_timeout)
+                await pipe.execute()
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.zadd(board, {user_id: rating for user_id, _, rating in chunk})
+                    pipe.hset(names, mapping={user_id: username for user_id, username, _ in chunk})
+                    pipe.hset(ids, mapping={username: user_id for user_id, username, _ in chunk})
+                    pipe.expire(self.rebuild_marker_key, self.rebuild_timeout)
+                    await pipe.execute()
+            return await self._swap_script(keys=[*rebuild_keys, *self._keys, *self._recording_keys])
+        except RedisError as e:
+            raise ValueError(f"Failed to rebuild leaderboard in Redis: {e}")
+
+
+leaderboard = Leaderboard()
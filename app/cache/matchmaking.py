@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import math
+import time
+from uuid import NAMESPACE_URL, uuid5
+
+import orjson
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.cache.game_cache import GamesCacheManager, game_cache_manager
+from app.cache.redis import redis
+from app.exceptions import MatchmakingError
+from app.helpers import GameItems
+from app.operations.statistic import get_statistic
+from app.schemas import MatchmakingTicket, Player, UserStatisticRead
+from app.settings import settings
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+# KEYS: tickets, bucket; ARGV: user id, ticket, enqueue time in ms
+_ENQUEUE_SCRIPT = """
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+    return 0
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+return 1
+"""
+
+# KEYS: tickets, buckets; ARGV: user id
+_CANCEL_SCRIPT = """
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+end
+return 1
+"""
+
+# Pops the pairs of the players, the longest waiting first. A player waiting alone in the bucket for `widen` ms
+# is paired with the player waiting alone in the neighbour bucket. The expired tickets are dropped.
+# KEYS: tickets, buckets in the skill order; ARGV: max pairs, now in ms, widen in ms, expiration time in ms
+# Returns: [user id, ticket, user id, ticket, ...], two players per pair
+_MATCH_SCRIPT = """
+local max_items = tonumber(ARGV[1]) * 4
+local now = tonumber(ARGV[2])
+local widen = tonumber(ARGV[3])
+local matched = {}
+local function take(member)
+    table.insert(matched, member)
+    table.insert(matched, redis.call('HGET', KEYS[1], member) or '')
+    redis.call('HDEL', KEYS[1], member)
+end
+
+local alone = nil
+for i = 2, #KEYS do
+    if #matched >= max_items then
+        break
+    end
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[i], '-inf', '(' .. ARGV[4], 'LIMIT', 0, 1000)
+    if #expired > 0 then
+        redis.call('ZREM', KEYS[i], unpack(expired))
+        redis.call('HDEL', KEYS[1], unpack(expired))
+    end
+    while #matched < max_items and redis.call('ZCARD', KEYS[i]) >= 2 do
+        local popped = redis.call('ZPOPMIN', KEYS[i], 2)
+        take(popped[1])
+        take(popped[3])
+    end
+    local first = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+    if #first == 0 then
+        alone = nil
+    elseif alone and #matched < max_items and now - math.min(alone[3], tonumber(first[2])) >= widen then
+        redis.call('ZREM', alone[1], alone[2])
+        redis.call('ZREM', KEYS[i], first[1])
+        take(alone[2])
+        take(first[1])
+        alone = nil
+    else
+        alone = {KEYS[i], first[1], tonumber(first[2])}
+    end
+end
+return matched
+"""
+
+
+class MatchmakingQueue:
+    """Quick-match queue shared by all the workers.
+
+    Players wait in the sorted sets of the skill buckets scored by the enqueue time, the tickets are kept in the
+    ``tickets_key`` hash. Pairs are popped by a single script, so concurrent matchers never pair a player twice.
+    """
+
+    tickets_key = "matchmaking:tickets"
+    bucket_prefix = "matchmaking:bucket:"
+    bucket_width = 100
+
+    def __init__(self, redis_client: Redis = redis, buckets: int = settings.MATCHMAKING_BUCKETS):
+        self.redis = redis_client
+        self.buckets = buckets
+        self.buckets_keys = [f"{self.bucket_prefix}{bucket}" for bucket in range(buckets)]
+        self._enqueue_script = self.redis.register_script(_ENQUEUE_SCRIPT)
+        self._cancel_script = self.redis.register_script(_CANCEL_SCRIPT)
+        self._match_script = self.redis.register_script(_MATCH_SCRIPT)
+
+    def bucket_of(self, statistic: UserStatisticRead) -> int:
+        """Skill bucket by the rating, `bucket_width` rating points per bucket. New players start in the middle."""
+        bucket = self.buckets // 2 + math.floor((statistic.rating - settings.RATING_INITIAL) / self.bucket_width)
+        return min(max(bucket, 0), self.buckets - 1)
+
+    async def enqueue(self, user_id: str, username: str, bucket: int) -> MatchmakingTicket | None:
+        """Put the player into the queue.
+
+        Returns:
+            MatchmakingTicket | None: the ticket, None if the player is already in the queue
+        """
+        ticket = MatchmakingTicket(username=username, bucket=bucket, queuedAt=time.time_ns() // 1_000_000)
+        try:
+            added = await self._enqueue_script(
+                keys=[self.tickets_key, self.buckets_keys[bucket]],
+                args=[user_id, orjson.dumps(ticket.model_dump()), ticket.queuedAt],
+            )
+        except RedisError as e:
+            raise ValueError(f"Failed to enqueue player to Redis: {e}")
+        return ticket if added else None
+
+    async def cancel(self, user_id: str) -> bool:
+        try:
+            return bool(await self._cancel_script(keys=[self.tickets_key, *self.buckets_keys], args=[user_id]))
+        except RedisError as e:
+            raise ValueError(f"Failed to cancel matchmaking in Redis: {e}")
+
+    async def pop_pairs(
+        self,
+        max_pairs: int,
+        widen_after: float = settings.MATCHMAKING_WIDEN_AFTER,
+        tickets: dict[str, bytes] | None = None,
+    ) -> list[tuple[Player, Player]]:
+        """Pop up to `max_pairs` pairs of the players. The first player of a pair has waited longer and plays X.
+
+        Args:
+            max_pairs (int): max number of the pairs
+            widen_after (float): seconds after which a player waiting alone is paired with the neighbour bucket
+            tickets (dict[str, bytes] | None): filled with the tickets of the popped players by the user id, e.g.
+                to requeue them
+        """
+        now = time.time_ns() // 1_000_000
+        expire_before = now - int(settings.MATCHMAKING_TICKET_TTL * 1000)
+        try:
+            matched = await self._match_script(
+                keys=[self.tickets_key, *self.buckets_keys],
+                args=[max_pairs, now, int(widen_after * 1000), expire_before],
+            )
+        except RedisError as e:
+            raise ValueError(f"Failed to match players in Redis: {e}")
+
+        pairs = []
+        for index in range(0, len(matched), 4):
+            first_id, first_ticket, second_id, second_ticket = matched[index : index + 4]
+            if tickets is not None:
+                tickets[first_id.decode()] = first_ticket
+                tickets[second_id.decode()] = second_ticket
+            pairs.append(
+                (
+                    Player(id=first_id.decode(), username=_ticket_username(first_ticket), item=GameItems.X),
+                    Player(id=second_id.decode(), username=_ticket_username(second_ticket), item=GameItems.O),
+                )
+            )
+        return pairs
+
+    async def requeue(self, tickets: dict[str, bytes]) -> None:
+        """Put the popped players back with their tickets, they keep their place in the queue.
+
+        The players who have queued again meanwhile keep the new tickets.
+        """
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id, ticket in tickets.items():
+                    if not ticket:
+                        continue
+                    data = orjson.loads(ticket)
+                    await self._enqueue_script(
+                        keys=[self.tickets_key, self.buckets_keys[data["bucket"]]],
+                        args=[user_id, ticket, data["queuedAt"]],
+                        client=pipe,
+                    )
+                await pipe.execute()
+        except RedisError as e:
+            raise ValueError(f"Failed to requeue players to Redis: {e}")
+
+    async def size(self) -> int:
+        try:
+            return await self.redis.hlen(self.tickets_key)
+        except RedisError as e:
+            raise ValueError(f"Failed to get matchmaking queue size from Redis: {e}")
+
+
+def _ticket_username(ticket: bytes) -> str:
+    return orjson.loads(ticket)["username"] if ticket else ""
+
+
+def match_game_id(pair: tuple[Player, Player], tickets: dict[str, bytes]) -> str:
+    """Id of the game of the matched players, the same for every attempt to create the game of the same match."""
+    first, second = pair
+    name = b":".join((first.id.encode(), tickets.get(first.id, b""), second.id.encode(), tickets.get(second.id, b"")))
+    return f"{uuid5(NAMESPACE_URL, f'matchmaking:{name.decode()}')}"
+
+
+class Matchmaker:
+    """Background matcher of the worker.
+
+    Every `interval` seconds, or as soon as a player of this worker is queued, the pairs are popped from the queue
+    and a game is created for each of them. Both players are notified with the `matchFound` message of the lobby
+    channel. The games of a batch are created by one script, and one by one if it fails. The ids of the games are
+    derived from the tickets of the players, so a game created by the failed call, e.g. when only its reply is lost,
+    is not created twice. The players whose game is not created are put back into the queue, their tickets expire
+    as usual.
+    """
+
+    def __init__(
+        self,
+        queue: MatchmakingQueue | None = None,
+        games: GamesCacheManager = game_cache_manager,
+        interval: float = settings.MATCHMAKING_INTERVAL,
+        batch_size: int = settings.MATCHMAKING_BATCH_SIZE,
+    ):
+        self.queue = queue or MatchmakingQueue()
+        self.games = games
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def join(self, user: User) -> MatchmakingTicket:
+        """Put the player into the queue.
+
+        Raises:
+            MatchmakingError: the player is already in the queue
+        """
+        statistic = await get_statistic(user.id)
+        ticket = await self.queue.enqueue(f"{user.id}", user.username, self.queue.bucket_of(statistic))
+        if ticket is None:
+            raise MatchmakingError("You are already in the matchmaking queue")
+        self._wakeup.set()
+        return ticket
+
+    async def leave(self, user: User) -> bool:
+        return await self.queue.cancel(f"{user.id}")
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="matchmaker")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def match(self) -> int:
+        """Pair the queued players and create their games.
+
+        Returns:
+            int: number of the created games
+        """
+        created = 0
+        tickets: dict[str, bytes] = {}
+        while pairs := await self.queue.pop_pairs(self.batch_size, tickets=tickets):
+            games_ids = [match_game_id(pair, tickets) for pair in pairs]
+            try:
+                created += len(await self.games.create_match_games(pairs, games_ids))
+            except Exception as e:
+                # One failed call does not fail the whole batch
+                logger.warning("Failed to create the games of %d pairs, creating them one by one: %s", len(pairs), e)
+                failed = await self._create_one_by_one(pairs, games_ids)
+                created += len(pairs) - len(failed)
+                if failed:
+                    await self._requeue({player.id: tickets[player.id] for pair in failed for player in pair})
+                    break
+            tickets.clear()
+            if len(pairs) < self.batch_size:
+                break
+        return created
+
+    async def _create_one_by_one(
+        self, pairs: list[tuple[Player, Player]], games_ids: list[str]
+    ) -> list[tuple[Player, Player]]:
+        """Create the game of every pair by its own call, the games created already are kept as they are.
+
+        Returns:
+            list[tuple[Player, Player]]: the pairs whose games are not created
+        """
+        failed = []
+        for pair, game_id in zip(pairs, games_ids):
+            try:
+                await self.games.create_match_games([pair], [game_id])
+            except Exception as e:
+                logger.error("Failed to create the game of %s and %s: %s", pair[0].id, pair[1].id, e, exc_info=True)
+                failed.append(pair)
+        return failed
+
+    async def _requeue(self, tickets: dict[str, bytes]) -> None:
+        try:
+            await self.queue.requeue(tickets)
+        except ValueError as e:
+            logger.error("Lost the matched players %s: %s", list(tickets), e)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.match()
+            except Exception as e:
+                logger.error("Matchmaking failed: %s", e)
+
+
+matchmaker = Matchmaker()
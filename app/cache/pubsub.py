@@ -0,0 +1,124 @@
+import asyncio
+import logging
+
+import orjson
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+from redis.exceptions import RedisError
+
+from app.cache.redis import pubsub_redis
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriberQueue(asyncio.Queue):
+    """Bounded queue of a subscriber. Messages that do not fit are dropped and counted."""
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+
+class PubSubDispatcher:
+    """Single Redis subscription of the worker process.
+
+    Every message is decoded once and put into the in-memory queues of the local subscribers. The decoded message
+    is shared between the subscribers, so they must not modify it.
+
+    The `channels` are subscribed for the whole life of the dispatcher, any other channel is subscribed in Redis
+    while it has at least one local subscriber.
+    """
+
+    reconnect_delay = 1.0
+
+    def __init__(self, redis_client: Redis = pubsub_redis, channels: tuple[str, ...] = (settings.REDIS_CHANNEL,)):
+        self.redis = redis_client
+        self.channels = channels
+        self._subscribers: dict[str, set[SubscriberQueue]] = {channel: set() for channel in channels}
+        self._pubsub: PubSub | None = None
+        self._reader: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read(), name="pubsub-dispatcher")
+
+    async def stop(self) -> None:
+        if self._reader is None:
+            return
+        self._reader.cancel()
+        try:
+            await self._reader
+        except asyncio.CancelledError:
+            pass
+        self._reader = None
+
+    async def subscribe(self, channel: str, maxsize: int = 0) -> SubscriberQueue:
+        queue = SubscriberQueue(maxsize)
+        if (subscribers := self._subscribers.get(channel)) is None:
+            subscribers = self._subscribers[channel] = set()
+            await self._execute("subscribe", channel)
+        subscribers.add(queue)
+        return queue
+
+    async def unsubscribe(self, channel: str, queue: SubscriberQueue) -> None:
+        if (subscribers := self._subscribers.get(channel)) is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers and channel not in self.channels:
+            del self._subscribers[channel]
+            await self._execute("unsubscribe", channel)
+
+    async def _execute(self, command: str, channel: str) -> None:
+        # Without the connection the channels are subscribed by the reader when it connects
+        if self._pubsub is None:
+            return
+        try:
+            await getattr(self._pubsub, command)(channel)
+        except (RedisError, OSError) as e:
+            logger.warning("Failed to %s the channel %s: %s", command, channel, e)
+
+    def subscribers_count(self, channel: str) -> int:
+        return len(self._subscribers.get(channel, ()))
+
+    def dispatch(self, channel: str, data: dict) -> None:
+        for queue in self._subscribers.get(channel, ()):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                queue.dropped += 1
+
+    async def _read(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                channels = set(self._subscribers)
+                await pubsub.subscribe(*channels)
+                self._pubsub = pubsub
+                # Channels added while the connection was being established
+                if missing := set(self._subscribers) - channels:
+                    await pubsub.subscribe(*missing)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel = message["channel"]
+                    try:
+                        data = orjson.loads(message["data"])
+                    except orjson.JSONDecodeError:
+                        logger.warning("Invalid message received from the channel %s", channel)
+                        continue
+                    self.dispatch(channel if isinstance(channel, str) else channel.decode(), data)
+            except asyncio.CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                logger.error("Pub/sub connection lost: %s", e)
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                self._pubsub = None
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+pubsub_dispatcher = PubSubDispatcher()
@@ -1,11 +1,319 @@
+import time
+from typing import Awaitable, Callable
+from uuid import UUID
+
 import orjson
 from redis.asyncio import Redis
-from redis.exceptions import RedisError
+from redis.commands.core import AsyncScript
+from redis.exceptions import RedisError, WatchError
 
-from app.schemas.game import Game, GameRead
+from app.cache.redis_client import RedisMetrics, create_redis
+from app.exceptions import BaseGameError, GameIsBusy, GameIsNotCreated
+from app.helpers import GameItems
+from app.schemas.game import (
+    GAME_FLAG_ACTIVE,
+    GAME_FLAG_FIRST_ITEM_O,
+    GAME_FLAG_SECOND_PLAYER,
+    GAME_FORMAT_VERSION,
+    Game,
+    GameRead,
+)
 from app.settings import settings
 
-redis = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, decode_responses=True)
+redis = create_redis()
+# Pub/sub connections wait for the messages without a reply timeout, they are kept out of the commands pool
+pubsub_redis = create_redis(max_connections=4, socket_timeout=None, metrics=RedisMetrics())
+
+
+def game_channel(game_id: str) -> str:
+    """Channel of the moves and chat messages of a single game."""
+    return f"game:{game_id}:events"
+
+
+def game_log_key(game_id: str) -> str:
+    """Stream of all the events of a single game, the ids of the entries are the event ids."""
+    return f"game:{game_id}:log"
+
+
+def game_lease_key(game_id: str) -> str:
+    """Id of the worker owning the game, see `app.cache.game_actors`."""
+    return f"game:{game_id}:lease"
+
+
+def owner_key(user_id: str) -> str:
+    """Id of the lobby game created by the user, one per user across all the workers."""
+    return f"user:{user_id}:game"
+
+
+def lobby_cursor(score: float, game_id: str | bytes) -> str:
+    """Cursor of the lobby page starting after the game, `<creation time in us>:<game id>`."""
+    if isinstance(game_id, bytes):
+        game_id = game_id.decode()
+    return f"{int(score)}:{game_id}"
+
+
+def parse_lobby_cursor(cursor: str) -> tuple[int, str]:
+    """Score and game id of the lobby cursor, see `lobby_cursor`.
+
+    Raises:
+        ValueError: the cursor is invalid
+    """
+    score, separator, game_id = cursor.partition(":")
+    if not separator or not game_id:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return int(score), game_id
+
+
+def parse_event_id(event_id: str | bytes) -> tuple[int, int]:
+    """Make the stream entry id `<ms>-<seq>` comparable.
+
+    Raises:
+        ValueError: the id is not a stream entry id
+    """
+    if isinstance(event_id, bytes):
+        event_id = event_id.decode()
+    milliseconds, _, sequence = event_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+# Appends the events to the log of the game and publishes them with the ids of the log entries, so the order
+# of the published events is the order of the log.
+# KEYS: log, channel; ARGV: max log length, log TTL, events (JSON objects)
+_APPEND_EVENTS_SCRIPT = """
+for i = 3, #ARGV do
+    local event_id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'event', ARGV[i])
+    redis.call('PUBLISH', KEYS[2], '{"eventId":"' .. event_id .. '",' .. string.sub(ARGV[i], 2))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return #ARGV - 2
+"""
+
+
+# Reading and writing of the binary game format, see `app.schemas.game`, shared by the scripts changing the games
+_GAME_FORMAT_LUA = (
+    f"""
+local GAME_FORMAT_VERSION = {GAME_FORMAT_VERSION}
+local GAME_FLAG_ACTIVE = {GAME_FLAG_ACTIVE}
+local GAME_FLAG_SECOND_PLAYER = {GAME_FLAG_SECOND_PLAYER}
+local GAME_FLAG_FIRST_ITEM_O = {GAME_FLAG_FIRST_ITEM_O}
+"""
+    + """
+local function read_string(data, offset)
+    local length = string.byte(data, offset) * 256 + string.byte(data, offset + 1)
+    return string.sub(data, offset + 2, offset + 1 + length), offset + 2 + length
+end
+
+-- The flags are single bits of the byte
+local function has_flag(flags, flag)
+    return math.floor(flags / flag) % 2 == 1
+end
+
+local function with_flag(flags, flag, value)
+    if has_flag(flags, flag) == value then
+        return flags
+    end
+    return value and flags + flag or flags - flag
+end
+
+local function pack_string(value)
+    return string.char(math.floor(#value / 256), #value % 256) .. value
+end
+
+-- nil for the games in the legacy JSON format
+local function parse_game(data)
+    if string.byte(data, 1) ~= GAME_FORMAT_VERSION then
+        return nil
+    end
+    local game = {flags = string.byte(data, 2), first_id = string.sub(data, 27, 42)}
+    local offset
+    game.name, offset = read_string(data, 43)
+    game.first_username, offset = read_string(data, offset)
+    game.second_offset = offset
+    if has_flag(game.flags, GAME_FLAG_SECOND_PLAYER) then
+        game.second_id = string.sub(data, offset, offset + 15)
+        game.second_username = read_string(data, offset + 16)
+    end
+    return game
+end
+
+local function with_flags(data, flags, players_end)
+    return string.sub(data, 1, 1) .. string.char(flags) .. string.sub(data, 3, players_end)
+end
+
+-- `GameRead` JSON of the game
+local function read_model(game_id, game, flags)
+    local first_item, second_item = 'X', 'O'
+    if has_flag(flags, GAME_FLAG_FIRST_ITEM_O) then
+        first_item, second_item = 'O', 'X'
+    end
+    local has_second = has_flag(flags, GAME_FLAG_SECOND_PLAYER)
+    return cjson.encode({
+        id = game_id,
+        gameName = game.name,
+        currentPlayerName = game.first_username,
+        secondPlayerName = has_second and game.second_username or cjson.null,
+        currentPlayerItem = first_item,
+        secondPlayerItem = has_second and second_item or cjson.null,
+        isActive = has_flag(flags, GAME_FLAG_ACTIVE),
+    })
+end
+"""
+)
+
+# Codes returned by the game scripts instead of the game
+_GAME_LEGACY_FORMAT = -1
+_GAME_NOT_FOUND = 0
+_GAME_NOT_ALLOWED = 1
+_GAME_BUSY = 2
+
+# Saves the new lobby game unless its creator already owns a game that still exists.
+# The owned game key is read from the owner record, it is not declared in KEYS, so the script needs all the keys on
+# one Redis instance, as the lobby index and the games are. On Redis Cluster the owner record would have to keep
+# the state of the game instead.
+# KEYS: owner, game, lobby, lobby version, lobby channel
+# ARGV: game id, game, TTL in s, now in us, lobby entries expiration in us, `gameAdded` message
+# Returns: 1 when the game is saved, 0 when the user already owns a game
+_CREATE_GAME_SCRIPT = """
+local owned = redis.call('GET', KEYS[1])
+if owned and redis.call('EXISTS', owned) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+redis.call('ZADD', KEYS[3], 'NX', ARGV[4], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[5])
+redis.call('INCR', KEYS[4])
+redis.call('PUBLISH', KEYS[5], ARGV[6])
+return 1
+"""
+
+# Puts the user into the second seat of the lobby game. The game owned by a worker is not changed, the owner keeps
+# its own copy of the game, see `app.cache.game_actors`.
+# KEYS: game, lobby, lobby version, lobby channel, lease
+# ARGV: game id, user id (16 bytes), username, `gameJoined` message, `gameInvite` message without `targetPlayer`
+# Returns: the game or the error code
+_JOIN_GAME_SCRIPT = (
+    _GAME_FORMAT_LUA
+    + """
+local data = redis.call('GET', KEYS[1])
+if not data then
+    return 0
+end
+local game = parse_game(data)
+if not game then
+    return -1
+end
+if not has_flag(game.flags, GAME_FLAG_ACTIVE) or game.second_id then
+    return 0
+end
+if game.first_id == ARGV[2] then
+    return 1
+end
+if redis.call('EXISTS', KEYS[5]) == 1 then
+    return 2
+end
+local flags = with_flag(with_flag(game.flags, GAME_FLAG_ACTIVE, false), GAME_FLAG_SECOND_PLAYER, true)
+data = with_flags(data, flags, game.second_offset - 1) .. ARGV[2] .. pack_string(ARGV[3])
+redis.call('SET', KEYS[1], data, 'KEEPTTL')
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('INCR', KEYS[3])
+redis.call('PUBLISH', KEYS[4], ARGV[4])
+redis.call('PUBLISH', KEYS[4], '{"targetPlayer":' .. cjson.encode(game.first_username) .. ',' .. string.sub(ARGV[5], 2))
+return data
+"""
+)
+
+# Frees the second seat of the game which has not started yet and returns the game to the lobby, unless the game
+# is owned by a worker, as the join does.
+# KEYS: game, lobby, lobby version, lobby channel, lease
+# ARGV: game id, user id (16 bytes), now in us, `gameLeft` message without `game`
+# Returns: the game or the error code
+_LEAVE_GAME_SCRIPT = (
+    _GAME_FORMAT_LUA
+    + """
+local data = redis.call('GET', KEYS[1])
+if not data then
+    return 0
+end
+local game = parse_game(data)
+if not game then
+    return -1
+end
+if game.second_id ~= ARGV[2] then
+    return 0
+end
+-- X and O masks and seq
+if string.sub(data, 3, 10) ~= string.rep(string.char(0), 8) then
+    return 1
+end
+if redis.call('EXISTS', KEYS[5]) == 1 then
+    return 2
+end
+local flags = with_flag(with_flag(game.flags, GAME_FLAG_SECOND_PLAYER, false), GAME_FLAG_ACTIVE, true)
+data = with_flags(data, flags, game.second_offset - 1)
+redis.call('SET', KEYS[1], data, 'KEEPTTL')
+redis.call('ZADD', KEYS[2], 'NX', ARGV[3], ARGV[1])
+redis.call('INCR', KEYS[3])
+local model = read_model(ARGV[1], game, flags)
+redis.call('PUBLISH', KEYS[4], '{"game":' .. cjson.encode(model) .. ',' .. string.sub(ARGV[4], 2))
+return data
+"""
+)
+
+# Deletes the game of the user and releases the ownership. The lease of the worker owning the game is deleted too,
+# so the actor of the game stops on its next save instead of playing the deleted game.
+# KEYS: owner, game, lobby, lobby version, lobby channel, lease
+# ARGV: game id, user id (16 bytes), `gameDeleted` message
+# Returns: 1 when the game is deleted or the error code
+_CLOSE_GAME_SCRIPT = (
+    _GAME_FORMAT_LUA
+    + """
+local data = redis.call('GET', KEYS[2])
+if not data then
+    return 0
+end
+local game = parse_game(data)
+if not game then
+    return -1
+end
+if game.first_id ~= ARGV[2] then
+    return 0
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+redis.call('DEL', KEYS[2], KEYS[6])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('INCR', KEYS[4])
+redis.call('PUBLISH', KEYS[5], ARGV[3])
+return 1
+"""
+)
+
+# Saves the games which do not exist yet and publishes their messages, so a retried creation of the same games does
+# not create or announce them twice.
+# KEYS: games; ARGV: TTL in s, channel, game and message per game
+# Returns: 1 for each created game, 0 for each existing one
+_CREATE_GAMES_SCRIPT = """
+local created = {}
+for i = 1, #KEYS do
+    if redis.call('SET', KEYS[i], ARGV[2 * i + 1], 'EX', ARGV[1], 'NX') then
+        redis.call('PUBLISH', ARGV[2], ARGV[2 * i + 2])
+        created[i] = 1
+    else
+        created[i] = 0
+    end
+end
+return created
+"""
+
+# KEYS: owner; ARGV: game id
+_RELEASE_OWNER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
 
 
 class RedisManager:
@@ -40,36 +348,386 @@ class RedisManager:
 
 
 class RedisCache:
+    """Games storage.
+
+    Games waiting for the second player are indexed in the ``lobby_key`` sorted set scored by the creation time
+    in microseconds, so the lobby is paged without scanning the keyspace. Every change of the lobby increments
+    the ``lobby_version_key`` counter in the same transaction.
+
+    A user owns one lobby game at a time across all the workers, see `owner_key`. The ownership is checked and
+    written by the same script as the game and the lobby index.
+
+    Creating, joining, leaving and closing a game are single scripts validating and changing the game in place,
+    updating the indexes and publishing to the lobby channel, so each of them is one round-trip and two players
+    can't take the same seat.
+    """
+
+    lobby_key = "lobby:games"
+    lobby_version_key = "lobby:version"
+    game_ttl = 60 * 60 * 24
+    game_log_length = 1000
+    max_retries = 16
+
     def __init__(self) -> None:
         self.redis = redis
+        self._append_events_script = self.redis.register_script(_APPEND_EVENTS_SCRIPT)
+        self._create_game_script = self.redis.register_script(_CREATE_GAME_SCRIPT)
+        self._join_game_script = self.redis.register_script(_JOIN_GAME_SCRIPT)
+        self._leave_game_script = self.redis.register_script(_LEAVE_GAME_SCRIPT)
+        self._close_game_script = self.redis.register_script(_CLOSE_GAME_SCRIPT)
+        self._release_owner_script = self.redis.register_script(_RELEASE_OWNER_SCRIPT)
+        self._create_games_script = self.redis.register_script(_CREATE_GAMES_SCRIPT)
 
-    async def set(self, game_id: str, game: Game) -> None:
+    async def set(self, game_id: str, game: Game, message: bytes | None = None) -> None:
+        """Save the game and keep the lobby index in sync with `Game.is_active` in the same transaction.
+
+        Args:
+            game_id (str): game id
+            game (Game): game
+            message (bytes | None): message published to the lobby channel in the same transaction
+        """
+        await self.set_many([(game, message)])
+
+    async def set_many(self, games: list[tuple[Game, bytes | None]]) -> None:
+        """Save the games and publish their messages, see `set`, in one round-trip."""
+        if not games:
+            return
         try:
-            await self.redis.set(game_id, orjson.dumps(game.dump()).decode("utf-8"), ex=60 * 60 * 24)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                now = time.time_ns() // 1000
+                lobby_changed = False
+                for game, message in games:
+                    pipe.set(game.id, game.dump_bytes(), ex=self.game_ttl)
+                    if game.is_active:
+                        pipe.zadd(self.lobby_key, {game.id: now}, nx=True)
+                    else:
+                        pipe.zrem(self.lobby_key, game.id)
+                    lobby_changed |= not game.is_bot_game
+                    if message is not None:
+                        pipe.publish(settings.REDIS_CHANNEL, message)
+                # Games expire by TTL, the index entries are removed together with them
+                pipe.zremrangebyscore(self.lobby_key, "-inf", now - self.game_ttl * 1_000_000)
+                if lobby_changed:
+                    pipe.incr(self.lobby_version_key)
+                await pipe.execute()
         except (RedisError, ValueError) as e:
             raise ValueError(f"Failed to save game to Redis: {e}")
 
+    async def create_many(self, games: list[tuple[Game, bytes]]) -> list[bool]:
+        """Save the games which do not exist yet and publish their messages to the lobby channel, in one round-trip.
+
+        The games are not indexed in the lobby, e.g. the games of the matched players. Creating the games with the
+        same ids once more, e.g. when the reply of the first call is lost, does not change them.
+
+        Returns:
+            list[bool]: False for the games which already exist
+        """
+        if not games:
+            return []
+        args = [self.game_ttl, settings.REDIS_CHANNEL]
+        for game, message in games:
+            args.extend((game.dump_bytes(), message))
+        try:
+            created = await self._create_games_script(keys=[game.id for game, _ in games], args=args)
+        except RedisError as e:
+            raise ValueError(f"Failed to save games to Redis: {e}")
+        return [bool(flag) for flag in created]
+
+    async def create(self, game: Game, message: bytes) -> bool:
+        """Save the new lobby game of the user and publish the message to the lobby channel.
+
+        Returns:
+            bool: False if the user already owns a game
+        """
+        now = time.time_ns() // 1000
+        try:
+            created = await self._create_game_script(
+                keys=[owner_key(game.first_player.id), game.id, *self._lobby_keys],
+                args=[game.id, game.dump_bytes(), self.game_ttl, now, now - self.game_ttl * 1_000_000, message],
+            )
+        except RedisError as e:
+            raise ValueError(f"Failed to save game to Redis: {e}")
+        return bool(created)
+
+    async def join(
+        self, game_id: str, player_id: str, username: str, joined_message: bytes, invite_message: bytes
+    ) -> Game:
+        """Put the player into the second seat of the lobby game and publish the messages to the lobby channel.
+
+        Args:
+            game_id (str): game id
+            player_id (str): second player id
+            username (str): second player username
+            joined_message (bytes): `gameJoined` message
+            invite_message (bytes): `gameInvite` message, the username of the creator is added as `targetPlayer`
+
+        Raises:
+            GameIsNotCreated: the game is not found, is not in the lobby or is created by the player
+            GameIsBusy: the game is owned by a worker, e.g. a move is being made
+        """
+        result = await self._call_game_script(
+            self._join_game_script,
+            game_id,
+            keys=[game_id, *self._lobby_keys, game_lease_key(game_id)],
+            args=[game_id, UUID(player_id).bytes, username, joined_message, invite_message],
+        )
+        if result == _GAME_NOT_ALLOWED:
+            raise GameIsNotCreated("You are the creator of the game")
+        return Game.decode(result)
+
+    async def leave(self, game_id: str, player_id: str, message: bytes) -> Game:
+        """Free the second seat of the game which has not started yet and return the game to the lobby.
+
+        Args:
+            game_id (str): game id
+            player_id (str): second player id
+            message (bytes): `gameLeft` message, the game is added as `game`
+
+        Raises:
+            GameIsNotCreated: the player is not in the game or the game has already started
+            GameIsBusy: the game is owned by a worker, e.g. a move is being made
+        """
+        result = await self._call_game_script(
+            self._leave_game_script,
+            game_id,
+            keys=[game_id, *self._lobby_keys, game_lease_key(game_id)],
+            args=[game_id, UUID(player_id).bytes, time.time_ns() // 1000, message],
+        )
+        if result == _GAME_NOT_FOUND:
+            raise GameIsNotCreated("You are not in this game")
+        if result == _GAME_NOT_ALLOWED:
+            raise GameIsNotCreated("The game has already started")
+        return Game.decode(result)
+
+    async def close(self, game_id: str, owner_id: str, message: bytes) -> bool:
+        """Delete the game of the user, release the ownership and publish the message to the lobby channel.
+
+        Returns:
+            bool: False if the game is not found or is created by another user
+        """
+        try:
+            result = await self._call_game_script(
+                self._close_game_script,
+                game_id,
+                keys=[owner_key(owner_id), game_id, *self._lobby_keys, game_lease_key(game_id)],
+                args=[game_id, UUID(owner_id).bytes, message],
+            )
+        except GameIsNotCreated:
+            return False
+        return result == 1
+
+    @property
+    def _lobby_keys(self) -> list[str]:
+        return [self.lobby_key, self.lobby_version_key, settings.REDIS_CHANNEL]
+
+    async def _call_game_script(self, script: AsyncScript, game_id: str, keys: list, args: list) -> bytes | int:
+        """Run the script changing the game.
+
+        The games in the legacy JSON format are rewritten in the binary format and the script is run once more.
+
+        Raises:
+            GameIsNotCreated: the game is not found
+            GameIsBusy: the game is owned by a worker
+        """
+        try:
+            result = await script(keys=keys, args=args)
+            if result == _GAME_LEGACY_FORMAT and (game := await self.get(game_id)) is not None:
+                await self.set(game_id, game)
+                result = await script(keys=keys, args=args)
+        except RedisError as e:
+            raise ValueError(f"Failed to update game in Redis: {e}")
+        if result in (_GAME_NOT_FOUND, _GAME_LEGACY_FORMAT):
+            raise GameIsNotCreated("Game not found")
+        if result == _GAME_BUSY:
+            raise GameIsBusy("The game is being played, try again")
+        return result
+
+    async def load_scripts(self) -> None:
+        """Load the scripts at startup, so even the first calls are single EVALSHA round-trips."""
+        scripts = (
+            self._append_events_script,
+            self._create_game_script,
+            self._join_game_script,
+            self._leave_game_script,
+            self._close_game_script,
+            self._release_owner_script,
+            self._create_games_script,
+        )
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for script in scripts:
+                    pipe.script_load(script.script)
+                await pipe.execute()
+        except RedisError as e:
+            raise ValueError(f"Failed to load scripts to Redis: {e}")
+
+    async def release_owner(self, game_id: str, owner_id: str) -> None:
+        """Let the user create a new game, e.g. when the game is finished."""
+        try:
+            await self._release_owner_script(keys=[owner_key(owner_id)], args=[game_id])
+        except RedisError as e:
+            raise ValueError(f"Failed to release game owner in Redis: {e}")
+
     async def get(self, game_id: str) -> Game | None:
         try:
             if (data := await self.redis.get(game_id)) is None:
                 return None
-            return Game.load(orjson.loads(data))
+            return Game.decode(data)
         except (RedisError, ValueError) as e:
             raise ValueError(f"Failed to load game from Redis: {e}")
 
+    async def get_latest(self, game_id: str) -> Game | None:
+        """Get the game with the moves logged after the game was saved.
+
+        The owner of the game saves it every few moves, see `app.cache.game_actors`, the log has all of them.
+        """
+        latest = await self.get_latest_and_saved_seq(game_id)
+        return latest[0] if latest is not None else None
+
+    async def get_latest_and_saved_seq(self, game_id: str) -> tuple[Game, int] | None:
+        """Same as `get_latest`, with the sequence number of the saved game the logged moves are applied to."""
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.get(game_id)
+                pipe.xrange(game_log_key(game_id))
+                data, entries = await pipe.execute()
+            if data is None:
+                return None
+            game = Game.decode(data)
+            saved_seq = game.seq
+            for _, fields in entries:
+                event = orjson.loads(fields[b"event"])
+                if event.get("type") == "gameState" and event.get("seq", 0) > game.seq:
+                    game.replay_move(event["cellIndex"], GameItems(event["item"]))
+            return game, saved_seq
+        except (RedisError, ValueError, BaseGameError) as e:
+            raise ValueError(f"Failed to load game from Redis: {e}")
+
+    async def update(self, game_id: str, mutate: Callable[[Game], Awaitable[list[bytes]]]) -> Game:
+        """Change the game atomically and append the events about the change to the log of the game.
+
+        The game is watched while `mutate` changes it, the new state and the events are written in one transaction.
+        When another worker changes the game first, the change is retried on the fresh state.
+
+        Args:
+            game_id (str): game id
+            mutate (Callable[[Game], Awaitable[list[bytes]]]): changes the game and returns the events as JSON
+                objects, the exceptions it raises are propagated
+
+        Raises:
+            GameIsNotCreated: the game is not found
+
+        Returns:
+            Game: the changed game
+        """
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for _ in range(self.max_retries):
+                    try:
+                        await pipe.watch(game_id)
+                        if (data := await pipe.get(game_id)) is None:
+                            raise GameIsNotCreated("Game not found")
+                        game = Game.decode(data)
+                        messages = await mutate(game)
+                        pipe.multi()
+                        pipe.set(game_id, game.dump_bytes(), keepttl=True)
+                        if messages:
+                            await self._append_events(game_id, messages, client=pipe)
+                        await pipe.execute()
+                        return game
+                    except WatchError:
+                        continue
+                    finally:
+                        await pipe.reset()
+        except RedisError as e:
+            raise ValueError(f"Failed to update game in Redis: {e}")
+        raise ValueError("Failed to update game in Redis: too many concurrent changes")
+
+    async def append_events(self, game_id: str, messages: list[bytes]) -> None:
+        try:
+            await self._append_events(game_id, messages)
+        except RedisError as e:
+            raise ValueError(f"Failed to append game events to Redis: {e}")
+
+    async def _append_events(self, game_id: str, messages: list[bytes], client: Redis | None = None) -> None:
+        # In a pipeline the script is queued, it is executed with the pipeline
+        await self._append_events_script(
+            keys=[game_log_key(game_id), game_channel(game_id)],
+            args=[self.game_log_length, self.game_ttl, *messages],
+            client=client,
+        )
+
+    async def get_events(self, game_id: str, after: str | None = None) -> list[dict]:
+        """Get the events of the game logged after the `after` event id, all of them if it is None."""
+        try:
+            entries = await self.redis.xrange(game_log_key(game_id), min=f"({after}" if after else "-", max="+")
+            return [{"eventId": event_id.decode(), **orjson.loads(fields[b"event"])} for event_id, fields in entries]
+        except (RedisError, ValueError) as e:
+            raise ValueError(f"Failed to get game events from Redis: {e}")
+
     async def delete(self, game_id: str) -> None:
         try:
-            await self.redis.delete(game_id)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(game_id)
+                pipe.zrem(self.lobby_key, game_id)
+                pipe.incr(self.lobby_version_key)
+                await pipe.execute()
         except RedisError as e:
             raise ValueError(f"Failed to delete game from Redis: {e}")
 
-    async def get_active_games(self) -> list[GameRead]:
+    async def get_lobby_version(self) -> int:
+        try:
+            return int(await self.redis.get(self.lobby_version_key) or 0)
+        except (RedisError, ValueError) as e:
+            raise ValueError(f"Failed to get lobby version from Redis: {e}")
+
+    async def get_active_games(self, cursor: str | None, limit: int) -> tuple[list[GameRead], str | None]:
+        """Get a page of the games waiting for the second player, the oldest first.
+
+        The games created in the same microsecond have the same score, they are ordered by the id, so the cursor is
+        the score and the id of the last game of the page, see `lobby_cursor`.
+
+        Args:
+            cursor (str | None): cursor returned with the previous page, None for the first page
+            limit (int): page size
+
+        Raises:
+            ValueError: the cursor is invalid
+
+        Returns:
+            tuple[list[GameRead], str | None]: games and the cursor of the next page, None if it is the last page
+        """
         try:
-            keys = await self.redis.keys("*")
-            return [
-                game
-                for data in await self.redis.mget(keys)
-                if (game := Game.to_read(orjson.loads(data))) and game.isActive
-            ]
+            if cursor is None:
+                entries = await self.redis.zrangebyscore(
+                    self.lobby_key, "-inf", "+inf", start=0, num=limit, withscores=True
+                )
+            else:
+                score, last_id = parse_lobby_cursor(cursor)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    # The games with the score of the last game, usually none but the last game itself
+                    pipe.zrangebyscore(self.lobby_key, score, score, withscores=True)
+                    pipe.zrangebyscore(self.lobby_key, f"({score}", "+inf", start=0, num=limit, withscores=True)
+                    same_score, entries = await pipe.execute()
+                after = [(game_id, score) for game_id, score in same_score if game_id.decode() > last_id]
+                entries = (after + entries)[:limit]
+            if not entries:
+                return [], None
+
+            games_ids = [game_id for game_id, _ in entries]
+            games, stale_ids = [], []
+            for game_id, data in zip(games_ids, await self.redis.mget(games_ids)):
+                if data is not None and (game := Game.decode_read(data)).isActive:
+                    games.append(game)
+                else:
+                    stale_ids.append(game_id)
+            if stale_ids:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.zrem(self.lobby_key, *stale_ids)
+                    pipe.incr(self.lobby_version_key)
+                    await pipe.execute()
+
+            next_cursor = lobby_cursor(entries[-1][1], entries[-1][0]) if len(entries) == limit else None
+            return games, next_cursor
         except (RedisError, ValueError) as e:
             raise ValueError(f"Failed to get all games from Redis: {e}")
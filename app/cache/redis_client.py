@@ -0,0 +1,167 @@
+import time
+from bisect import bisect_left
+
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.connection import parse_url
+from redis.exceptions import ConnectionError
+
+from app.settings import settings
+
+# Upper bounds of the latency buckets, milliseconds
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 1000.0)
+
+
+class LatencyHistogram:
+    """Counts of the latencies in the `LATENCY_BUCKETS`, the last count is for the slower ones."""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        # Milliseconds
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        milliseconds = seconds * 1000
+        self.counts[bisect_left(LATENCY_BUCKETS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+
+    def to_dict(self) -> dict:
+        buckets = {f"{bound:g}": count for bound, count in zip(LATENCY_BUCKETS, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {"count": self.count, "sum": self.total, "buckets": buckets}
+
+
+class RedisMetrics:
+    """Latencies of the Redis commands and the saturation of the connection pool of the worker.
+
+    A pipeline is counted once as `PIPELINE` or `MULTI`, a script as `EVALSHA`. The pool is saturated when
+    `waits` grow: the commands wait for a free connection, `timeouts` of them have given up.
+    """
+
+    def __init__(self):
+        self.commands: dict[str, LatencyHistogram] = {}
+        self.pool_acquire = LatencyHistogram()
+        self.max_connections = 0
+        self.connections_created = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def observe(self, command: str, seconds: float) -> None:
+        if (histogram := self.commands.get(command)) is None:
+            histogram = self.commands[command] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "commands": {command: histogram.to_dict() for command, histogram in sorted(self.commands.items())},
+            "pool": {
+                "acquire": self.pool_acquire.to_dict(),
+                "maxConnections": self.max_connections,
+                "connectionsCreated": self.connections_created,
+                "inUse": self.in_use,
+                "maxInUse": self.max_in_use,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            },
+        }
+
+
+class MeteredConnectionPool(BlockingConnectionPool):
+    """Connection pool of at most `max_connections` connections, the commands wait up to `timeout` seconds for a free
+    connection instead of failing."""
+
+    def __init__(self, metrics: RedisMetrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        metrics.max_connections = self.max_connections
+
+    def make_connection(self):
+        self.metrics.connections_created += 1
+        return super().make_connection()
+
+    async def get_connection(self, command_name, *keys, **options):
+        metrics = self.metrics
+        if not self._available_connections and len(self._in_use_connections) >= self.max_connections:
+            metrics.waits += 1
+        started = time.perf_counter()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except ConnectionError:
+            if len(self._in_use_connections) >= self.max_connections:
+                metrics.timeouts += 1
+            raise
+        metrics.pool_acquire.observe(time.perf_counter() - started)
+        metrics.in_use = len(self._in_use_connections)
+        metrics.max_in_use = max(metrics.max_in_use, metrics.in_use)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.metrics.in_use = len(self._in_use_connections)
+
+
+class MeteredPipeline(Pipeline):
+    metrics: RedisMetrics
+
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            self.metrics.observe("MULTI" if self.is_transaction else "PIPELINE", time.perf_counter() - started)
+
+
+class MeteredRedis(Redis):
+    """Redis client counting the latency of every command in the `metrics`."""
+
+    def __init__(self, *args, metrics: RedisMetrics, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            command = args[0].decode() if isinstance(args[0], bytes) else str(args[0])
+            self.metrics.observe(command.upper(), time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> MeteredPipeline:
+        pipe = MeteredPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipe.metrics = self.metrics
+        return pipe
+
+
+redis_metrics = RedisMetrics()
+
+
+def create_redis(
+    max_connections: int = settings.REDIS_MAX_CONNECTIONS,
+    socket_timeout: float | None = settings.REDIS_SOCKET_TIMEOUT,
+    metrics: RedisMetrics = redis_metrics,
+) -> MeteredRedis:
+    """Redis client with its own connection pool.
+
+    Args:
+        max_connections (int): pool size
+        socket_timeout (float | None): seconds to wait for a reply, None for the pub/sub clients which wait for the
+            messages without a limit
+        metrics (RedisMetrics): metrics of the client
+    """
+    pool = MeteredConnectionPool(
+        metrics,
+        **parse_url(settings.REDIS_URL),
+        max_connections=max_connections,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return MeteredRedis(connection_pool=pool, metrics=metrics)
@@ -0,0 +1,89 @@
+import orjson
+from redis.exceptions import RedisError
+
+from app.cache.redis import redis
+from app.schemas import UserStatisticRead
+
+# Caches the statistic read from the database unless it has been changed since the read, see `StatisticCache`.
+# KEYS: statistic, version; ARGV: statistic, TTL in s, version read before the database or '' if it is unknown,
+# TTL in s when the version is unknown
+# Returns: 1 when the statistic is cached
+_FILL_SCRIPT = """
+if ARGV[3] == '' then
+    return redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4], 'NX') and 1 or 0
+end
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[3] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+
+class StatisticCache:
+    """Read-through cache of `UserStatisticRead` shared by all the workers.
+
+    Every invalidation increments the version of the statistic of the user. The reader takes the version together
+    with the cache miss and fills the cache only if the version is the same, so a statistic read from the database
+    before a concurrent flush does not overwrite the invalidation. A statistic cached without the version is kept
+    for `unversioned_ttl` seconds only.
+    """
+
+    key_prefix = "statistic:"
+    ttl = 60 * 60
+    unversioned_ttl = 5
+
+    def __init__(self) -> None:
+        self.redis = redis
+        self._fill_script = self.redis.register_script(_FILL_SCRIPT)
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.key_prefix}{user_id}"
+
+    def _version_key(self, user_id: str) -> str:
+        return f"{self.key_prefix}{user_id}:version"
+
+    async def get(self, user_id: str) -> tuple[UserStatisticRead | None, bytes]:
+        """Get the cached statistic and the version of the statistic of the user, see `fill`."""
+        try:
+            data, version = await self.redis.mget(self._key(user_id), self._version_key(user_id))
+            if data is None:
+                return None, version or b"0"
+            return UserStatisticRead.model_validate(orjson.loads(data)), version or b"0"
+        except (RedisError, ValueError) as e:
+            raise ValueError(f"Failed to load statistic from Redis: {e}")
+
+    async def fill(self, user_id: str, statistic: UserStatisticRead, version: bytes | None = None) -> bool:
+        """Cache the statistic read from the database.
+
+        Args:
+            user_id (str): user id
+            statistic (UserStatisticRead): statistic read from the database
+            version (bytes | None): version returned by `get` before the statistic was read, None if it is unknown
+
+        Returns:
+            bool: False if the statistic has been changed since the version was read or is cached already
+        """
+        try:
+            filled = await self._fill_script(
+                keys=[self._key(user_id), self._version_key(user_id)],
+                args=[orjson.dumps(statistic.model_dump()), self.ttl, version or b"", self.unversioned_ttl],
+            )
+        except RedisError as e:
+            raise ValueError(f"Failed to save statistic to Redis: {e}")
+        return bool(filled)
+
+    async def delete(self, *users_ids: str) -> None:
+        """Invalidate the cached statistic of the users, e.g. when it is changed in the database."""
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for user_id in users_ids:
+                    pipe.incr(self._version_key(user_id))
+                    pipe.expire(self._version_key(user_id), self.ttl)
+                pipe.delete(*(self._key(user_id) for user_id in users_ids))
+                await pipe.execute()
+        except RedisError as e:
+            raise ValueError(f"Failed to delete statistic from Redis: {e}")
+
+
+statistic_cache = StatisticCache()
@@ -0,0 +1,2 @@
+from .bitboard import Bitboard, MoveResult
+from .rating import INITIAL_RATING, Rating, rate_game
@@ -0,0 +1,130 @@
+"""Bitboard representation of the tic-tac-toe board.
+
+Every side owns a 9-bit integer mask, bit ``i`` is set when the side occupies cell ``i``::
+
+    0 | 1 | 2
+    3 | 4 | 5
+    6 | 7 | 8
+
+All the checks are table lookups and bitwise operations, so a move does not allocate anything.
+"""
+
+from enum import IntEnum
+
+from app.exceptions import GameIsFinished, MoveIsNotAllowed
+from app.helpers import GameItems
+
+BOARD_SIZE = 9
+FULL_MASK = (1 << BOARD_SIZE) - 1
+CELL_MASKS: tuple[int, ...] = tuple(1 << index for index in range(BOARD_SIZE))
+
+WIN_PATTERNS: tuple[tuple[int, int, int], ...] = (
+    (0, 1, 2),
+    (3, 4, 5),
+    (6, 7, 8),
+    (0, 3, 6),
+    (1, 4, 7),
+    (2, 5, 8),
+    (0, 4, 8),
+    (2, 4, 6),
+)
+WIN_MASKS: tuple[int, ...] = tuple(sum(CELL_MASKS[index] for index in pattern) for pattern in WIN_PATTERNS)
+
+# WINNING[mask] is True when the mask contains at least one of the win lines
+WINNING: tuple[bool, ...] = tuple(
+    any(mask & win_mask == win_mask for win_mask in WIN_MASKS) for mask in range(FULL_MASK + 1)
+)
+
+
+class MoveResult(IntEnum):
+    CONTINUE = 0
+    WIN = 1
+    DRAW = 2
+
+
+class Bitboard:
+    """Board state of a single game. ``X`` always makes the first move."""
+
+    __slots__ = ("x_mask", "o_mask")
+
+    def __init__(self, x_mask: int = 0, o_mask: int = 0):
+        self.x_mask = x_mask
+        self.o_mask = o_mask
+
+    @property
+    def occupied(self) -> int:
+        return self.x_mask | self.o_mask
+
+    @property
+    def moves_count(self) -> int:
+        return (self.x_mask | self.o_mask).bit_count()
+
+    @property
+    def turn(self) -> GameItems:
+        return GameItems.X if self.x_mask.bit_count() == self.o_mask.bit_count() else GameItems.O
+
+    @property
+    def winner(self) -> GameItems | None:
+        if WINNING[self.x_mask]:
+            return GameItems.X
+        if WINNING[self.o_mask]:
+            return GameItems.O
+        return None
+
+    @property
+    def is_finished(self) -> bool:
+        return WINNING[self.x_mask] or WINNING[self.o_mask] or self.occupied == FULL_MASK
+
+    def is_legal(self, cell_index: int) -> bool:
+        return 0 <= cell_index < BOARD_SIZE and not self.occupied & CELL_MASKS[cell_index]
+
+    def item_at(self, cell_index: int) -> GameItems | None:
+        cell_mask = CELL_MASKS[cell_index]
+        if self.x_mask & cell_mask:
+            return GameItems.X
+        if self.o_mask & cell_mask:
+            return GameItems.O
+        return None
+
+    def play(self, cell_index: int, item: GameItems) -> MoveResult:
+        """Put the item into the cell.
+
+        Args:
+            cell_index (int): index of the cell, 0..8
+            item (GameItems): item of the player who makes the move
+
+        Raises:
+            GameIsFinished: the game already has a winner or the board is full
+            MoveIsNotAllowed: it is the other player's turn or the cell is not available
+
+        Returns:
+            MoveResult
+        """
+        x_mask = self.x_mask
+        o_mask = self.o_mask
+        occupied = x_mask | o_mask
+        if WINNING[x_mask] or WINNING[o_mask] or occupied == FULL_MASK:
+            raise GameIsFinished("The game is already finished")
+        if type(cell_index) is not int or not 0 <= cell_index < BOARD_SIZE:
+            raise MoveIsNotAllowed("Incorrect cell index")
+        cell_mask = CELL_MASKS[cell_index]
+        if occupied & cell_mask:
+            raise MoveIsNotAllowed("The cell is already occupied")
+
+        if x_mask.bit_count() == o_mask.bit_count():
+            if item is not GameItems.X:
+                raise MoveIsNotAllowed("It is the other player's turn")
+            mask = self.x_mask = x_mask | cell_mask
+        else:
+            if item is not GameItems.O:
+                raise MoveIsNotAllowed("It is the other player's turn")
+            mask = self.o_mask = o_mask | cell_mask
+
+        if WINNING[mask]:
+            return MoveResult.WIN
+        if occupied | cell_mask == FULL_MASK:
+            return MoveResult.DRAW
+        return MoveResult.CONTINUE
+
+    def to_list(self) -> list[str]:
+        return [item.value if (item := self.item_at(index)) else "" for index in range(BOARD_SIZE)]
@@ -0,0 +1,54 @@
+"""Glicko rating of the players.
+
+Every finished game is a rating period of its own, so the ratings are updated incrementally game by game::
+
+    g(RD) = 1 / sqrt(1 + 3 q^2 RD^2 / pi^2),  q = ln(10) / 400
+    E = 1 / (1 + 10^(-g(RD_opponent) (r - r_opponent) / 400))
+    d^2 = 1 / (q^2 g^2 E (1 - E))
+    r' = r + q / (1 / RD^2 + 1 / d^2) g (s - E)
+    RD' = sqrt(1 / (1 / RD^2 + 1 / d^2))
+
+The deviation is kept above `RATING_DEVIATION_MIN`, so the ratings of the regular players still move.
+"""
+
+import math
+from typing import NamedTuple
+
+from app.settings import settings
+
+Q = math.log(10) / 400
+
+
+class Rating(NamedTuple):
+    rating: float = settings.RATING_INITIAL
+    deviation: float = settings.RATING_DEVIATION_INITIAL
+
+
+INITIAL_RATING = Rating()
+
+
+def _g(deviation: float) -> float:
+    return 1 / math.sqrt(1 + 3 * Q * Q * deviation * deviation / (math.pi * math.pi))
+
+
+def _rate(player: Rating, opponent: Rating, score: float) -> Rating:
+    g = _g(opponent.deviation)
+    expected = 1 / (1 + 10 ** (-g * (player.rating - opponent.rating) / 400))
+    d_squared_inverse = Q * Q * g * g * expected * (1 - expected)
+    precision = 1 / (player.deviation * player.deviation) + d_squared_inverse
+    rating = player.rating + Q / precision * g * (score - expected)
+    return Rating(rating, max(math.sqrt(1 / precision), settings.RATING_DEVIATION_MIN))
+
+
+def rate_game(first: Rating, second: Rating, first_score: float) -> tuple[Rating, Rating]:
+    """New ratings of the players of the game.
+
+    Args:
+        first (Rating): rating of the first player
+        second (Rating): rating of the second player
+        first_score (float): 1 if the first player has won, 0 if they have lost, 0.5 for a draw
+
+    Returns:
+        tuple[Rating, Rating]: new ratings of the first and the second player
+    """
+    return _rate(first, second, first_score), _rate(second, first, 1 - first_score)
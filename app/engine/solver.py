@@ -0,0 +1,135 @@
+"""Table of solved positions used by the built-in bot.
+
+The whole game tree is solved once, when the table is loaded. Positions that are rotations or reflections
+of each other share a single entry. A lookup then costs 8 symmetry transforms and one ``dict`` access.
+"""
+
+import logging
+
+from app.engine.bitboard import BOARD_SIZE, FULL_MASK, WINNING, Bitboard
+
+logger = logging.getLogger(__name__)
+
+# Cell permutations of the 8 board symmetries: SYMMETRIES[s][cell] is the cell the `cell` is moved to
+_ROTATE = (6, 3, 0, 7, 4, 1, 8, 5, 2)
+_REFLECT = (2, 1, 0, 5, 4, 3, 8, 7, 6)
+
+
+def _compose(first: tuple[int, ...], second: tuple[int, ...]) -> tuple[int, ...]:
+    return tuple(second[first[cell]] for cell in range(BOARD_SIZE))
+
+
+def _build_symmetries() -> tuple[tuple[int, ...], ...]:
+    symmetries = []
+    permutation = tuple(range(BOARD_SIZE))
+    for _ in range(4):
+        symmetries.append(permutation)
+        symmetries.append(_compose(permutation, _REFLECT))
+        permutation = _compose(permutation, _ROTATE)
+    return tuple(symmetries)
+
+
+SYMMETRIES: tuple[tuple[int, ...], ...] = _build_symmetries()
+INVERSE_SYMMETRIES: tuple[tuple[int, ...], ...] = tuple(
+    tuple(permutation.index(cell) for cell in range(BOARD_SIZE)) for permutation in SYMMETRIES
+)
+# MASK_TRANSFORMS[s][mask] is the mask moved by the symmetry `s`
+MASK_TRANSFORMS: tuple[tuple[int, ...], ...] = tuple(
+    tuple(
+        sum(1 << permutation[cell] for cell in range(BOARD_SIZE) if mask >> cell & 1) for mask in range(FULL_MASK + 1)
+    )
+    for permutation in SYMMETRIES
+)
+
+
+def position_key(x_mask: int, o_mask: int) -> int:
+    return x_mask | o_mask << BOARD_SIZE
+
+
+def canonical_position(x_mask: int, o_mask: int) -> tuple[int, int]:
+    """Find the smallest key among the symmetric positions.
+
+    Returns:
+        tuple[int, int]: the canonical key and the index of the symmetry that produces it
+    """
+    best_key = -1
+    best_symmetry = 0
+    for symmetry, transform in enumerate(MASK_TRANSFORMS):
+        key = transform[x_mask] | transform[o_mask] << BOARD_SIZE
+        if best_key < 0 or key < best_key:
+            best_key = key
+            best_symmetry = symmetry
+    return best_key, best_symmetry
+
+
+class PositionTable:
+    """Best move for every reachable unfinished position, up to symmetry."""
+
+    def __init__(self):
+        self._moves: dict[int, int] = {}
+        self._scores: dict[int, int] = {}
+
+    @property
+    def is_loaded(self) -> bool:
+        return bool(self._moves)
+
+    def __len__(self) -> int:
+        return len(self._moves)
+
+    def load(self) -> None:
+        if self.is_loaded:
+            return
+        self._solve(0, 0)
+        self._scores.clear()
+        logger.info("Bot position table loaded: %s positions", len(self._moves))
+
+    def _solve(self, x_mask: int, o_mask: int) -> int:
+        """Score of the canonical position for the side to move: >0 win, 0 draw, <0 loss.
+
+        Faster wins and slower losses have larger scores, so the bot finishes the game as soon as it can.
+        """
+        key, _ = canonical_position(x_mask, o_mask)
+        if (score := self._scores.get(key)) is not None:
+            return score
+
+        occupied = x_mask | o_mask
+        x_turn = x_mask.bit_count() == o_mask.bit_count()
+        best_score = -BOARD_SIZE - 1
+        best_cell = -1
+        for cell in range(BOARD_SIZE):
+            cell_mask = 1 << cell
+            if occupied & cell_mask:
+                continue
+            if x_turn:
+                next_x, next_o = x_mask | cell_mask, o_mask
+                won = WINNING[next_x]
+            else:
+                next_x, next_o = x_mask, o_mask | cell_mask
+                won = WINNING[next_o]
+            if won:
+                score = BOARD_SIZE + 1 - occupied.bit_count()
+            elif occupied | cell_mask == FULL_MASK:
+                score = 0
+            else:
+                score = -self._solve(next_x, next_o)
+            if score > best_score:
+                best_score = score
+                best_cell = cell
+
+        # The move is stored in the frame of the canonical position
+        _, symmetry = canonical_position(x_mask, o_mask)
+        self._moves[key] = SYMMETRIES[symmetry][best_cell]
+        self._scores[key] = best_score
+        return best_score
+
+    def best_move(self, board: Bitboard) -> int:
+        """Get the perfect move for the side to move.
+
+        Raises:
+            KeyError: the table is not loaded or the game on the board is already finished
+        """
+        key, symmetry = canonical_position(board.x_mask, board.o_mask)
+        return INVERSE_SYMMETRIES[symmetry][self._moves[key]]
+
+
+positions_table = PositionTable()
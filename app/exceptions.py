@@ -31,3 +31,15 @@ class GameIsNotCreated(BaseGameError):
 
 class GameIsFinished(BaseGameError):
     pass
+
+
+class MoveIsNotAllowed(BaseGameError):
+    pass
+
+
+class MatchmakingError(BaseGameError):
+    pass
+
+
+class GameIsBusy(BaseGameError):
+    pass
@@ -1,4 +1,3 @@
-import asyncio
 import logging.config
 from contextlib import asynccontextmanager
 from typing import Any
@@ -10,13 +9,21 @@ from fastapi.websockets import WebSocketState
 
 from app.api.routers import router
 from app.auth.websocket_auth import JWTWebsocketAuth
+from app.cache.game_actors import game_actors
 from app.cache.game_cache import game_cache_manager
+from app.cache.matchmaking import matchmaker
+from app.cache.pubsub import pubsub_dispatcher
 from app.cache.redis import RedisManager
-from app.operations.statistic import get_statistic
+from app.engine.solver import positions_table
+from app.exceptions import BaseGameError
+from app.operations.leaderboard import leaderboard_reconciler
+from app.operations.statistic import get_statistic, statistic_writer
 from app.operations.users import get_user_and_statistic_by_username
 from app.settings import settings
 from app.websockets.helper import WebsocketMessageType
-from database import create_db_and_tables
+from app.websockets.lobby import LobbyConnection, lobby_feed
+from app.websockets.game_sessions import game_sessions
+from database import create_db_and_tables, session_scope
 from database.models.users import User
 
 logger = logging.getLogger(__name__)
@@ -28,7 +35,23 @@ logger.info("VERSION - %s", settings.PROJECT_VERSION)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await create_db_and_tables()
+    positions_table.load()
+    await game_cache_manager.load_scripts()
+    await pubsub_dispatcher.start()
+    await game_actors.start()
+    await lobby_feed.start()
+    await statistic_writer.start()
+    await matchmaker.start()
+    await leaderboard_reconciler.start()
     yield
+    await leaderboard_reconciler.stop()
+    await matchmaker.stop()
+    # The games in memory are saved before the worker exits
+    await game_actors.stop()
+    await lobby_feed.stop()
+    await pubsub_dispatcher.stop()
+    # Pending statistic updates are written before the worker exits
+    await statistic_writer.stop()
 
 
 app = FastAPI(title=settings.PROJECT_NAME, version=settings.PROJECT_VERSION, debug=settings.DEBUG, lifespan=lifespan)
@@ -44,29 +67,36 @@ app.add_middleware(
 app.include_router(router=router)
 
 
-async def auth_user(websocket: WebSocket) -> None | User:
+async def auth_user(websocket: WebSocket) -> tuple[User | None, dict]:
+    """Аутентификация по первому сообщению сокета.
+
+    Returns:
+        tuple[User | None, dict]: Пользователь или None и сообщение с токеном, в нем передаются настройки соединения
+    """
+    token_message = {}
     try:
         # Ждем сообщение с токеном
         token_message = await websocket.receive_json()
         if not isinstance(token_message, dict) or "token" not in token_message:
             await websocket.send_json({"type": "auth", "status": "error", "message": "Токен не предоставлен"})
-            return None
+            return None, {}
 
-        user = await JWTWebsocketAuth.validate(token_message["token"])
+        async with session_scope():
+            user = await JWTWebsocketAuth.validate(token_message["token"])
         if user:
             await websocket.send_json(
                 {"type": "auth", "status": "success", "user": {"id": str(user.id), "username": user.username}}
             )
-            return user
+            return user, token_message
         else:
             await websocket.send_json({"type": "auth", "status": "error", "message": "Недействительный токен"})
-            return None
+            return None, token_message
     except WebSocketException as e:
         logger.error(f"WebSocket exception: {e}")
-        return None
+        return None, token_message
     except Exception as e:
         logger.error(f"Authentication error: {e}")
-        return None
+        return None, token_message
 
 
 @app.websocket("/ws")
@@ -74,71 +104,44 @@ async def websocket_endpoint(websocket: WebSocket) -> None:
     await websocket.accept()
     redis_manager = RedisManager()
     user = None
+    lobby_queue = None
+    lobby_diff = False
 
     try:
         # Аутентифицируем пользователя
-        user = await auth_user(websocket)
+        user, token_message = await auth_user(websocket)
         if not user:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
 
-        # Подписываемся на канал
-        await redis_manager.subscribe_to_channel(settings.REDIS_CHANNEL)
+        # lobbyFeed: "diff" - изменения лобби приходят пачками раз в LOBBY_FEED_INTERVAL, старые клиенты
+        # получают каждое изменение отдельным сообщением
+        lobby_diff = token_message.get("lobbyFeed") == "diff"
+        if lobby_diff:
+            lobby_queue = lobby_feed.subscribe(maxsize=settings.LOBBY_QUEUE_SIZE)
+        else:
+            # Подписываемся на общий для процесса канал
+            lobby_queue = await pubsub_dispatcher.subscribe(settings.REDIS_CHANNEL, maxsize=settings.LOBBY_QUEUE_SIZE)
 
-        while True:
-            try:
-                # Создаем задачи для параллельной обработки сообщений
-                websocket_task = asyncio.create_task(websocket.receive_json())
-                redis_task = asyncio.create_task(redis_manager.get_message())
-
-                # Ждем первое завершившееся событие
-                done, pending = await asyncio.wait([websocket_task, redis_task], return_when=asyncio.FIRST_COMPLETED)
-
-                # Отменяем оставшиеся задачи
-                for task in pending:
-                    task.cancel()
-                    try:
-                        await task
-                    except asyncio.CancelledError:
-                        pass
-
-                # Обрабатываем результат
-                for task in done:
-                    try:
-                        result = task.result()
-                        if result is None:
-                            continue
-
-                        if isinstance(result, dict) and "type" in result:
-                            # Определяем источник сообщения по задаче
-                            if task == websocket_task:
-                                await handle_websocket_message(result, user, redis_manager, websocket)
-                            else:
-                                await handle_redis_message(result, user, websocket)
-                    except WebSocketDisconnect:
-                        raise
-                    except asyncio.CancelledError:
-                        logger.info("Task cancelled")
-                        continue
-                    except Exception as e:
-                        logger.error(f"Error processing message: {e}")
-
-            except WebSocketDisconnect:
-                logger.info("WebSocket disconnected normally")
-                break
-            except Exception as e:
-                logger.error(f"Error in message processing loop: {e}")
-                break
+        # Читатель и писатель живут все время соединения, простаивающий сокет не тратит CPU
+        connection = LobbyConnection(websocket, lobby_queue)
+        await connection.run(
+            on_receive=lambda data: handle_websocket_message(data, user, redis_manager, websocket),
+            on_publish=lambda data: handle_redis_message(data, user, websocket),
+        )
 
     except WebSocketException as e:
         logger.error(f"WebSocket exception: {e}")
     except WebSocketDisconnect as e:
         logger.debug("WebSocket disconnected")
     except Exception as e:
-        logger.error(f"Error: {e}")
+        logger.error(f"Error in message processing loop: {e}")
     finally:
         try:
-            await redis_manager.unsubscribe_from_channel(settings.REDIS_CHANNEL)
+            if lobby_queue is not None and lobby_diff:
+                lobby_feed.unsubscribe(lobby_queue)
+            elif lobby_queue is not None:
+                await pubsub_dispatcher.unsubscribe(settings.REDIS_CHANNEL, lobby_queue)
             if websocket.state != WebSocketState.DISCONNECTED:
                 await websocket.close()
         except Exception as e:
@@ -149,27 +152,33 @@ async def handle_websocket_message(
     data: dict, user: User | None, redis_manager: RedisManager, websocket: WebSocket
 ) -> None:
     try:
-        match data["type"]:
-            case WebsocketMessageType.GAME_INVITE:
-                statistic = await get_statistic(user.id)
-                data["stats"] = statistic.model_dump()
-                await redis_manager.publish_to_channel(settings.REDIS_CHANNEL, orjson.dumps(data))
-            case WebsocketMessageType.GAME_JOINED:
-                await websocket.send_json(data)
-            case WebsocketMessageType.GAME_ENDED:
-                await websocket.send_json(data)
-            case WebsocketMessageType.GAME_WIN:
-                await websocket.send_json(data)
-            case "auth":
-                user = await JWTWebsocketAuth.validate(data["token"])
-            case _:
-                logger.warning(f"Unknown WebSocket message type received: {data['type']}")
+        # Запросы к базе при обработке сообщения выполняются в одной сессии
+        async with session_scope():
+            match data["type"]:
+                case WebsocketMessageType.GAME_INVITE:
+                    statistic = await get_statistic(user.id)
+                    data["stats"] = statistic.model_dump()
+                    await redis_manager.publish_to_channel(settings.REDIS_CHANNEL, orjson.dumps(data))
+                case WebsocketMessageType.GAME_JOINED:
+                    await websocket.send_json(data)
+                case WebsocketMessageType.GAME_ENDED:
+                    await websocket.send_json(data)
+                case WebsocketMessageType.GAME_WIN:
+                    await websocket.send_json(data)
+                case "auth":
+                    user = await JWTWebsocketAuth.validate(data["token"])
+                case _:
+                    logger.warning(f"Unknown WebSocket message type received: {data['type']}")
     except Exception as e:
         logger.error(f"Error handling WebSocket message: {e}")
 
 
-async def handle_redis_message(data: dict, user: User | None, websocket: WebSocket) -> None:
+async def handle_redis_message(data: dict | str, user: User | None, websocket: WebSocket) -> None:
     try:
+        if isinstance(data, str):
+            # Кадр ленты лобби, уже закодирован
+            await websocket.send_text(data)
+            return
         match data["type"]:
             case WebsocketMessageType.GAME_INVITE:
                 if user is None:
@@ -178,6 +187,9 @@ async def handle_redis_message(data: dict, user: User | None, websocket: WebSock
                 if user.username != data.get("targetPlayer"):
                     return
                 await websocket.send_json(data)
+            case WebsocketMessageType.MATCH_FOUND:
+                if user is not None and f"{user.id}" in data.get("playersIds", ()):
+                    await websocket.send_json(data)
             case _:
                 await websocket.send_json(data)
                 logger.warning(f"Unknown Redis message type received: {data['type']}")
@@ -200,19 +212,42 @@ async def websocket_game_endpoint(game_id: str, websocket: WebSocket) -> None:
         WebSocketDisconnect: При разрыве соединения
         ConnectionClosed: При закрытии соединения
     """
-    if (game := game_cache_manager.get(game_id)) is None:
+    await websocket.accept()
+    if (game := await game_cache_manager.get(game_id)) is None:
         await websocket.send_json({"type": "Error", "message": "Game not found"})
         await websocket.close()
         return
 
-    await websocket.accept()
     await websocket.send_json({"type": "auth"})
 
+    user = None
+    connected = False
     try:
         token_message = await websocket.receive_json()
-        user = await JWTWebsocketAuth.validate(token_message["token"])
-        websocket_manager = game.websocket_manager
-        await websocket_manager.add(user, websocket=websocket)
+        async with session_scope():
+            user = await JWTWebsocketAuth.validate(token_message["token"])
+        # Only the players get the events and the snapshots of the game, as from GET /games/{game_id}/events.
+        # The game is read again, the player may have joined it after it was read
+        if user is None or (
+            f"{user.id}" not in game.players_state
+            and ((game := await game_cache_manager.get(game_id)) is None or f"{user.id}" not in game.players_state)
+        ):
+            await websocket.send_json({"type": "Error", "message": "You are not a player of this game"})
+            await websocket.close()
+            return
+        # Ходы и сообщения приходят через канал игры, игроки могут быть подключены к разным воркерам
+        # lastEventId передаётся при переподключении, пропущенные события отправляются из лога игры
+        # protocol: "delta" - ходы приходят дельтами, состояние игры снимком при подключении и при пропуске хода
+        await game_sessions.connect(
+            game_id,
+            user,
+            websocket,
+            last_event_id=token_message.get("lastEventId"),
+            protocol=token_message.get("protocol"),
+        )
+        connected = True
+        if game.is_bot_turn:
+            await game_cache_manager.make_bot_move(game_id)
 
         while True:
             try:
@@ -224,27 +259,28 @@ async def websocket_game_endpoint(game_id: str, websocket: WebSocket) -> None:
                 match data["type"]:
                     case "sendChatMessage":
                         data["type"] = "chatMessage"
-                        await websocket_manager.broadcast_json(data)
+                        await game_cache_manager.publish_game_event(game_id, data)
                     case "makeMove":
-                        game_state = await game.player_set_item(user, data["cellIndex"])
-                        data["type"] = "gameState"
-                        data["gameState"] = game_state.to_dict()
-                        await websocket_manager.broadcast_json(data)
+                        await game_cache_manager.make_move(game_id, user, data["cellIndex"])
+                    case "resync":
+                        await game_sessions.resync(game_id, user)
                     case "closeGame":
-                        game_cache_manager.close_game(game_id)
+                        await game_cache_manager.close_game(game_id, user.id)
                         await websocket.close()
                         break
                     case _:
                         logger.warning(f"Unknown message type received: {data['type']}")
 
+            except BaseGameError as e:
+                await websocket.send_json({"type": "Error", "message": e.message})
             except WebSocketDisconnect:
                 logger.info(f"WebSocket disconnected for user {user}")
-                await websocket_manager.remove(user)
-                if not websocket_manager.active_connections:
-                    game_cache_manager.close_game(game_id)
                 break
 
     except Exception as e:
         logger.error(f"Authentication or connection error: {e}")
         await websocket.close()
-        return
+    finally:
+        # The socket rejected by `connect`, e.g. the second one of the user, does not remove the connected one
+        if connected:
+            await game_sessions.disconnect(game_id, user, websocket)
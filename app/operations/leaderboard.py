@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+
+from redis.exceptions import RedisError
+from sqlalchemy import exists, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache.leaderboard import Leaderboard, leaderboard
+from app.settings import settings
+from database.base import session_connection
+from database.models import GameResult, User, UserStatistic
+
+logger = logging.getLogger(__name__)
+
+
+async def _ranked_users(session: AsyncSession, chunk_size: int) -> AsyncIterator[list[tuple[str, str, float]]]:
+    """(user id, username, rating) of the rated users, streamed in chunks.
+
+    As on the statistic flush, only the games of two users are rated, so the users who have played the bot only are
+    not ranked.
+    """
+    rated = or_(
+        exists().where(GameResult.first_player_id == UserStatistic.user_id),
+        exists().where(GameResult.second_player_id == UserStatistic.user_id),
+    )
+    stmt = (
+        select(UserStatistic.user_id, User.username, UserStatistic.rating)
+        .join(User, User.id == UserStatistic.user_id)
+        .where(rated)
+        .execution_options(yield_per=chunk_size)
+    )
+    result = await session.stream(stmt)
+    async for partition in result.partitions():
+        yield [(f"{user_id}", username, rating) for user_id, username, rating in partition]
+
+
+@session_connection
+async def reconcile_leaderboard(session: AsyncSession, board: Leaderboard = leaderboard) -> int:
+    """Rebuild the leaderboard from the database.
+
+    Returns:
+        int: number of the users on the leaderboard
+    """
+    return await board.replace(_ranked_users(session, settings.RATING_RECOMPUTE_CHUNK))
+
+
+class LeaderboardReconciler:
+    """Rebuilds the leaderboard on start and every `interval` seconds.
+
+    The ratings are written to the leaderboard on every statistic flush, the rebuild repairs the drift, e.g. after
+    Redis has lost the data. The workers take the ``lock_key`` lock, so one of them rebuilds it per interval.
+    """
+
+    lock_key = "leaderboard:reconcile"
+
+    def __init__(self, board: Leaderboard = leaderboard, interval: float = settings.LEADERBOARD_RECONCILE_INTERVAL):
+        self.board = board
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="leaderboard-reconciler")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def reconcile(self) -> int | None:
+        """Rebuild the leaderboard unless another worker has rebuilt it within the interval."""
+        try:
+            if not await self.board.redis.set(self.lock_key, 1, nx=True, ex=max(int(self.interval), 1)):
+                return None
+        except RedisError as e:
+            logger.warning("Failed to lock the leaderboard rebuild: %s", e)
+            return None
+        count = await reconcile_leaderboard(board=self.board)
+        logger.info("Leaderboard rebuilt, %s users", count)
+        return count
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error("Failed to rebuild the leaderboard: %s", e, exc_info=True)
+            await asyncio.sleep(self.interval)
+
+
+leaderboard_reconciler = LeaderboardReconciler()
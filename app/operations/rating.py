@@ -0,0 +1,73 @@
+"""Full recompute of the ratings from the history of the games.
+
+Run from the repository root::
+
+    python -m app.operations.rating
+"""
+
+import asyncio
+import logging
+
+from sqlalchemy import select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache.statistic_cache import statistic_cache
+from app.engine.rating import INITIAL_RATING, Rating, rate_game
+from app.operations.statistic import save_ratings
+from app.settings import settings
+from database.base import session_connection
+from database.models import GameResult, UserStatistic
+
+logger = logging.getLogger(__name__)
+
+
+@session_connection
+async def recompute_ratings(session: AsyncSession, chunk_size: int = settings.RATING_RECOMPUTE_CHUNK) -> int:
+    """Rebuild the ratings of all the users by rating the games in the finish order.
+
+    The history is streamed by a server-side cursor in chunks of `chunk_size` games, only the ratings of the users
+    are kept in memory. The ratings are written in the same transaction, in chunks of `chunk_size` users.
+
+    Returns:
+        int: number of the rated games
+    """
+    # The statistic is read-only until the commit, the games flushed meanwhile are rated after the recompute
+    await session.execute(text(f"LOCK TABLE {UserStatistic.__tablename__} IN EXCLUSIVE MODE"))
+    stmt = (
+        select(GameResult.first_player_id, GameResult.second_player_id, GameResult.winner_id)
+        .order_by(GameResult.finished_at, GameResult.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    ratings: dict[str, Rating] = {}
+    games_count = 0
+    result = await session.stream(stmt)
+    async for partition in result.partitions():
+        for first_player_id, second_player_id, winner_id in partition:
+            first_id, second_id = f"{first_player_id}", f"{second_player_id}"
+            first_score = 0.5 if winner_id is None else float(winner_id == first_player_id)
+            first = ratings.get(first_id, INITIAL_RATING)
+            second = ratings.get(second_id, INITIAL_RATING)
+            ratings[first_id], ratings[second_id] = rate_game(first, second, first_score)
+        games_count += len(partition)
+        logger.info("Rated %s games", games_count)
+
+    await session.execute(
+        update(UserStatistic).values(rating=INITIAL_RATING.rating, rating_deviation=INITIAL_RATING.deviation)
+    )
+    users_ids = list(ratings)
+    for start in range(0, len(users_ids), chunk_size):
+        chunk = users_ids[start : start + chunk_size]
+        await save_ratings({user_id: ratings[user_id] for user_id in chunk}, session)
+    await session.commit()
+
+    for start in range(0, len(users_ids), chunk_size):
+        try:
+            await statistic_cache.delete(*users_ids[start : start + chunk_size])
+        except ValueError as e:
+            logger.warning("Statistic cache is not available: %s", e)
+    return games_count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Rated {asyncio.run(recompute_ratings())} games")
@@ -1,44 +1,361 @@
-from sqlalchemy import insert, select, update
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from sqlalchemy import Float, Integer, Uuid, column, select, update, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.cache.leaderboard import leaderboard
+from app.cache.statistic_cache import statistic_cache
+from app.engine.rating import INITIAL_RATING, Rating, rate_game
 from app.schemas import UserStatisticRead
+from app.settings import settings
 from database.base import session_connection
-from database.models import UserStatistic
+from database.models import GameResult, User, UserStatistic
+
+logger = logging.getLogger(__name__)
+
+
+async def get_statistic(user_id: str) -> UserStatisticRead:
+    """Read-through: the database is queried only when the statistic is not cached."""
+    version = None
+    try:
+        statistic, version = await statistic_cache.get(user_id)
+        if statistic is not None:
+            return statistic
+    except ValueError as e:
+        logger.warning("Statistic cache is not available: %s", e)
+
+    statistic = await load_statistic(user_id)
+    if version is None:
+        return statistic
+    try:
+        # Not cached if the statistic has been flushed since the cache miss
+        await statistic_cache.fill(user_id, statistic, version)
+    except ValueError as e:
+        logger.warning("Statistic cache is not available: %s", e)
+    return statistic
 
 
 @session_connection
-async def get_statistic(user_id: str, session: AsyncSession) -> UserStatisticRead:
+async def load_statistic(user_id: str, session: AsyncSession) -> UserStatisticRead:
     stmt = select(UserStatistic).where(UserStatistic.user_id == user_id)
     result = await session.execute(stmt)
-    statistic = result.scalar_one_or_none()
-    if statistic is None:
-        await create_statistic(user_id, session)
-        return await get_statistic(user_id, session)
+    if (statistic := result.scalar_one_or_none()) is None:
+        # The row is created on registration, this is the fallback for the users registered before that
+        stmt = (
+            insert(UserStatistic)
+            .values(user_id=user_id, games_total=0, games_win=0, games_loose=0)
+            .on_conflict_do_update(index_elements=[UserStatistic.user_id], set_={"user_id": user_id})
+            .returning(UserStatistic)
+        )
+        result = await session.execute(stmt)
+        statistic = result.scalar_one()
     return UserStatisticRead.model_validate(statistic)
 
 
+async def update_statistic(user_id: str, winner: bool = False, looses: bool = False) -> None:
+    """Count the finished game. The change is written to the database by `statistic_writer` in batches."""
+    statistic_writer.record(user_id, winner=winner, looses=looses)
+
+
+class FinishedGame(NamedTuple):
+    game_id: str
+    first_player_id: str
+    second_player_id: str
+    # None for a draw
+    winner_id: str | None
+    finished_at: datetime
+
+    @property
+    def first_score(self) -> float:
+        if self.winner_id is None:
+            return 0.5
+        return 1.0 if self.winner_id == self.first_player_id else 0.0
+
+
+async def update_game_statistic(
+    game_id: str, first_player_id: str, second_player_id: str, winner_id: str | None
+) -> None:
+    """Count the finished game of two users and rate it. Written by `statistic_writer` in batches."""
+    statistic_writer.record_game(
+        FinishedGame(game_id, first_player_id, second_player_id, winner_id, datetime.now(timezone.utc))
+    )
+
+
 @session_connection
-async def update_statistic(user_id: str, session: AsyncSession, winner: bool = False, looses: bool = False) -> None:
+async def apply_statistic_increments(
+    increments: dict[str, list[int]], session: AsyncSession, games: list[FinishedGame] | None = None
+) -> dict[str, tuple[str, float]]:
+    """Add the counters of many users with a single UPDATE, save the finished games and update the ratings.
+
+    The ratings of the players are locked while the games are rated in their order, so the workers flushing
+    at the same time do not lose the updates of each other.
+
+    Args:
+        increments (dict[str, list[int]]): user id -> [games_total, games_win, games_loose] increments
+        games (list[FinishedGame] | None): finished games of two users in the finish order
+
+    Returns:
+        dict[str, tuple[str, float]]: user id -> (username, rating) of the rated players
+    """
+    users_ids = {*increments}
+    for game in games or ():
+        users_ids.update((game.first_player_id, game.second_player_id))
+    await create_missing_statistics(users_ids, session)
+    rated = {}
+    if games:
+        await session.execute(insert(GameResult).values([game._asdict() for game in games]))
+        rated = await update_ratings(games, session)
+    if not increments:
+        await session.commit()
+        return rated
+
+    rows = values(
+        column("user_id", Uuid),
+        column("games_total", Integer),
+        column("games_win", Integer),
+        column("games_loose", Integer),
+        name="increments",
+    ).data([(user_id, *counters) for user_id, counters in increments.items()])
     stmt = (
         update(UserStatistic)
-        .where(UserStatistic.user_id == user_id)
+        .where(UserStatistic.user_id == rows.c.user_id)
         .values(
-            games_total=UserStatistic.games_total + 1,
-            games_win=UserStatistic.games_win + 1 if winner else UserStatistic.games_win,
-            games_loose=UserStatistic.games_loose + 1 if looses else UserStatistic.games_loose,
+            games_total=UserStatistic.games_total + rows.c.games_total,
+            games_win=UserStatistic.games_win + rows.c.games_win,
+            games_loose=UserStatistic.games_loose + rows.c.games_loose,
         )
     )
     await session.execute(stmt)
     await session.commit()
+    return rated
+
+
+async def create_missing_statistics(users_ids: set[str], session: AsyncSession) -> None:
+    """Create the statistic rows of the users registered before the row was created on registration.
+
+    The deleted users are skipped, so their updates are not applied.
+    """
+    stmt = (
+        select(User.id)
+        .outerjoin(UserStatistic, UserStatistic.user_id == User.id)
+        .where(User.id.in_(users_ids), UserStatistic.id.is_(None))
+    )
+    if missing := (await session.scalars(stmt)).all():
+        stmt = (
+            insert(UserStatistic)
+            .values([{"user_id": user_id, "games_total": 0, "games_win": 0, "games_loose": 0} for user_id in missing])
+            .on_conflict_do_nothing(index_elements=[UserStatistic.user_id])
+        )
+        await session.execute(stmt)
+
+
+async def update_ratings(games: list[FinishedGame], session: AsyncSession) -> dict[str, tuple[str, float]]:
+    """Rate the games in their order and save the new ratings of the players.
+
+    Returns:
+        dict[str, tuple[str, float]]: user id -> (username, rating) of the players
+    """
+    players_ids = {player_id for game in games for player_id in (game.first_player_id, game.second_player_id)}
+    stmt = (
+        select(UserStatistic.user_id, UserStatistic.rating, UserStatistic.rating_deviation, User.username)
+        .join(User, User.id == UserStatistic.user_id)
+        .where(UserStatistic.user_id.in_(players_ids))
+        .order_by(UserStatistic.user_id)
+        .with_for_update(of=UserStatistic)
+    )
+    ratings, usernames = {}, {}
+    for user_id, rating, deviation, username in await session.execute(stmt):
+        ratings[f"{user_id}"] = Rating(rating, deviation)
+        usernames[f"{user_id}"] = username
+    for game in games:
+        first = ratings.get(game.first_player_id, INITIAL_RATING)
+        second = ratings.get(game.second_player_id, INITIAL_RATING)
+        ratings[game.first_player_id], ratings[game.second_player_id] = rate_game(first, second, game.first_score)
+    await save_ratings(ratings, session)
+    return {user_id: (usernames[user_id], ratings[user_id].rating) for user_id in usernames}
+
+
+async def save_ratings(ratings: dict[str, Rating], session: AsyncSession) -> None:
+    if not ratings:
+        return
+    rows = values(
+        column("user_id", Uuid),
+        column("rating", Float),
+        column("rating_deviation", Float),
+        name="ratings",
+    ).data([(user_id, rating.rating, rating.deviation) for user_id, rating in ratings.items()])
+    stmt = (
+        update(UserStatistic)
+        .where(UserStatistic.user_id == rows.c.user_id)
+        .values(rating=rows.c.rating, rating_deviation=rows.c.rating_deviation)
+    )
+    await session.execute(stmt)
+
+
+class StatisticWriter:
+    """Write-behind aggregator of the statistic updates.
+
+    Increments are summed per user in memory and flushed in one transaction every `flush_interval` seconds
+    or as soon as `flush_size` users are pending. A failed flush keeps the increments for the next one, an update
+    failed `max_retries` times is dropped and logged. When a batch with games fails, the counters are flushed without
+    the games and the games are rated one by one, so a game which can't be saved does not hold the others.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = settings.STATISTIC_FLUSH_INTERVAL,
+        flush_size: int = settings.STATISTIC_FLUSH_SIZE,
+        max_retries: int = settings.STATISTIC_FLUSH_RETRIES,
+    ):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_retries = max_retries
+        self._pending: dict[str, list[int]] = {}
+        self._games: list[FinishedGame] = []
+        # user id or game id -> failed flushes
+        self._retries: dict[str, int] = {}
+        self._flush_requested = asyncio.Event()
+        self._stopping = False
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def record(self, user_id: str, winner: bool = False, looses: bool = False) -> None:
+        counters = self._pending.get(f"{user_id}")
+        if counters is None:
+            counters = self._pending[f"{user_id}"] = [0, 0, 0]
+        counters[0] += 1
+        counters[1] += winner
+        counters[2] += looses
+        if len(self._pending) >= self.flush_size:
+            self._flush_requested.set()
+
+    def record_game(self, game: FinishedGame) -> None:
+        """Count the game of two users, it is rated on the flush."""
+        self._games.append(game)
+        for player_id in (game.first_player_id, game.second_player_id):
+            winner = game.winner_id is not None and game.winner_id == player_id
+            looses = game.winner_id is not None and game.winner_id != player_id
+            self.record(player_id, winner=winner, looses=looses)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="statistic-writer")
+
+    async def stop(self) -> None:
+        """Flush the pending updates and stop. The flush in progress is awaited, cancelling it would lose its batch."""
+        if self._task is not None:
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending and not self._games:
+                return
+            pending, self._pending = self._pending, {}
+            games, self._games = self._games, []
+            try:
+                rated = await apply_statistic_increments(pending, games=games)
+            except Exception as e:
+                if not games:
+                    logger.error("Failed to flush %s statistic updates: %s", len(pending), e, exc_info=True)
+                    self._retry(pending, [])
+                    return
+                logger.warning("Failed to flush the statistic with %s games, rating them one by one: %s", len(games), e)
+                try:
+                    rated = await apply_statistic_increments(pending) if pending else {}
+                except Exception as e:
+                    logger.error("Failed to flush %s statistic updates: %s", len(pending), e, exc_info=True)
+                    self._retry(pending, games)
+                    return
+                rated.update(await self._rate_games(games))
+            for user_id in pending:
+                self._retries.pop(user_id, None)
+        try:
+            await statistic_cache.delete(*pending)
+        except ValueError as e:
+            logger.warning("Statistic cache is not available: %s", e)
+        try:
+            await leaderboard.update(rated)
+        except ValueError as e:
+            # The leaderboard is repaired by `leaderboard_reconciler`
+            logger.warning("Leaderboard is not available: %s", e)
+
+    async def _rate_games(self, games: list[FinishedGame]) -> dict[str, tuple[str, float]]:
+        rated, failed = {}, []
+        for game in games:
+            try:
+                rated.update(await apply_statistic_increments({}, games=[game]))
+                self._retries.pop(game.game_id, None)
+            except Exception as e:
+                logger.error("Failed to save the game %s: %s", game.game_id, e)
+                failed.append(game)
+        self._retry({}, failed)
+        return rated
+
+    def _retry(self, pending: dict[str, list[int]], games: list[FinishedGame]) -> None:
+        """Keep the failed updates for the next flush, the ones failed `max_retries` times are dropped."""
+        for user_id, counters in pending.items():
+            if not self._failed(user_id):
+                logger.error("Dropped the statistic update %s of the user %s", counters, user_id)
+                continue
+            current = self._pending.setdefault(user_id, [0, 0, 0])
+            for index, value in enumerate(counters):
+                current[index] += value
+        kept = []
+        for game in games:
+            if self._failed(game.game_id):
+                kept.append(game)
+            else:
+                logger.error("Dropped the finished game %s", game)
+        self._games[:0] = kept
+
+    def _failed(self, key: str) -> bool:
+        """Count the failed flush of the update, False if it has to be dropped."""
+        retries = self._retries[key] = self._retries.get(key, 0) + 1
+        if retries <= self.max_retries:
+            return True
+        del self._retries[key]
+        return False
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to flush the statistic: %s", e, exc_info=True)
+
+
+statistic_writer = StatisticWriter()
 
 
 @session_connection
 async def create_statistic(user_id: str, session: AsyncSession) -> None:
-    stmt = insert(UserStatistic).values(
-        user_id=user_id,
-        games_total=0,
-        games_win=0,
-        games_loose=0,
+    stmt = (
+        insert(UserStatistic)
+        .values(
+            user_id=user_id,
+            games_total=0,
+            games_win=0,
+            games_loose=0,
+        )
+        .on_conflict_do_nothing(index_elements=[UserStatistic.user_id])
     )
     await session.execute(stmt)
     await session.commit()
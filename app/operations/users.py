@@ -1,7 +1,8 @@
-from sqlalchemy import select
+from sqlalchemy import Select, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.operations.statistic import get_statistic
+from app.operations.statistic import load_statistic
+from app.schemas import UserStatisticRead
 from database.base import session_connection
 from database.models import User, UserStatistic
 
@@ -11,7 +12,6 @@ async def get_user_by_id(uid: str, session: AsyncSession) -> User | None:
     stmt = select(User).where(User.id == uid)
     result = await session.execute(stmt)
     user = result.scalar_one_or_none()
-    print(user)
     return user
 
 
@@ -23,12 +23,28 @@ async def get_user_by_username(username: str, session: AsyncSession) -> User | N
     return user
 
 
-@session_connection
-async def get_user_and_statistic_by_username(username: str, session: AsyncSession) -> tuple[User, UserStatistic] | None:
-    stmt = select(User).where(User.username == username)
+def _select_user_and_statistic() -> Select:
+    return select(User, UserStatistic).outerjoin(UserStatistic, UserStatistic.user_id == User.id)
+
+
+async def _user_and_statistic(stmt: Select, session: AsyncSession) -> tuple[User, UserStatisticRead] | None:
+    """The user and the statistic are read by one query, the statistic row is created when it is missing."""
     result = await session.execute(stmt)
-    user = result.scalar_one_or_none()
-    if user is None:
-        return
-    statistic = await get_statistic(user.id, session)
-    return user, statistic
+    if (row := result.one_or_none()) is None:
+        return None
+    user, statistic = row
+    if statistic is None:
+        return user, await load_statistic(user.id)
+    return user, UserStatisticRead.model_validate(statistic)
+
+
+@session_connection
+async def get_user_and_statistic_by_id(uid: str, session: AsyncSession) -> tuple[User, UserStatisticRead] | None:
+    return await _user_and_statistic(_select_user_and_statistic().where(User.id == uid), session)
+
+
+@session_connection
+async def get_user_and_statistic_by_username(
+    username: str, session: AsyncSession
+) -> tuple[User, UserStatisticRead] | None:
+    return await _user_and_statistic(_select_user_and_statistic().where(User.username == username), session)
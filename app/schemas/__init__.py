@@ -1,4 +1,6 @@
 from .game import Game, GameCreate, GameJoin, GameListRead
+from .leaderboard import LeaderboardEntry, LeaderboardPage
+from .matchmaking import MatchmakingTicket
 from .player import Player
 from .statistic import UserStatisticRead
 from .user import UserCreate, UserRead, UserUpdate
@@ -1,15 +1,35 @@
-from uuid import uuid4
+import struct
+from functools import lru_cache
+from uuid import UUID, uuid4
 
 import orjson
 from pydantic import BaseModel
 
-from app.exceptions import GameIsNotCreated
+from app.engine import Bitboard, MoveResult
+from app.engine.solver import positions_table
+from app.exceptions import GameIsNotCreated, MoveIsNotAllowed
 from app.helpers import GameItems
 from app.schemas.player import Player
-from app.websockets.manager import WebsocketConnectionManager
+from app.settings import settings
 from database.models import User
 
 
+BOT_PLAYER_ID = f"{UUID(int=0)}"
+
+# Binary format of the game stored in Redis, all the numbers are big-endian:
+#   header: version (B), flags (B), X mask (H), O mask (H), seq (I), game id (16s), first player id (16s)
+#   name and first player username: length (H) + UTF-8 bytes each
+#   second player, present when GAME_FLAG_SECOND_PLAYER is set: id (16s), username length (H) + UTF-8 bytes
+# JSON documents start with `{` (0x7B), so the version byte tells the formats apart
+GAME_FORMAT_VERSION = 1
+GAME_FLAG_ACTIVE = 0x01
+GAME_FLAG_SECOND_PLAYER = 0x02
+GAME_FLAG_FIRST_ITEM_O = 0x04
+_GAME_HEADER = struct.Struct(">BBHHI16s16s")
+_STRING_LENGTH = struct.Struct(">H")
+_SECOND_PLAYER_ID = struct.Struct(">16s")
+
+
 class GameRead(BaseModel):
     id: str
     gameName: str
@@ -23,6 +43,7 @@ class GameRead(BaseModel):
 class GameListRead(BaseModel):
     gamesList: list[GameRead]
     userName: str
+    nextCursor: str | None = None
 
 
 class GameCreate(BaseModel):
@@ -34,6 +55,16 @@ class GameState(BaseModel):
     winner: str | None = None
     finished: bool = False
 
+    class Config:
+        frozen = True
+
+    def to_dict(self) -> dict:
+        return self.model_dump()
+
+
+GAME_CONTINUES = GameState()
+GAME_DRAW = GameState(finished=True)
+
 
 class GameJoin(BaseModel):
     gameId: str
@@ -48,34 +79,19 @@ class Game:
         "first_player",
         "second_player",
         "is_active",
-        "_player_turn",
-        "_available_indexes",
-        "_win_patterns",
+        "board",
+        "seq",
         "_first_player_item",
         "_second_player_item",
-        "game_state",
         "players_state",
-        "websocket_manager",
     )
 
     id: str = ""
     name: str = ""
     first_player: Player | None = None
     second_player: Player | None = None
+    # Is the game waiting for the second player
     is_active: bool = False
-    # Is the game currently active
-    _player_turn: GameItems = GameItems.X
-    _available_indexes: list[int] = [0, 1, 2, 3, 4, 5, 6, 7, 8]
-    _win_patterns: list[list[int, int, int]] = [
-        [0, 1, 2],
-        [3, 4, 5],
-        [6, 7, 8],
-        [0, 3, 6],
-        [1, 4, 7],
-        [2, 5, 8],
-        [0, 4, 8],
-        [2, 4, 6],
-    ]
 
     def __init__(
         self, user: User | None = None, game_name: str | None = None, user_item: GameItems | None = GameItems.X
@@ -88,27 +104,60 @@ class Game:
         self._first_player_item = user_item
         self._second_player_item = GameItems.O if user_item == GameItems.X else GameItems.X
 
-        player = Player(id=user.id, username=user.username, item=self._first_player_item) if user else None
+        player = Player(id=f"{user.id}", username=user.username, item=self._first_player_item) if user else None
         self.first_player = player
 
-        self.game_state = dict().fromkeys(self._available_indexes, "")
-        self.players_state: dict[str, Player] = {user.id: player} if user else {}
-
-        self.websocket_manager = WebsocketConnectionManager()
+        self.board = Bitboard()
+        # Number of the moves made, increased by every state change of the board
+        self.seq = 0
+        self.players_state: dict[str, Player] = {player.id: player} if player else {}
 
     @classmethod
     def create(cls, user: User, game_data: GameCreate) -> "Game":
         return cls(user, game_data.gameName, game_data.currentPlayerItem)
 
+    @property
+    def _player_turn(self) -> GameItems:
+        return self.board.turn
+
+    @property
+    def game_state(self) -> dict[int, str]:
+        return dict(enumerate(self.board.to_list()))
+
+    @property
+    def state(self) -> GameState:
+        """State of the game derived from the board."""
+        if (item := self.board.winner) is not None:
+            winner = next((player.id for player in self.players_state.values() if player.item == item), None)
+            return GameState(winner=winner, finished=True)
+        return GAME_DRAW if self.board.is_finished else GAME_CONTINUES
+
     async def join_player(self, user: User) -> bool:
-        if self.is_active or self.second_player or user is None or self.first_player.id == user.id:
+        if not self.is_active or self.second_player or user is None or self.first_player.id == f"{user.id}":
             raise GameIsNotCreated("Game is not active or user is already in the game")
-        player = Player(id=f"{user.id}", username=user.username, item=self._first_player_item)
+        player = Player(id=f"{user.id}", username=user.username, item=self._second_player_item)
         self.second_player = player
-        self.players_state[user.id] = player
-        self.is_active = True
+        self.players_state[player.id] = player
+        self.is_active = False
         return True
 
+    def join_bot(self) -> None:
+        """Put the built-in bot into the second seat. The game is not shown in the lobby."""
+        if self.second_player:
+            raise GameIsNotCreated("The game already has the second player")
+        player = Player(id=BOT_PLAYER_ID, username=settings.BOT_USERNAME, item=self._second_player_item)
+        self.second_player = player
+        self.players_state[player.id] = player
+        self.is_active = False
+
+    @property
+    def is_bot_game(self) -> bool:
+        return self.second_player is not None and self.second_player.id == BOT_PLAYER_ID
+
+    @property
+    def is_bot_turn(self) -> bool:
+        return self.is_bot_game and not self.board.is_finished and self.board.turn == self._second_player_item
+
     async def player_set_item(self, user: User, cell_index: int) -> GameState:
         """Метод для установки значения в ячейку.
 
@@ -116,29 +165,51 @@ class Game:
             user (User): Пользователь, который делает ход
             cell_index (int): Индекс ячейки, в которую будет установлено значение
 
+        Raises:
+            MoveIsNotAllowed: Пользователь не участвует в игре, ход другого игрока или ячейка недоступна
+            GameIsFinished: Игра уже закончена
+
         Returns:
-            GameState: ID следующего игрока, который выиграл или None, если игра не закончена
+            GameState: ID игрока, который выиграл или None, если игра не закончена
         """
-        player = self.players_state.get(user.id)
-        assert player is None, "Данный пользователь не имеет права устанавливать значения"
-        assert player.item == self._player_turn, "Ход разрешен другому игроку"
-        assert cell_index in self._available_indexes, "Передано неверное значение ячейки"
-        assert self.game_state[cell_index] == "", "Попытка поставить значение, в уже занятую ячейку"
-
-        finished: bool = False
-        winner: str | None = None
-        self.game_state[cell_index] = player.item
-        current_values = [set_item[0] for set_item in self.game_state.items() if set_item[1] == player.item]
-
-        if len(current_values) >= 3:
-            if current_values in self._win_patterns:
-                winner = player.id
-                finished = True
-            elif not list(filter(lambda x: self.game_state[x] == "", self.game_state)):
-                finished = True
-
-        self._player_turn = GameItems.O if self._player_turn == GameItems.X else GameItems.X
-        return GameState(winner=winner, finished=finished)
+        return self.player_id_set_item(f"{user.id}", cell_index)
+
+    def player_id_set_item(self, player_id: str, cell_index: int) -> GameState:
+        """Same as `player_set_item` for the player id, e.g. for the move forwarded by another worker."""
+        player = self.players_state.get(player_id)
+        if player is None or player.id == BOT_PLAYER_ID:
+            raise MoveIsNotAllowed("Данный пользователь не имеет права устанавливать значения")
+        return self._set_item(player, cell_index)
+
+    def replay_move(self, cell_index: int, item: GameItems) -> None:
+        """Apply the move read from the log of the game, e.g. to catch up the snapshot stored in Redis."""
+        self.board.play(cell_index, item)
+        self.seq += 1
+
+    async def bot_set_item(self) -> tuple[int, GameState]:
+        """Ход бота из таблицы решенных позиций.
+
+        Raises:
+            MoveIsNotAllowed: Игра без бота или сейчас ход другого игрока
+
+        Returns:
+            tuple[int, GameState]: Индекс ячейки, выбранной ботом, и состояние игры
+        """
+        if not self.is_bot_turn:
+            raise MoveIsNotAllowed("It is not the bot's turn")
+        cell_index = positions_table.best_move(self.board)
+        return cell_index, self._set_item(self.second_player, cell_index)
+
+    def _set_item(self, player: Player, cell_index: int) -> GameState:
+        if self.second_player is None:
+            raise MoveIsNotAllowed("The game has not started yet, waiting for the second player")
+        result = self.board.play(cell_index, player.item)
+        self.seq += 1
+        if result is MoveResult.CONTINUE:
+            return GAME_CONTINUES
+        if result is MoveResult.DRAW:
+            return GAME_DRAW
+        return GameState(winner=player.id, finished=True)
 
     def dump(self) -> dict:
         return {
@@ -181,6 +252,83 @@ class Game:
         game.players_state = {player.id: player for player in (first_player, second_player) if player}
         return game
 
+    def dump_bytes(self) -> bytes:
+        """Full state of the game in the versioned binary format, see `GAME_FORMAT_VERSION`."""
+        flags = GAME_FLAG_ACTIVE if self.is_active else 0
+        if self._first_player_item == GameItems.O:
+            flags |= GAME_FLAG_FIRST_ITEM_O
+        if self.second_player:
+            flags |= GAME_FLAG_SECOND_PLAYER
+        name = (self.name or "").encode()
+        first_username = self.first_player.username.encode()
+        data = (
+            _GAME_HEADER.pack(
+                GAME_FORMAT_VERSION,
+                flags,
+                self.board.x_mask,
+                self.board.o_mask,
+                self.seq,
+                _uuid_to_bytes(self.id),
+                _uuid_to_bytes(self.first_player.id),
+            )
+            + len(name).to_bytes(2, "big")
+            + name
+            + len(first_username).to_bytes(2, "big")
+            + first_username
+        )
+        if self.second_player:
+            second_username = self.second_player.username.encode()
+            data += _uuid_to_bytes(self.second_player.id) + len(second_username).to_bytes(2, "big") + second_username
+        return data
+
+    @classmethod
+    def load_bytes(cls, data: bytes) -> "Game":
+        version, flags, x_mask, o_mask, seq, game_id, first_player_id = _GAME_HEADER.unpack_from(data)
+        if version != GAME_FORMAT_VERSION:
+            raise ValueError(f"Unsupported game format version: {version}")
+        offset = _GAME_HEADER.size
+        name, offset = _unpack_string(data, offset)
+        first_username, offset = _unpack_string(data, offset)
+
+        first_item, second_item = (
+            (GameItems.O, GameItems.X) if flags & GAME_FLAG_FIRST_ITEM_O else (GameItems.X, GameItems.O)
+        )
+        first_player = Player(id=_uuid_from_bytes(first_player_id), username=first_username, item=first_item)
+        second_player = None
+        if flags & GAME_FLAG_SECOND_PLAYER:
+            (second_player_id,) = _SECOND_PLAYER_ID.unpack_from(data, offset)
+            second_username, offset = _unpack_string(data, offset + _SECOND_PLAYER_ID.size)
+            second_player = Player(id=_uuid_from_bytes(second_player_id), username=second_username, item=second_item)
+
+        game = cls.__new__(cls)
+        game.id = _uuid_from_bytes(game_id)
+        game.name = name
+        game.is_active = bool(flags & GAME_FLAG_ACTIVE)
+        game.board = Bitboard(x_mask, o_mask)
+        game.seq = seq
+        game._first_player_item = first_item
+        game._second_player_item = second_item
+        game.first_player = first_player
+        game.second_player = second_player
+        game.players_state = {player.id: player for player in (first_player, second_player) if player}
+        return game
+
+    @classmethod
+    def decode(cls, data: bytes | str) -> "Game":
+        """Load the game stored in either the binary or the legacy JSON format."""
+        if isinstance(data, str) or data[:1] == b"{":
+            return cls.load(orjson.loads(data))
+        try:
+            return cls.load_bytes(data)
+        except struct.error as e:
+            raise ValueError(f"Corrupted game data: {e}")
+
+    @classmethod
+    def decode_read(cls, data: bytes | str) -> GameRead:
+        if isinstance(data, str) or data[:1] == b"{":
+            return cls.to_read(orjson.loads(data))
+        return cls.decode(data).dump_model()
+
     @classmethod
     def to_read(cls, data: dict) -> GameRead:
         first_player = Player.load(data["first_player"])
@@ -194,3 +342,23 @@ class Game:
             secondPlayerItem=second_player.item.value if second_player else None,
             isActive=data["is_active"],
         )
+
+
+def _unpack_string(data: bytes, offset: int) -> tuple[str, int]:
+    (length,) = _STRING_LENGTH.unpack_from(data, offset)
+    offset += _STRING_LENGTH.size
+    return data[offset : offset + length].decode(), offset + length
+
+
+# The same game and player ids are converted on every save and load of the game
+@lru_cache(maxsize=65536)
+def _uuid_to_bytes(value: str) -> bytes:
+    # Same as `UUID(value).bytes` for the canonical form, several times faster
+    return bytes.fromhex(value.replace("-", ""))
+
+
+@lru_cache(maxsize=65536)
+def _uuid_from_bytes(value: bytes) -> str:
+    # Same as `str(UUID(bytes=value))`
+    h = value.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
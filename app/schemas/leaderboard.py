@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class LeaderboardEntry(BaseModel):
+    # Starts with 1
+    rank: int
+    username: str
+    rating: float
+
+
+class LeaderboardPage(BaseModel):
+    entries: list[LeaderboardEntry]
+    total: int
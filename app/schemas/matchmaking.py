@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+
+
+class MatchmakingTicket(BaseModel):
+    username: str
+    bucket: int
+    # Enqueue time, ms since the epoch
+    queuedAt: int
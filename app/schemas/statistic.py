@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 
 from app.schemas import Player
+from app.settings import settings
 
 
 class PlayerStatistic(BaseModel):
@@ -13,6 +14,8 @@ class UserStatisticRead(BaseModel):
     games_total: int = Field(default=0, serialize_alias="gamesPlayed")
     games_win: int = Field(default=0, serialize_alias="gamesWin")
     games_loose: int = Field(default=0, serialize_alias="gamesLoose")
+    rating: float = Field(default=settings.RATING_INITIAL, serialize_alias="rating")
+    rating_deviation: float = Field(default=settings.RATING_DEVIATION_INITIAL, serialize_alias="ratingDeviation")
 
     class Config:
         from_attributes = True
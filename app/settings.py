@@ -20,18 +20,84 @@ class Settings:
     POSTGRES_HOSTNAME: str = "localhost"  # TODO: return os.getenv("POSTGRES_HOSTNAME", "localhost")
     POSTGRES_PORT: str = os.getenv("POSTGRES_PORT", 5432)
     POSTGRES_DB: str = os.getenv("POSTGRES_DB", "tic_tac_toe")
-    DATABASE_URL = (
-        f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOSTNAME}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    # DATABASE_URL overrides the POSTGRES_* settings, e.g. sqlite+aiosqlite:///tic_tac_toe.db for a local run
+    DATABASE_URL: str = os.getenv(
+        "DATABASE_URL",
+        f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOSTNAME}:{POSTGRES_PORT}/{POSTGRES_DB}",
     )
+    # Connection pool of the worker: connections kept open, connections opened above them under load, seconds
+    # a session waits for a free connection, seconds after which a connection is reopened
+    POSTGRES_POOL_SIZE: int = int(os.getenv("POSTGRES_POOL_SIZE", 10))
+    POSTGRES_MAX_OVERFLOW: int = int(os.getenv("POSTGRES_MAX_OVERFLOW", 5))
+    POSTGRES_POOL_TIMEOUT: float = float(os.getenv("POSTGRES_POOL_TIMEOUT", 10.0))
+    POSTGRES_POOL_RECYCLE: int = int(os.getenv("POSTGRES_POOL_RECYCLE", 1800))
+    # Prepared statements cached by asyncpg per connection, 0 behind pgbouncer in the transaction mode
+    POSTGRES_STATEMENT_CACHE_SIZE: int = int(os.getenv("POSTGRES_STATEMENT_CACHE_SIZE", 100))
 
     REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT: str = os.getenv("REDIS_PORT", 6379)
-    REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
+    # REDIS_URL overrides REDIS_HOST and REDIS_PORT, e.g. redis://127.0.0.1:6390/1
+    REDIS_URL: str = os.getenv("REDIS_URL", f"redis://{REDIS_HOST}:{REDIS_PORT}")
     REDIS_CHANNEL: str = os.getenv("REDIS_CHANNEL", "game_cache")
+    # Connection pool of the worker: connections, seconds a command waits for a free connection, seconds to wait
+    # for a reply and to connect, seconds between the health checks of an idle connection
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", 64))
+    REDIS_POOL_TIMEOUT: float = float(os.getenv("REDIS_POOL_TIMEOUT", 5.0))
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5.0))
+    REDIS_CONNECT_TIMEOUT: float = float(os.getenv("REDIS_CONNECT_TIMEOUT", 2.0))
+    REDIS_HEALTH_CHECK_INTERVAL: int = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+    LOBBY_PAGE_SIZE: int = int(os.getenv("LOBBY_PAGE_SIZE", 50))
+    LOBBY_PAGE_SIZE_MAX: int = int(os.getenv("LOBBY_PAGE_SIZE_MAX", 200))
+    # Rendered lobby pages kept in the worker, they are valid while the lobby version does not change
+    LOBBY_PAGE_CACHE_SIZE: int = int(os.getenv("LOBBY_PAGE_CACHE_SIZE", 64))
+    # Messages waiting to be sent to a single lobby socket, the newer ones are dropped when it is full
+    LOBBY_QUEUE_SIZE: int = int(os.getenv("LOBBY_QUEUE_SIZE", 256))
+    # Seconds the lobby changes are collected before they are sent as one diff frame
+    LOBBY_FEED_INTERVAL: float = float(os.getenv("LOBBY_FEED_INTERVAL", 0.25))
+    # Events of a single game waiting to be relayed to the local sockets of the game
+    GAME_QUEUE_SIZE: int = int(os.getenv("GAME_QUEUE_SIZE", 64))
+
+    BOT_USERNAME: str = os.getenv("BOT_USERNAME", "Bot")
+
+    # Matchmaking: number of the skill buckets, seconds between the matcher runs, seconds after which a player
+    # waiting alone in the bucket is paired with the neighbour bucket, seconds a ticket stays in the queue
+    MATCHMAKING_BUCKETS: int = int(os.getenv("MATCHMAKING_BUCKETS", 10))
+    MATCHMAKING_INTERVAL: float = float(os.getenv("MATCHMAKING_INTERVAL", 0.05))
+    MATCHMAKING_WIDEN_AFTER: float = float(os.getenv("MATCHMAKING_WIDEN_AFTER", 5.0))
+    MATCHMAKING_TICKET_TTL: float = float(os.getenv("MATCHMAKING_TICKET_TTL", 60.0))
+    MATCHMAKING_BATCH_SIZE: int = int(os.getenv("MATCHMAKING_BATCH_SIZE", 500))
+
+    # Write-behind of the statistic updates: seconds between flushes and pending users that force a flush
+    STATISTIC_FLUSH_INTERVAL: float = float(os.getenv("STATISTIC_FLUSH_INTERVAL", 1.0))
+    STATISTIC_FLUSH_SIZE: int = int(os.getenv("STATISTIC_FLUSH_SIZE", 500))
+    # Failed flushes of an update before it is dropped and logged
+    STATISTIC_FLUSH_RETRIES: int = int(os.getenv("STATISTIC_FLUSH_RETRIES", 10))
+    # Glicko rating: the rating and the deviation of a new player, the lowest deviation, games read per chunk
+    # by the full recompute
+    RATING_INITIAL: float = float(os.getenv("RATING_INITIAL", 1500.0))
+    RATING_DEVIATION_INITIAL: float = float(os.getenv("RATING_DEVIATION_INITIAL", 350.0))
+    RATING_DEVIATION_MIN: float = float(os.getenv("RATING_DEVIATION_MIN", 30.0))
+    RATING_RECOMPUTE_CHUNK: int = int(os.getenv("RATING_RECOMPUTE_CHUNK", 5000))
+    # Seconds between the rebuilds of the leaderboard from the database, one worker rebuilds it at a time
+    LEADERBOARD_RECONCILE_INTERVAL: float = float(os.getenv("LEADERBOARD_RECONCILE_INTERVAL", 3600.0))
+    LEADERBOARD_PAGE_SIZE: int = int(os.getenv("LEADERBOARD_PAGE_SIZE", 50))
+    LEADERBOARD_PAGE_SIZE_MAX: int = int(os.getenv("LEADERBOARD_PAGE_SIZE_MAX", 100))
+    # Game actors: seconds the worker owns the game without renewing the lease, moves between the snapshots
+    # of the game, seconds the idle game is kept in memory, seconds to wait for the worker owning the game
+    GAME_LEASE_TTL: float = float(os.getenv("GAME_LEASE_TTL", 10.0))
+    GAME_SNAPSHOT_MOVES: int = int(os.getenv("GAME_SNAPSHOT_MOVES", 4))
+    GAME_ACTOR_IDLE_TIMEOUT: float = float(os.getenv("GAME_ACTOR_IDLE_TIMEOUT", 60.0))
+    GAME_FORWARD_TIMEOUT: float = float(os.getenv("GAME_FORWARD_TIMEOUT", 3.0))
+    # Seconds a game socket may take to accept a message before it is closed as a slow consumer
+    WEBSOCKET_SEND_TIMEOUT: float = float(os.getenv("WEBSOCKET_SEND_TIMEOUT", 5.0))
 
     SECRET: str = os.getenv("SECRET_KEY", uuid4().hex)
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE: int = int(os.getenv("ACCESS_TOKEN_EXPIRE", 3600))
+    # In-process cache of the websocket authentication, seconds
+    AUTH_CACHE_TTL: int = int(os.getenv("AUTH_CACHE_TTL", 60))
+    AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", 10000))
 
 
 settings = Settings()
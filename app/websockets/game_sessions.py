@@ -0,0 +1,259 @@
+import asyncio
+import logging
+
+import orjson
+from fastapi import WebSocket
+
+from app.cache.pubsub import PubSubDispatcher, SubscriberQueue, pubsub_dispatcher
+from app.cache.redis import RedisCache, game_channel, parse_event_id
+from app.settings import settings
+from app.websockets.helper import GameProtocol
+from app.websockets.manager import WebsocketConnectionManager
+from app.websockets.protocol import delta_frame, move_seq, snapshot_frame
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class GameSession:
+    def __init__(self, game_id: str, queue: SubscriberQueue):
+        self.game_id = game_id
+        self.queue = queue
+        self.websocket_manager = WebsocketConnectionManager()
+        self.relay: asyncio.Task | None = None
+        # Users being added by the relay, the session is not closed until they are added
+        self.joining = 0
+        # user id -> id of the last event replayed to the user, newer events are sent by the relay
+        self.replayed: dict[str, tuple[int, int]] = {}
+        # user id -> sequence number of the last move sent to the user, for the users of the delta protocol
+        self.delta_seqs: dict[str, int] = {}
+
+
+class _Join:
+    """Request of the relay to add the socket, send the snapshot and replay the missed events."""
+
+    __slots__ = ("user", "websocket", "last_event_id", "protocol", "done")
+
+    def __init__(self, user: User, websocket: WebSocket, last_event_id: str | None, protocol: GameProtocol):
+        self.user = user
+        self.websocket = websocket
+        self.last_event_id = last_event_id
+        self.protocol = protocol
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class _Resync:
+    """Request of the relay to send the snapshot to the user."""
+
+    __slots__ = ("user_id",)
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+
+
+class GameSessions:
+    """Local sockets of the games played on this worker.
+
+    Moves and chat messages are published to the channel of the game, whichever worker handles the player who sent
+    them. Every worker with a socket of the game relays the channel to its local sockets, so the players of a game
+    may be connected to different workers.
+
+    Every event carries the id of its entry in the log of the game. A reconnected player passes the id of the last
+    event it received and gets the missed events from the log before the live ones, in order and without duplicates.
+
+    Every event is encoded once per protocol, see `app.websockets.protocol`. The users of the delta protocol get the
+    snapshot on join and instead of a move when the sequence number of the move is not the next one.
+    """
+
+    def __init__(self, dispatcher: PubSubDispatcher = pubsub_dispatcher, redis_cache: RedisCache | None = None):
+        self.dispatcher = dispatcher
+        self.redis_cache = redis_cache or RedisCache()
+        self._sessions: dict[str, GameSession] = {}
+        self._lock = asyncio.Lock()
+
+    async def connect(
+        self,
+        game_id: str,
+        user: User,
+        websocket: WebSocket,
+        last_event_id: str | None = None,
+        protocol: str | None = None,
+    ) -> None:
+        """Add the socket of the player to the session of the game.
+
+        Args:
+            game_id (str): game id
+            user (User): player
+            websocket (WebSocket): socket of the player
+            last_event_id (str | None): id of the last event received before the reconnect, the events logged after
+                it are sent before the live ones. An invalid id is ignored.
+            protocol (str | None): `GameProtocol` requested by the client, the full protocol if it is unknown
+        """
+        if last_event_id is not None:
+            try:
+                parse_event_id(last_event_id)
+            except (TypeError, ValueError, AttributeError):
+                last_event_id = None
+        try:
+            protocol = GameProtocol(protocol) if protocol is not None else GameProtocol.FULL
+        except ValueError:
+            protocol = GameProtocol.FULL
+
+        async with self._lock:
+            if (session := self._sessions.get(game_id)) is None:
+                queue = await self.dispatcher.subscribe(game_channel(game_id), maxsize=settings.GAME_QUEUE_SIZE)
+                session = self._sessions[game_id] = GameSession(game_id, queue)
+                session.relay = asyncio.create_task(self._relay(session), name=f"game-relay-{game_id}")
+            if last_event_id is None and protocol is GameProtocol.FULL:
+                try:
+                    await session.websocket_manager.add(user, websocket=websocket)
+                except Exception:
+                    await self._close_if_empty(session)
+                    raise
+                return
+            # The relay replays the log and sends the snapshot, so they are ordered with the queued live events
+            join = _Join(user, websocket, last_event_id, protocol)
+            session.joining += 1
+
+        try:
+            await session.queue.put(join)
+            await join.done
+        finally:
+            async with self._lock:
+                session.joining -= 1
+                if not join.done.done() or join.done.exception() is not None:
+                    await self._close_if_empty(session)
+
+    async def resync(self, game_id: str, user: User) -> None:
+        """Send the snapshot of the game to the player, e.g. when the client has detected a gap."""
+        if (session := self._sessions.get(game_id)) is not None:
+            await session.queue.put(_Resync(user.id))
+
+    async def disconnect(self, game_id: str, user: User, websocket: WebSocket | None = None) -> None:
+        """Remove the socket of the player from the session of the game, see `WebsocketConnectionManager.remove`."""
+        async with self._lock:
+            if (session := self._sessions.get(game_id)) is None:
+                return
+            if await session.websocket_manager.remove(user, websocket):
+                session.replayed.pop(user.id, None)
+                session.delta_seqs.pop(user.id, None)
+            await self._close_if_empty(session)
+
+    async def _close_if_empty(self, session: GameSession) -> None:
+        if session.websocket_manager.active_connections or session.joining:
+            return
+        if self._sessions.get(session.game_id) is not session:
+            return
+        del self._sessions[session.game_id]
+        session.relay.cancel()
+        await asyncio.gather(session.relay, return_exceptions=True)
+        await self.dispatcher.unsubscribe(game_channel(session.game_id), session.queue)
+
+    async def _relay(self, session: GameSession) -> None:
+        while True:
+            data = await session.queue.get()
+            try:
+                if isinstance(data, _Join):
+                    await self._join(session, data)
+                elif isinstance(data, _Resync):
+                    if data.user_id in session.websocket_manager.active_connections:
+                        await self._send_snapshot(session, data.user_id)
+                else:
+                    await self._send_event(session, data)
+            except Exception as e:
+                logger.error("Failed to relay the event of the game %s: %s", session.game_id, e)
+
+    async def _join(self, session: GameSession, join: _Join) -> None:
+        user_id = join.user.id
+        try:
+            await session.websocket_manager.add(join.user, websocket=join.websocket)
+            try:
+                if join.protocol is GameProtocol.DELTA:
+                    session.delta_seqs[user_id] = -1
+                    await self._send_snapshot(session, user_id)
+                if join.last_event_id is not None:
+                    events = await self.redis_cache.get_events(session.game_id, after=join.last_event_id)
+                    for event in events:
+                        await self._send_to(session, user_id, event)
+                    if events:
+                        session.replayed[user_id] = parse_event_id(events[-1]["eventId"])
+            except Exception:
+                await session.websocket_manager.remove(join.user, join.websocket)
+                session.delta_seqs.pop(user_id, None)
+                raise
+        except Exception as e:
+            if not join.done.done():
+                join.done.set_exception(e)
+            return
+        if not join.done.done():
+            join.done.set_result(None)
+
+    async def _send_event(self, session: GameSession, data: dict) -> None:
+        exclude = self._replayed_users(session, data)
+        manager = session.websocket_manager
+        if session.delta_seqs and (seq := move_seq(data)) is not None:
+            next_users = []
+            for user_id, last_seq in list(session.delta_seqs.items()):
+                if user_id in exclude or user_id not in manager.active_connections:
+                    continue
+                if seq == last_seq + 1:
+                    next_users.append(user_id)
+                    session.delta_seqs[user_id] = seq
+                else:
+                    await self._send_to(session, user_id, data)
+            if next_users:
+                await manager.multicast_message(delta_frame(data), next_users)
+            exclude = (*exclude, *session.delta_seqs)
+        if len(exclude) < len(manager.active_connections):
+            await manager.broadcast_message(orjson.dumps(data).decode(), exclude=exclude)
+        self._forget_evicted(session)
+
+    async def _send_to(self, session: GameSession, user_id: str, data: dict) -> None:
+        """Send the event to one socket in the protocol of the user."""
+        if (seq := move_seq(data)) is None or user_id not in session.delta_seqs:
+            await session.websocket_manager.send_personal_message(user_id, orjson.dumps(data).decode())
+            return
+        last_seq = session.delta_seqs[user_id]
+        if seq <= last_seq:
+            # Already in the snapshot
+            return
+        if seq != last_seq + 1:
+            await self._send_snapshot(session, user_id)
+            return
+        await session.websocket_manager.send_personal_message(user_id, delta_frame(data))
+        session.delta_seqs[user_id] = seq
+
+    async def _send_snapshot(self, session: GameSession, user_id: str) -> None:
+        if (game := await self.redis_cache.get_latest(session.game_id)) is None:
+            return
+        if user_id in session.delta_seqs:
+            session.delta_seqs[user_id] = game.seq
+        await session.websocket_manager.send_personal_message(user_id, snapshot_frame(game))
+
+    @staticmethod
+    def _forget_evicted(session: GameSession) -> None:
+        """Drop the state of the users evicted by the manager, the session is closed by their disconnect."""
+        connections = session.websocket_manager.active_connections
+        for state in (session.delta_seqs, session.replayed):
+            for user_id in [user_id for user_id in state if user_id not in connections]:
+                del state[user_id]
+
+    @staticmethod
+    def _replayed_users(session: GameSession, data: dict) -> tuple[str, ...]:
+        """Users the event has already been replayed to. The entries are dropped once a newer event arrives."""
+        if not session.replayed or "eventId" not in data:
+            return ()
+        try:
+            event_id = parse_event_id(data["eventId"])
+        except (TypeError, ValueError, AttributeError):
+            return ()
+        exclude = []
+        for user_id, replayed_id in list(session.replayed.items()):
+            if event_id <= replayed_id:
+                exclude.append(user_id)
+            else:
+                del session.replayed[user_id]
+        return tuple(exclude)
+
+
+game_sessions = GameSessions()
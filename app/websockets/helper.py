@@ -13,3 +13,11 @@ class WebsocketMessageType(str, Enum):
     GAME_INVITE = "gameInvite"
     GAME_IS_ACCEPTED = "gameIsAccepted"
     GAME_IS_ABORTED = "gameIsAborted"
+    MATCH_FOUND = "matchFound"
+
+
+class GameProtocol(str, Enum):
+    """Protocol of the game socket, requested by the client in the auth message."""
+
+    FULL = "full"
+    DELTA = "delta"
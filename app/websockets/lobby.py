@@ -0,0 +1,214 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+import orjson
+from fastapi import WebSocket
+
+from app.cache.pubsub import PubSubDispatcher, SubscriberQueue, pubsub_dispatcher
+from app.cache.redis import RedisCache
+from app.settings import settings
+from app.websockets.helper import WebsocketMessageType
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[dict | str], Awaitable[None]]
+
+
+class LobbyConnection:
+    """Lobby socket served by two long-lived tasks.
+
+    The reader waits for the client messages and the writer waits for the messages of the subscription queue.
+    An idle connection is just two tasks suspended on their awaits, it does not wake the event loop.
+    """
+
+    def __init__(self, websocket: WebSocket, queue: asyncio.Queue):
+        self.websocket = websocket
+        self.queue = queue
+
+    async def run(self, on_receive: MessageHandler, on_publish: MessageHandler) -> None:
+        """Serve the connection until one of the tasks stops.
+
+        Raises:
+            WebSocketDisconnect: the client has closed the connection
+        """
+        reader = asyncio.create_task(self._read(on_receive))
+        writer = asyncio.create_task(self._write(on_publish))
+        try:
+            done, _ = await asyncio.wait((reader, writer), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            reader.cancel()
+            writer.cancel()
+            await asyncio.gather(reader, writer, return_exceptions=True)
+        for task in done:
+            task.result()
+
+    async def _read(self, on_receive: MessageHandler) -> None:
+        while True:
+            data = await self.websocket.receive_json()
+            if isinstance(data, dict) and "type" in data:
+                await on_receive(data)
+
+    async def _write(self, on_publish: MessageHandler) -> None:
+        while True:
+            data = await self.queue.get()
+            await on_publish(data)
+
+
+class LobbyFeed:
+    """Coalesced feed of the lobby changes for the sockets of the worker.
+
+    The changes published to the lobby channel within `interval` seconds are merged into one diff frame::
+
+        {"type": "lobbyDiff", "version": 42, "added": [game, ...], "updated": [game, ...], "removed": [id, ...]}
+
+    encoded once for all the sockets. Clients apply the diffs in order as upserts and deletes by the game id.
+    A new socket and a socket whose queue has overflowed get a snapshot of the first lobby page instead::
+
+        {"type": "lobbySnapshot", "version": 42, "games": [game, ...], "nextCursor": ...}
+
+    Other messages, e.g. invites, are forwarded to the sockets as they are. The frames are put into the queues
+    as encoded strings, the forwarded messages as dicts.
+    """
+
+    def __init__(
+        self,
+        dispatcher: PubSubDispatcher = pubsub_dispatcher,
+        redis_cache: RedisCache | None = None,
+        interval: float = settings.LOBBY_FEED_INTERVAL,
+    ):
+        self.dispatcher = dispatcher
+        self.redis_cache = redis_cache or RedisCache()
+        self.interval = interval
+        self.version = 0
+        self._subscribers: set[SubscriberQueue] = set()
+        # Subscribers waiting for the snapshot
+        self._resync: set[SubscriberQueue] = set()
+        self._added: dict[str, dict] = {}
+        self._updated: dict[str, dict] = {}
+        self._removed: set[str] = set()
+        self._queue: SubscriberQueue | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._queue = await self.dispatcher.subscribe(settings.REDIS_CHANNEL)
+            self._task = asyncio.create_task(self._run(), name="lobby-feed")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self.dispatcher.unsubscribe(settings.REDIS_CHANNEL, self._queue)
+        self._task = self._queue = None
+
+    def subscribe(self, maxsize: int = 0) -> SubscriberQueue:
+        """Queue of the lobby frames for a socket, it starts with the snapshot."""
+        queue = SubscriberQueue(maxsize)
+        self._subscribers.add(queue)
+        self._resync.add(queue)
+        if self._queue is not None:
+            self._queue.put_nowait(_RESYNC)
+        return queue
+
+    def unsubscribe(self, queue: SubscriberQueue) -> None:
+        self._subscribers.discard(queue)
+        self._resync.discard(queue)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._apply(await self._queue.get())
+            deadline = loop.time() + self.interval
+            while (timeout := deadline - loop.time()) > 0:
+                try:
+                    self._apply(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to send the lobby changes: %s", e, exc_info=True)
+
+    def _apply(self, data: dict) -> None:
+        if data is _RESYNC:
+            return
+        try:
+            self._merge(data)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Invalid lobby message %s: %s", data, e)
+
+    def _merge(self, data: dict) -> None:
+        match data.get("type"):
+            case WebsocketMessageType.GAME_ADDED | WebsocketMessageType.GAME_UPDATED | WebsocketMessageType.GAME_LEFT:
+                game = data["game"]
+                # The game is published as the JSON string
+                game = orjson.loads(game) if isinstance(game, (str, bytes)) else game
+                game_id = game["id"]
+                self._removed.discard(game_id)
+                if game_id in self._added or data["type"] == WebsocketMessageType.GAME_ADDED:
+                    self._added[game_id] = game
+                else:
+                    self._updated[game_id] = game
+            case WebsocketMessageType.GAME_JOINED | WebsocketMessageType.GAME_DELETED:
+                game_id = data["gameId"]
+                self._updated.pop(game_id, None)
+                if self._added.pop(game_id, None) is None:
+                    self._removed.add(game_id)
+            case _:
+                for queue in self._subscribers:
+                    self._put(queue, data)
+
+    async def flush(self) -> None:
+        if self._added or self._updated or self._removed:
+            self.version += 1
+            frame = orjson.dumps(
+                {
+                    "type": "lobbyDiff",
+                    "version": self.version,
+                    "added": list(self._added.values()),
+                    "updated": list(self._updated.values()),
+                    "removed": list(self._removed),
+                }
+            ).decode()
+            self._added, self._updated, self._removed = {}, {}, set()
+            for queue in self._subscribers:
+                if queue not in self._resync:
+                    self._put(queue, frame)
+
+        if self._resync:
+            games, next_cursor = await self.redis_cache.get_active_games(None, settings.LOBBY_PAGE_SIZE)
+            snapshot = orjson.dumps(
+                {
+                    "type": "lobbySnapshot",
+                    "version": self.version,
+                    "games": [game.model_dump() for game in games],
+                    "nextCursor": next_cursor,
+                }
+            ).decode()
+            resync, self._resync = self._resync, set()
+            for queue in resync & self._subscribers:
+                # The queued diffs are older than the snapshot, the forwarded messages are kept
+                forwarded = []
+                while not queue.empty():
+                    if isinstance(item := queue.get_nowait(), dict):
+                        forwarded.append(item)
+                queue.dropped = 0
+                self._put(queue, snapshot)
+                for item in forwarded:
+                    self._put(queue, item)
+
+    def _put(self, queue: SubscriberQueue, item: str | dict) -> None:
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            queue.dropped += 1
+            # The socket has fallen behind, it gets the snapshot
+            self._resync.add(queue)
+
+
+# Wakes the feed up to send the snapshot to a new socket
+_RESYNC: dict = {}
+
+lobby_feed = LobbyFeed()
@@ -1,35 +1,104 @@
+import asyncio
+import logging
+from typing import Iterable
+
+import orjson
 from fastapi import WebSocket, WebSocketDisconnect, WebSocketException, status
 
+from app.settings import settings
 from database.models import User
 
+logger = logging.getLogger(__name__)
+
 
 class WebsocketConnectionManager:
-    def __init__(self):
+    """Sockets of the players of a game.
+
+    A broadcast encodes the message once and sends it to all the sockets concurrently. A socket that does not accept
+    the message within `send_timeout` seconds or fails is evicted: it is removed and closed, so a slow consumer
+    does not stall the others.
+    """
+
+    def __init__(self, max_connections: int = 2, send_timeout: float = settings.WEBSOCKET_SEND_TIMEOUT):
         self.active_connections: dict[str, WebSocket] = {}
+        self.max_connections = max_connections
+        self.send_timeout = send_timeout
+        self.evicted_count = 0
 
     async def add(self, user: User, websocket: WebSocket):
         if user.id in self.active_connections:
             raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="User already connected")
-        if len(self.active_connections) >= 2:
+        if len(self.active_connections) >= self.max_connections:
             raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Too many connections")
         self.active_connections[user.id] = websocket
 
+    async def remove(self, user: User, websocket: WebSocket | None = None) -> bool:
+        """Remove the socket of the user, only if it is `websocket` when it is given, e.g. not a newer one.
+
+        Returns:
+            bool: True if the socket is removed
+        """
+        if websocket is not None and self.active_connections.get(user.id) is not websocket:
+            return False
+        return self.active_connections.pop(user.id, None) is not None
+
     async def disconnect(self, uid: str):
         websocket = self.active_connections.pop(uid)
         await websocket.close()
 
-    async def send_personal_message(self, uid: str, message: str):
-        websocket = self.active_connections[uid]
-        await websocket.send_text(message)
+    async def send_personal_message(self, uid: str, message: str) -> bool:
+        if (websocket := self.active_connections.get(uid)) is None:
+            return False
+        return await self._send(uid, websocket, message)
+
+    async def send_personal_json(self, uid: str, data: dict) -> bool:
+        return await self.send_personal_message(uid, orjson.dumps(data).decode())
+
+    async def broadcast_message(self, message: str, exclude: tuple[str, ...] = ()) -> list[str]:
+        """Send the message to all the sockets except the `exclude` users.
+
+        Returns:
+            list[str]: ids of the evicted users
+        """
+        return await self.multicast_message(message, [uid for uid in self.active_connections if uid not in exclude])
+
+    async def broadcast_json(self, data: dict, exclude: tuple[str, ...] = ()) -> list[str]:
+        return await self.broadcast_message(orjson.dumps(data).decode(), exclude=exclude)
+
+    async def multicast_message(self, message: str, uids: Iterable[str]) -> list[str]:
+        """Send the message to the sockets of the users concurrently.
 
-    async def send_personal_json(self, uid: str, data: dict):
-        websocket = self.active_connections[uid]
-        await websocket.send_json(data)
+        Returns:
+            list[str]: ids of the evicted users
+        """
+        targets = [(uid, websocket) for uid in uids if (websocket := self.active_connections.get(uid)) is not None]
+        if not targets:
+            return []
+        if len(targets) == 1:
+            uid, websocket = targets[0]
+            return [] if await self._send(uid, websocket, message) else [uid]
+        results = await asyncio.gather(*(self._send(uid, websocket, message) for uid, websocket in targets))
+        return [uid for (uid, _), sent in zip(targets, results) if not sent]
 
-    async def broadcast_message(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
+    async def _send(self, uid: str, websocket: WebSocket, message: str) -> bool:
+        try:
+            await asyncio.wait_for(websocket.send_text(message), timeout=self.send_timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("Socket of the user %s is too slow, it is closed", uid)
+        except (WebSocketDisconnect, RuntimeError, OSError) as e:
+            logger.info("Failed to send the message to the user %s: %s", uid, e)
+        await self._evict(uid, websocket)
+        return False
 
-    async def broadcast_json(self, data: dict):
-        for connection in self.active_connections.values():
-            await connection.send_json(data)
+    async def _evict(self, uid: str, websocket: WebSocket) -> None:
+        if self.active_connections.get(uid) is websocket:
+            del self.active_connections[uid]
+            self.evicted_count += 1
+        try:
+            await asyncio.wait_for(
+                websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too slow"), timeout=self.send_timeout
+            )
+        except Exception:
+            # The socket is already broken, the reader of the socket finishes the connection
+            pass
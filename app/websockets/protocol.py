@@ -0,0 +1,53 @@
+"""Frames of the game socket.
+
+The events of a game are logged and published in the full form, e.g. a move::
+
+    {"type": "gameState", "gameId": ..., "cellIndex": 4, "item": "X", "seq": 3, "gameState": {...}, "eventId": ...}
+
+Clients of the `GameProtocol.DELTA` protocol get a move as a delta frame instead::
+
+    {"t": "m", "s": 3, "c": 4, "i": "X"}            # "w": winner id and "f": 1 are added when the game is finished
+
+and the whole state as a snapshot frame on join, on a gap in the sequence numbers and on the `resync` request.
+Other events, e.g. chat messages, are sent in the full form to all the clients.
+"""
+
+import orjson
+
+from app.schemas.game import Game
+
+GAME_STATE_TYPE = "gameState"
+SNAPSHOT_TYPE = "snapshot"
+RESYNC_TYPE = "resync"
+
+
+def move_seq(data: dict) -> int | None:
+    """Sequence number of the move event, None for the other events."""
+    if data.get("type") != GAME_STATE_TYPE:
+        return None
+    seq = data.get("seq")
+    return seq if isinstance(seq, int) else None
+
+
+def delta_frame(data: dict) -> str:
+    """Delta frame of the move event."""
+    frame = {"t": "m", "s": data["seq"], "c": data["cellIndex"], "i": data.get("item")}
+    game_state = data.get("gameState") or {}
+    if game_state.get("finished"):
+        frame["f"] = 1
+        if game_state.get("winner") is not None:
+            frame["w"] = game_state["winner"]
+    return orjson.dumps(frame).decode()
+
+
+def snapshot_frame(game: Game) -> str:
+    return orjson.dumps(
+        {
+            "type": SNAPSHOT_TYPE,
+            "gameId": game.id,
+            "seq": game.seq,
+            "board": game.board.to_list(),
+            "turn": game.board.turn,
+            "gameState": game.state.to_dict(),
+        }
+    ).decode()
@@ -0,0 +1,17 @@
+import time
+from typing import Callable
+
+
+def best_of(func: Callable[[], None], loops: int, repeat: int = 5) -> float:
+    """Run ``func`` ``loops`` times per round and return the best round time per call in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / loops
+
+
+def report(name: str, seconds_per_call: float, unit: str = "op") -> None:
+    print(f"{name:<40} {seconds_per_call * 1e6:10.3f} us/{unit} {1 / seconds_per_call:14,.0f} {unit}/s")
@@ -0,0 +1,28 @@
+"""Cost of the table load and of a single bot move.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_bot
+"""
+
+import time
+
+from app.engine import Bitboard
+from app.engine.solver import PositionTable
+from benchmarks._timing import best_of, report
+
+
+def main() -> None:
+    table = PositionTable()
+    start = time.perf_counter()
+    table.load()
+    print(f"{'table load':<40} {(time.perf_counter() - start) * 1e3:10.3f} ms ({len(table)} positions)")
+
+    empty = Bitboard()
+    middle = Bitboard(x_mask=0b000010001, o_mask=0b000000110)
+    report("bot move (empty board)", best_of(lambda: table.best_move(empty), loops=100_000), unit="move")
+    report("bot move (middle game)", best_of(lambda: table.best_move(middle), loops=100_000), unit="move")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Broadcast of a game event to many sockets: sequential `send_json` per socket against the serialize-once
+concurrent broadcast of `WebsocketConnectionManager`, with one slow socket among the listeners.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_broadcast [listeners]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+from app.websockets.manager import WebsocketConnectionManager
+
+SEND_DELAY = 0.001  # seconds a healthy socket takes to accept a message
+SLOW_DELAY = 1.0
+EVENT = {
+    "eventId": "1718000000000-0",
+    "type": "gameState",
+    "gameId": "8b0f0b52-8a1e-4b6e-9d6f-6f0e2f5b7c11",
+    "cellIndex": 4,
+    "item": "X",
+    "seq": 1,
+    "gameState": {"winner": None, "finished": False},
+}
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def send_json(self, data: dict) -> None:
+        # What starlette does in `WebSocket.send_json`
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, data: str) -> None:
+        await asyncio.sleep(self.delay)
+
+    async def close(self, code: int = 1000, reason: str | None = None) -> None:
+        pass
+
+
+def make_sockets(listeners: int) -> dict[str, FakeWebSocket]:
+    sockets = {f"user-{index}": FakeWebSocket(SEND_DELAY) for index in range(listeners - 1)}
+    sockets["slow"] = FakeWebSocket(SLOW_DELAY)
+    return sockets
+
+
+async def sequential(listeners: int) -> float:
+    sockets = make_sockets(listeners)
+    start = time.perf_counter()
+    for websocket in sockets.values():
+        await websocket.send_json(EVENT)
+    return time.perf_counter() - start
+
+
+async def concurrent(listeners: int) -> tuple[float, float]:
+    manager = WebsocketConnectionManager(max_connections=listeners, send_timeout=0.05)
+    manager.active_connections.update(make_sockets(listeners))
+    start = time.perf_counter()
+    await manager.broadcast_json(EVENT)
+    first = time.perf_counter() - start
+    # The slow socket has been evicted
+    start = time.perf_counter()
+    await manager.broadcast_json(EVENT)
+    return first, time.perf_counter() - start
+
+
+async def main(listeners: int) -> None:
+    print(f"{listeners} listeners, {SEND_DELAY * 1000:.0f} ms per send, one socket takes {SLOW_DELAY:.0f} s")
+    print(f"{'sequential send_json':<40} {await sequential(listeners) * 1000:10.1f} ms")
+    first, second = await concurrent(listeners)
+    print(f"{'concurrent broadcast':<40} {first * 1000:10.1f} ms")
+    print(f"{'concurrent broadcast, slow evicted':<40} {second * 1000:10.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
@@ -0,0 +1,186 @@
+"""Microbenchmarks of the game core and the serialization, no Redis or database is needed.
+
+These functions run for every move and every lobby listing. The results are written to a JSON file, a run compared
+to the file of another commit fails when a benchmark is slower than `--threshold`.
+
+Run from the repository root, e.g. on the base commit and on the change::
+
+    python -m benchmarks.bench_core --output base.json
+    python -m benchmarks.bench_core --output change.json --baseline base.json --threshold 0.1
+
+The exit status is 1 when a benchmark has regressed. Compare the runs made on the same idle machine, on a busy
+or a shared one the timings vary by tens of percent and the threshold has to be raised. `--filter` runs the benchmarks
+with the substring in the name.
+"""
+
+import argparse
+import asyncio
+import gc
+import platform
+import subprocess
+import sys
+import time
+from collections.abc import Callable, Coroutine
+from types import SimpleNamespace
+from uuid import uuid4
+
+import orjson
+
+from app.engine import Bitboard
+from app.helpers import GameItems
+from app.schemas import Game, GameCreate, Player, UserStatisticRead
+from benchmarks._timing import best_of, report
+from database.models import UserStatistic
+
+# X wins on the diagonal 0-4-8 with the 5th move of the game
+MOVES: tuple[int, ...] = (0, 1, 4, 3, 8)
+# Seconds of a round at least, the shorter rounds are too noisy to compare the commits
+MIN_ROUND_TIME = 0.2
+
+
+def _run(coroutine: Coroutine):
+    """Result of the coroutine which does not await anything, without the event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("The coroutine has suspended")
+
+
+def make_game() -> tuple[Game, SimpleNamespace, SimpleNamespace]:
+    first = SimpleNamespace(id=uuid4(), username="first_player")
+    second = SimpleNamespace(id=uuid4(), username="second_player")
+    game = Game.create(first, GameCreate(gameName="Friday evening game", currentPlayerItem=GameItems.X))
+    asyncio.run(game.join_player(second))
+    return game, first, second
+
+
+def benchmarks() -> dict[str, tuple[Callable[[], object], str]]:
+    """Name -> (function, unit). A function making several moves is reported per move."""
+    game, first, second = make_game()
+    players = (first, second)
+
+    def play_game() -> None:
+        # A fresh board for the same players, the moves alternate between them
+        game.board = Bitboard()
+        game.seq = 0
+        for index, cell_index in enumerate(MOVES):
+            _run(game.player_set_item(players[index % 2], cell_index))
+
+    # A game in progress, as it is stored and listed in the lobby
+    game.board, game.seq = Bitboard(), 0
+    for index, cell_index in enumerate(MOVES[:3]):
+        _run(game.player_set_item(players[index % 2], cell_index))
+    data = game.dump()
+    binary_data = game.dump_bytes()
+    player = game.first_player
+    player_data = player.dump()
+    statistic = UserStatistic(
+        user_id=first.id, games_total=120, games_win=64, games_loose=40, rating=1623.5, rating_deviation=48.2
+    )
+    return {
+        "Game.__init__": (lambda: Game(first, "Friday evening game", GameItems.X), "op"),
+        "Game.player_set_item": (play_game, "move"),
+        "Game.dump": (game.dump, "op"),
+        "Game.load": (lambda: Game.load(data), "op"),
+        "Game.dump_bytes": (game.dump_bytes, "op"),
+        "Game.load_bytes": (lambda: Game.load_bytes(binary_data), "op"),
+        "Game.to_read": (lambda: Game.to_read(data), "op"),
+        "Game.dump_model_json": (game.dump_model_json, "op"),
+        "Player.dump": (player.dump, "op"),
+        "Player.load": (lambda: Player.load(player_data), "op"),
+        "UserStatisticRead.model_validate": (lambda: UserStatisticRead.model_validate(statistic), "op"),
+    }
+
+
+def calibrate(func: Callable[[], object]) -> int:
+    """Loops of a round taking `MIN_ROUND_TIME` at least."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - start >= MIN_ROUND_TIME:
+            return loops
+        loops *= 2
+
+
+def run(name_filter: str | None, repeat: int) -> dict[str, dict]:
+    results = {}
+    for name, (func, unit) in benchmarks().items():
+        if name_filter and name_filter not in name:
+            continue
+        # As timeit does, the collections of the garbage of other benchmarks do not count
+        gc.collect()
+        gc.disable()
+        try:
+            loops = calibrate(func)
+            seconds = best_of(func, loops, repeat)
+        finally:
+            gc.enable()
+        if unit == "move":
+            seconds /= len(MOVES)
+        report(name, seconds, unit)
+        results[name] = {"seconds": seconds, "unit": unit, "loops": loops}
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """Names of the benchmarks slower than the baseline by more than the threshold."""
+    regressed = []
+    print(f"\n{'benchmark':<40} {'baseline us':>12} {'current us':>12} {'change':>8}")
+    for name, result in results.items():
+        if (base := baseline.get(name)) is None:
+            continue
+        change = result["seconds"] / base["seconds"] - 1
+        mark = ""
+        if change > threshold:
+            regressed.append(name)
+            mark = "  REGRESSION"
+        print(f"{name:<40} {base['seconds'] * 1e6:12.3f} {result['seconds'] * 1e6:12.3f} {change:+8.1%}{mark}")
+    return regressed
+
+
+def _commit() -> str | None:
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.strip()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", default="bench_core.json", help="JSON file of the results")
+    parser.add_argument("--baseline", help="JSON file of the results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown counted as a regression, 0.1 is 10%%")
+    parser.add_argument("--repeat", type=int, default=7, help="rounds per benchmark, the best one is reported")
+    parser.add_argument("--filter", dest="name_filter", help="run the benchmarks with the substring in the name")
+    args = parser.parse_args()
+
+    results = run(args.name_filter, args.repeat)
+    with open(args.output, "wb") as file:
+        file.write(
+            orjson.dumps(
+                {
+                    "commit": _commit(),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                option=orjson.OPT_INDENT_2,
+            )
+        )
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, "rb") as file:
+        baseline = orjson.loads(file.read())
+    if regressed := compare(results, baseline["results"], args.threshold):
+        print(f"\n{len(regressed)} regressed by more than {args.threshold:.0%}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
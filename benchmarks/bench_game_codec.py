@@ -0,0 +1,43 @@
+"""Size and speed of the binary game format against the JSON `Game.dump`/`Game.load`.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_game_codec
+"""
+
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+
+import orjson
+
+from app.helpers import GameItems
+from app.schemas import Game, GameCreate
+from benchmarks._timing import best_of, report
+
+
+def make_game() -> Game:
+    first = SimpleNamespace(id=uuid4(), username="first_player")
+    second = SimpleNamespace(id=uuid4(), username="second_player")
+    game = Game.create(first, GameCreate(gameName="Friday evening game", currentPlayerItem=GameItems.X))
+    asyncio.run(game.join_player(second))
+    for user, cell_index in ((first, 4), (second, 0), (first, 8)):
+        asyncio.run(game.player_set_item(user, cell_index))
+    return game
+
+
+def main() -> None:
+    game = make_game()
+    json_data = orjson.dumps(game.dump())
+    binary_data = game.dump_bytes()
+    print(f"{'JSON size':<40} {len(json_data):10} bytes")
+    print(f"{'binary size':<40} {len(binary_data):10} bytes ({len(json_data) / len(binary_data):.1f}x smaller)")
+
+    report("JSON encode (dump + orjson)", best_of(lambda: orjson.dumps(game.dump()), loops=50_000))
+    report("binary encode (dump_bytes)", best_of(game.dump_bytes, loops=50_000))
+    report("JSON decode (orjson + load)", best_of(lambda: Game.load(orjson.loads(json_data)), loops=50_000))
+    report("binary decode (load_bytes)", best_of(lambda: Game.load_bytes(binary_data), loops=50_000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Rank and page latency of the leaderboard with many users. Needs Redis, see `REDIS_HOST`/`REDIS_PORT`;
+the benchmark uses its own keys and removes them.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_leaderboard [users]
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from app.cache.leaderboard import Leaderboard
+from app.cache.redis import redis
+
+CHUNK_SIZE = 10_000
+QUERIES = 1_000
+
+
+class BenchLeaderboard(Leaderboard):
+    board_key = "bench:leaderboard"
+    names_key = "bench:leaderboard:names"
+    ids_key = "bench:leaderboard:ids"
+
+
+async def users(count: int):
+    for start in range(0, count, CHUNK_SIZE):
+        indexes = range(start, min(count, start + CHUNK_SIZE))
+        yield [(f"user-{index}", f"name-{index}", random.gauss(1500, 300)) for index in indexes]
+
+
+async def main(count: int = 1_000_000) -> None:
+    board = BenchLeaderboard(redis)
+    try:
+        start = time.perf_counter()
+        await board.replace(users(count))
+        print(f"{count} users loaded in {time.perf_counter() - start:.1f} s")
+
+        latencies = []
+        for _ in range(QUERIES):
+            start = time.perf_counter()
+            await board.rank(f"name-{random.randrange(count)}")
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f"rank p50 {latencies[QUERIES // 2] * 1000:.2f} ms, p99 {latencies[QUERIES * 99 // 100] * 1000:.2f} ms")
+
+        latencies = []
+        for _ in range(QUERIES):
+            start = time.perf_counter()
+            await board.top(random.randrange(count - 100), 50)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f"page p50 {latencies[QUERIES // 2] * 1000:.2f} ms, p99 {latencies[QUERIES * 99 // 100] * 1000:.2f} ms")
+    finally:
+        await redis.delete(*board._keys, *(f"{key}{board.rebuild_suffix}" for key in board._keys))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:2])))
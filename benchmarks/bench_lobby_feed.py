@@ -0,0 +1,95 @@
+"""Frames and CPU of the lobby sockets at a high rate of lobby changes: a message per change against the
+coalesced `LobbyFeed` diffs. No Redis is needed, the changes are fed straight into the dispatcher.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_lobby_feed [connections] [changes per second]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+import orjson
+
+from app.cache.pubsub import PubSubDispatcher
+from app.settings import settings
+from app.websockets.lobby import LobbyConnection, LobbyFeed
+
+SECONDS = 2.0
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = 0
+        self._closed = asyncio.get_running_loop().create_future()
+
+    async def receive_json(self) -> dict:
+        return await self._closed
+
+    async def send_json(self, data: dict) -> None:
+        # What starlette does in `WebSocket.send_json`
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, data: str) -> None:
+        self.sent += 1
+
+
+class FakeRedisCache:
+    async def get_active_games(self, cursor: str | None, limit: int) -> tuple[list, None]:
+        return [], None
+
+
+async def _ignore(data: dict) -> None:
+    pass
+
+
+async def publish(dispatcher: PubSubDispatcher, rate: int) -> None:
+    """Add a game and join it, half of the changes are additions."""
+    for index in range(int(rate * SECONDS) // 2):
+        game = {"id": f"game-{index}", "gameName": "Friday evening game", "currentPlayerName": "first_player"}
+        dispatcher.dispatch(settings.REDIS_CHANNEL, {"type": "gameAdded", "game": orjson.dumps(game).decode()})
+        await asyncio.sleep(1 / rate)
+        dispatcher.dispatch(settings.REDIS_CHANNEL, {"type": "gameJoined", "gameId": f"game-{index}"})
+        await asyncio.sleep(1 / rate)
+
+
+async def run(connections: int, rate: int, coalesced: bool) -> None:
+    dispatcher = PubSubDispatcher(redis_client=None)
+    feed = LobbyFeed(dispatcher, redis_cache=FakeRedisCache())
+    await feed.start()
+    sockets = [FakeWebSocket() for _ in range(connections)]
+    tasks = []
+    for websocket in sockets:
+        if coalesced:
+            queue = feed.subscribe(maxsize=settings.LOBBY_QUEUE_SIZE)
+            on_publish = websocket.send_text
+        else:
+            queue = await dispatcher.subscribe(settings.REDIS_CHANNEL, maxsize=settings.LOBBY_QUEUE_SIZE)
+            on_publish = websocket.send_json
+        tasks.append(asyncio.create_task(LobbyConnection(websocket, queue).run(_ignore, on_publish)))
+    await asyncio.sleep(0.1)
+
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+    await publish(dispatcher, rate)
+    await asyncio.sleep(feed.interval * 2)
+    cpu = (time.process_time() - start_cpu) / (time.perf_counter() - start_wall)
+    frames = sum(websocket.sent for websocket in sockets) / connections / SECONDS
+
+    name = f"coalesced every {feed.interval * 1000:.0f} ms" if coalesced else "message per change"
+    print(f"{name:<30} {frames:8.1f} frames/s per socket, CPU {cpu:6.1%}")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await feed.stop()
+
+
+async def main(connections: int = 1000, rate: int = 200) -> None:
+    print(f"{connections} lobby sockets, {rate} lobby changes per second")
+    await run(connections, rate, coalesced=False)
+    await run(connections, rate, coalesced=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:3])))
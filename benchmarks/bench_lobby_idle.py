@@ -0,0 +1,115 @@
+"""CPU used by the lobby sockets at idle and under load.
+
+The previous loop created two tasks per iteration and polled `pubsub.get_message`, which returns immediately,
+so an idle socket kept the event loop busy. The new model keeps two tasks suspended per connection.
+No Redis is needed, messages are fed straight into the dispatcher.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_lobby_idle [connections]
+"""
+
+import asyncio
+import sys
+import time
+
+from app.cache.pubsub import PubSubDispatcher
+from app.websockets.lobby import LobbyConnection
+
+CHANNEL = "lobby"
+IDLE_SECONDS = 2.0
+LOAD_SECONDS = 2.0
+LOAD_RATE = 20  # messages per second published to every connection
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = 0
+        self._closed = asyncio.get_running_loop().create_future()
+
+    async def receive_json(self) -> dict:
+        # The client never sends anything
+        return await self._closed
+
+    async def send_json(self, data: dict) -> None:
+        self.sent += 1
+
+
+async def legacy_connection(websocket: FakeWebSocket) -> None:
+    async def get_message() -> dict | None:
+        # `pubsub.get_message` without a timeout returns None when there is no message
+        return None
+
+    while True:
+        websocket_task = asyncio.create_task(websocket.receive_json())
+        redis_task = asyncio.create_task(get_message())
+        done, pending = await asyncio.wait([websocket_task, redis_task], return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+async def measure_cpu(seconds: float) -> float:
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+    await asyncio.sleep(seconds)
+    return (time.process_time() - start_cpu) / (time.perf_counter() - start_wall)
+
+
+async def run_legacy(connections: int) -> None:
+    sockets = [FakeWebSocket() for _ in range(connections)]
+    tasks = [asyncio.create_task(legacy_connection(websocket)) for websocket in sockets]
+    await asyncio.sleep(0.1)
+    cpu = await measure_cpu(IDLE_SECONDS)
+    print(f"legacy loop, {connections} idle sockets: CPU {cpu:6.1%}")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_event_driven(connections: int) -> None:
+    dispatcher = PubSubDispatcher(redis_client=None, channels=(CHANNEL,))
+    sockets = [FakeWebSocket() for _ in range(connections)]
+    tasks = []
+    for websocket in sockets:
+        connection = LobbyConnection(websocket, await dispatcher.subscribe(CHANNEL, maxsize=256))
+        tasks.append(asyncio.create_task(connection.run(on_receive=_ignore, on_publish=websocket.send_json)))
+    await asyncio.sleep(0.1)
+
+    cpu = await measure_cpu(IDLE_SECONDS)
+    print(f"event-driven, {connections} idle sockets: CPU {cpu:6.1%}")
+
+    async def publish() -> None:
+        message = {"type": "gameAdded", "gameId": "0"}
+        for _ in range(int(LOAD_RATE * LOAD_SECONDS)):
+            dispatcher.dispatch(CHANNEL, message)
+            await asyncio.sleep(1 / LOAD_RATE)
+
+    publisher = asyncio.create_task(publish())
+    cpu = await measure_cpu(LOAD_SECONDS)
+    await publisher
+    await asyncio.sleep(0.1)
+    delivered = sum(websocket.sent for websocket in sockets)
+    print(
+        f"event-driven, {connections} sockets at {LOAD_RATE} msg/s: CPU {cpu:6.1%}, "
+        f"{delivered / LOAD_SECONDS:,.0f} frames/s delivered"
+    )
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _ignore(data: dict) -> None:
+    pass
+
+
+async def main(connections: int) -> None:
+    # The legacy loop saturates the CPU with a few hundred sockets, more would only slow the run down
+    await run_legacy(min(connections, 500))
+    await run_event_driven(connections)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
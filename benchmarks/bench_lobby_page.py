@@ -0,0 +1,35 @@
+"""Rendering of a full lobby page: `GameListRead` built and serialized on every poll against the page rendered
+once per lobby version. Redis round trips are not included, the poll with the current version costs one GET of
+the version counter and an empty 304 response.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_lobby_page
+"""
+
+import orjson
+
+from app.cache.game_cache import LobbyPage
+from app.schemas.game import GameListRead, GameRead
+from app.settings import settings
+from benchmarks._timing import best_of, report
+
+
+def main() -> None:
+    games = [
+        GameRead(id=f"{index:032x}", gameName="Friday evening game", currentPlayerName="first_player", isActive=True)
+        for index in range(settings.LOBBY_PAGE_SIZE)
+    ]
+    page = LobbyPage(1, orjson.dumps([game.model_dump() for game in games]), 1718000000000000)
+
+    def rebuild() -> bytes:
+        return GameListRead(gamesList=games, userName="player", nextCursor=page.next_cursor).model_dump_json().encode()
+
+    assert orjson.loads(rebuild()) == orjson.loads(page.render("player"))
+    print(f"{settings.LOBBY_PAGE_SIZE} games per page, {len(rebuild())} bytes")
+    report("GameListRead per poll", best_of(rebuild, loops=5_000), unit="poll")
+    report("cached page per poll", best_of(lambda: page.render("player"), loops=5_000), unit="poll")
+
+
+if __name__ == "__main__":
+    main()
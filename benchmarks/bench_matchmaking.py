@@ -0,0 +1,76 @@
+"""Pairing latency of the matchmaking queue with many queued players. Needs Redis, see `REDIS_HOST`/`REDIS_PORT`;
+the benchmark uses its own keys and removes them.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_matchmaking [queued players]
+"""
+
+import asyncio
+import sys
+import time
+
+from app.cache.matchmaking import Matchmaker, MatchmakingQueue
+from app.cache.redis import redis
+from app.schemas import Player
+
+
+class BenchQueue(MatchmakingQueue):
+    tickets_key = "bench:matchmaking:tickets"
+    bucket_prefix = "bench:matchmaking:bucket:"
+
+
+class FakeGames:
+    """Records the pairs instead of creating the games."""
+
+    def __init__(self):
+        self.matched: dict[str, float] = {}
+
+    async def create_match_games(self, pairs: list[tuple[Player, Player]], games_ids: list[str] | None = None) -> list:
+        now = time.perf_counter()
+        for first, second in pairs:
+            self.matched[first.id] = self.matched[second.id] = now
+        return pairs
+
+
+async def fill(queue: BenchQueue, players: int) -> None:
+    now = time.time_ns() // 1_000_000
+    async with redis.pipeline(transaction=False) as pipe:
+        for index in range(players):
+            bucket = index % queue.buckets
+            pipe.hset(queue.tickets_key, f"queued-{index}", b'{"username":"queued"}')
+            pipe.zadd(queue.buckets_keys[bucket], {f"queued-{index}": now})
+        await pipe.execute()
+
+
+async def main(players: int = 20_000) -> None:
+    queue = BenchQueue()
+    await redis.delete(queue.tickets_key, *queue.buckets_keys)
+    try:
+        await fill(queue, players)
+        start = time.perf_counter()
+        pairs = await queue.pop_pairs(500)
+        print(f"{players} queued, {len(pairs)} pairs popped in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        games = FakeGames()
+        matchmaker = Matchmaker(queue, games)
+        await matchmaker.match()
+        await matchmaker.start()
+        latencies = []
+        for index in range(100):
+            start = time.perf_counter()
+            for player in (f"new-{index}-a", f"new-{index}-b"):
+                await queue.enqueue(player, player, bucket=index % queue.buckets)
+            matchmaker._wakeup.set()
+            while f"new-{index}-b" not in games.matched:
+                await asyncio.sleep(0.0005)
+            latencies.append(games.matched[f"new-{index}-b"] - start)
+        await matchmaker.stop()
+        latencies.sort()
+        print(f"pairing latency p50 {latencies[50] * 1000:.1f} ms, p99 {latencies[98] * 1000:.1f} ms")
+    finally:
+        await redis.delete(queue.tickets_key, *queue.buckets_keys)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:2])))
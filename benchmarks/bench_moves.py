@@ -0,0 +1,58 @@
+"""Moves per second of the previous list based move check against the bitboard engine.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_moves
+"""
+
+from app.engine import Bitboard
+from app.helpers import GameItems
+from benchmarks._timing import best_of, report
+
+# X wins on the diagonal 0-4-8 with the 5th move of the game
+MOVES: tuple[int, ...] = (0, 1, 4, 3, 8)
+DRAW_MOVES: tuple[int, ...] = (0, 4, 8, 1, 7, 6, 2, 5, 3)
+
+_WIN_PATTERNS = [[0, 1, 2], [3, 4, 5], [6, 7, 8], [0, 3, 6], [1, 4, 7], [2, 5, 8], [0, 4, 8], [2, 4, 6]]
+_AVAILABLE_INDEXES = [0, 1, 2, 3, 4, 5, 6, 7, 8]
+
+
+def legacy_game(moves: tuple[int, ...]) -> None:
+    """Move check as it was implemented in ``Game.player_set_item`` before the bitboard engine."""
+    game_state = dict().fromkeys(_AVAILABLE_INDEXES, "")
+    turn = GameItems.X
+    for cell_index in moves:
+        assert cell_index in _AVAILABLE_INDEXES
+        assert game_state[cell_index] == ""
+        game_state[cell_index] = turn
+        current_values = [set_item[0] for set_item in game_state.items() if set_item[1] == turn]
+        if len(current_values) >= 3:
+            if current_values in _WIN_PATTERNS:
+                break
+            elif not list(filter(lambda x: game_state[x] == "", game_state)):
+                break
+        turn = GameItems.O if turn == GameItems.X else GameItems.X
+
+
+def bitboard_game(moves: tuple[int, ...]) -> None:
+    board = Bitboard()
+    play = board.play
+    x, o = GameItems.X, GameItems.O
+    item = x
+    for cell_index in moves:
+        play(cell_index, item)
+        item = o if item is x else x
+
+
+def main() -> None:
+    for title, moves in (("win", MOVES), ("draw", DRAW_MOVES)):
+        moves_count = len(moves)
+        legacy = best_of(lambda: legacy_game(moves), loops=20_000) / moves_count
+        bitboard = best_of(lambda: bitboard_game(moves), loops=20_000) / moves_count
+        report(f"legacy list check ({title})", legacy, unit="move")
+        report(f"bitboard ({title})", bitboard, unit="move")
+        print(f"{'speedup':<40} {legacy / bitboard:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
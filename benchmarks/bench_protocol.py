@@ -0,0 +1,36 @@
+"""Bytes on the wire and encoding cost of a move in the full and the delta protocols of the game socket.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_protocol
+"""
+
+import json
+
+import orjson
+
+from app.cache.game_cache import GamesCacheManager
+from app.websockets.protocol import delta_frame, snapshot_frame
+from benchmarks._timing import best_of, report
+from benchmarks.bench_game_codec import make_game
+
+
+def main() -> None:
+    game = make_game()
+    event = {"eventId": "1718000000000-0", **orjson.loads(GamesCacheManager._game_state_message(game, 8, game.state))}
+    full = orjson.dumps(event).decode()
+    delta = delta_frame(event)
+    snapshot = snapshot_frame(game)
+    print(f"{'full move':<40} {len(full):10} bytes")
+    print(f"{'delta move':<40} {len(delta):10} bytes ({len(full) / len(delta):.1f}x smaller)")
+    print(f"{'snapshot':<40} {len(snapshot):10} bytes")
+
+    # `WebSocket.send_json` used to encode the event for every socket
+    report("full move (json.dumps)", best_of(lambda: json.dumps(event, separators=(",", ":")), loops=50_000))
+    report("full move (orjson)", best_of(lambda: orjson.dumps(event).decode(), loops=50_000))
+    report("delta move", best_of(lambda: delta_frame(event), loops=50_000))
+    report("snapshot", best_of(lambda: snapshot_frame(game), loops=50_000))
+
+
+if __name__ == "__main__":
+    main()
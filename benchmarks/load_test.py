@@ -0,0 +1,407 @@
+"""End-to-end load test of the app over HTTP and websockets.
+
+Simulated players register and log in, create and join games through `/api/v1/games` and play them to the end
+over `/games/{id}/ws`, while idle sockets sit in the lobby on `/ws`. Reported per operation: count, throughput,
+p50/p95/p99 and max latency:
+
+- auth: the login request
+- ws_auth: the authentication of a lobby socket
+- create, join: `POST /games` and `GET /games/{id}/join`
+- move: from sending `makeMove` to receiving the move back on the game socket
+- lobby: from the create request to the game added frame on every idle lobby socket
+
+Needs the packages of `benchmarks/requirements.txt`: httpx, and aiosqlite and `fakeredis[lua]` for a local run::
+
+    pip install -r benchmarks/requirements.txt
+
+The app started with `--serve` takes its database and Redis from DATABASE_URL and REDIS_URL. A local run without
+the services uses SQLite and the Redis stand-in of fakeredis started with `--fake-redis`::
+
+    DATABASE_URL=sqlite+aiosqlite:///load_test.db REDIS_URL=redis://127.0.0.1:6390 \\
+        python -m benchmarks.load_test --serve --fake-redis --players 50 --games 3 --idle 200
+
+SQLite serializes the writes, so keep `--concurrency` low with it. The statistic writer flushes the results of the
+games with Postgres SQL, on SQLite they are not saved, the measured operations are not affected by that.
+
+Against an app already running, e.g. with Postgres and Redis of docker-compose::
+
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --players 200 --games 5 --idle 1000
+
+The players pick their moves with a seeded random generator, runs with the same arguments play the same games.
+"""
+
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import httpx
+import orjson
+from redis.asyncio.connection import parse_url
+from websockets.asyncio.client import ClientConnection, connect
+
+from app.settings import settings
+
+PASSWORD = "load-test-password"
+# Seconds to wait for a game socket message, the game is abandoned after that
+MESSAGE_TIMEOUT = 10.0
+# Attempts to create the next game while the previous one is being released
+CREATE_ATTEMPTS = 20
+CREATE_RETRY_DELAY = 0.05
+# Seconds to wait for the app started with `--serve`
+SERVE_TIMEOUT = 30.0
+
+
+class Latencies:
+    """Latencies of one operation, the throughput is counted from the start of the first one to the end of the last."""
+
+    def __init__(self):
+        self.samples: list[float] = []
+        self.first_start = math.inf
+        self.last_end = -math.inf
+
+    def add(self, started: float, finished: float) -> None:
+        self.samples.append(finished - started)
+        self.first_start = min(self.first_start, started)
+        self.last_end = max(self.last_end, finished)
+
+    def percentile(self, q: float) -> float:
+        samples = sorted(self.samples)
+        return samples[max(0, math.ceil(q * len(samples)) - 1)]
+
+    def throughput(self) -> float:
+        elapsed = self.last_end - self.first_start
+        return len(self.samples) / elapsed if elapsed > 0 else math.inf
+
+
+class Player:
+    def __init__(self, client: httpx.AsyncClient, name: str):
+        self.client = client
+        self.name = name
+        self.email = f"{name}@loadtest.io"
+        self.token = ""
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+class LoadTest:
+    def __init__(
+        self,
+        url: str,
+        players: int,
+        games: int,
+        idle: int,
+        concurrency: int,
+        lobby_feed: str,
+        protocol: str,
+        seed: int,
+    ):
+        self.url = url.rstrip("/")
+        self.ws_url = "ws" + self.url.removeprefix("http")
+        self.players = players + players % 2
+        self.games = games
+        self.idle = idle
+        self.concurrency = concurrency
+        self.lobby_feed = lobby_feed
+        self.protocol = protocol
+        self.seed = seed
+        self.run_id = uuid4().hex[:8]
+        self.latencies: dict[str, Latencies] = defaultdict(Latencies)
+        self.errors: Counter[str] = Counter()
+        # game id -> time of the create request and the times the game has reached the lobby sockets
+        self.created: dict[str, float] = {}
+        self.lobby_arrivals: dict[str, list[float]] = defaultdict(list)
+
+    async def run(self) -> None:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.url + settings.API_PREFIX, limits=limits, timeout=30.0) as client:
+            players = [Player(client, f"lt{self.run_id}p{index}") for index in range(self.players)]
+            semaphore = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._sign_in(player, semaphore) for player in players))
+            players = [player for player in players if player.token]
+            if not players:
+                print("No player has signed in, is the app running?")
+                return
+
+            loop = asyncio.get_running_loop()
+            ready = [loop.create_future() for _ in range(self.idle)]
+            lobby = [
+                asyncio.create_task(self._idle(players[index % len(players)], future))
+                for index, future in enumerate(ready)
+            ]
+            await asyncio.gather(*ready)
+
+            started = time.perf_counter()
+            pairs = [(players[index], players[index + 1]) for index in range(0, len(players) - 1, 2)]
+            await asyncio.gather(*(self._play_pair(pair, first, second) for pair, (first, second) in enumerate(pairs)))
+            elapsed = time.perf_counter() - started
+            # The last lobby frames, the diff feed sends them in batches
+            await asyncio.sleep(max(settings.LOBBY_FEED_INTERVAL, 0.1) * 2)
+            for task in lobby:
+                task.cancel()
+            await asyncio.gather(*lobby, return_exceptions=True)
+
+        for game_id, arrivals in self.lobby_arrivals.items():
+            if (created := self.created.get(game_id)) is not None:
+                for arrived in arrivals:
+                    self.latencies["lobby"].add(created, arrived)
+        self.report(elapsed)
+
+    async def _sign_in(self, player: Player, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            data = {"email": player.email, "password": PASSWORD, "username": player.name}
+            try:
+                started = time.perf_counter()
+                response = await player.client.post("/auth/register", json=data)
+                response.raise_for_status()
+                self.latencies["register"].add(started, time.perf_counter())
+
+                started = time.perf_counter()
+                response = await player.client.post(
+                    "/auth/jwt/login", data={"username": player.email, "password": PASSWORD}
+                )
+                response.raise_for_status()
+                self.latencies["auth"].add(started, time.perf_counter())
+                player.token = response.json()["access_token"]
+            except httpx.HTTPError:
+                self.errors["auth"] += 1
+
+    async def _idle(self, player: Player, ready: asyncio.Future) -> None:
+        """Lobby socket which only receives, the games it has seen are recorded for the fan-out latency."""
+        try:
+            async with connect(f"{self.ws_url}/ws", max_size=None) as websocket:
+                started = time.perf_counter()
+                token_message = {"token": f"Bearer {player.token}", "lobbyFeed": self.lobby_feed}
+                await websocket.send(orjson.dumps(token_message).decode())
+                reply = orjson.loads(await websocket.recv())
+                if reply.get("status") != "success":
+                    self.errors["ws_auth"] += 1
+                    return
+                self.latencies["ws_auth"].add(started, time.perf_counter())
+                ready.set_result(None)
+
+                async for message in websocket:
+                    arrived = time.perf_counter()
+                    for game_id in _added_games(orjson.loads(message)):
+                        self.lobby_arrivals[game_id].append(arrived)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.errors["ws_auth" if not ready.done() else "lobby"] += 1
+        finally:
+            if not ready.done():
+                ready.set_result(None)
+
+    async def _play_pair(self, pair: int, first: Player, second: Player) -> None:
+        for index in range(self.games):
+            if (game_id := await self._create(first, index)) is None:
+                return
+            if not await self._join(second, game_id):
+                return
+            # The moves of a game do not depend on the order the games are played in
+            await asyncio.gather(
+                self._play(first, game_id, "X", random.Random(f"{self.seed}:{pair}:{index}:X")),
+                self._play(second, game_id, "O", random.Random(f"{self.seed}:{pair}:{index}:O")),
+            )
+
+    async def _create(self, player: Player, index: int) -> str | None:
+        data = {"gameName": f"{player.name}-{index}", "currentPlayerItem": "X"}
+        for _ in range(CREATE_ATTEMPTS):
+            started = time.perf_counter()
+            try:
+                response = await player.client.post("/games", json=data, headers=player.headers)
+            except httpx.HTTPError:
+                break
+            if response.status_code == 200:
+                game_id = response.json()["id"]
+                self.latencies["create"].add(started, time.perf_counter())
+                self.created[game_id] = started
+                return game_id
+            if response.status_code != 400:
+                break
+            # The previous game of the player is released after its last move
+            await asyncio.sleep(CREATE_RETRY_DELAY)
+        self.errors["create"] += 1
+        return None
+
+    async def _join(self, player: Player, game_id: str) -> bool:
+        started = time.perf_counter()
+        try:
+            response = await player.client.get(f"/games/{game_id}/join", headers=player.headers)
+        except httpx.HTTPError:
+            response = None
+        if response is None or response.status_code != 204:
+            self.errors["join"] += 1
+            return False
+        self.latencies["join"].add(started, time.perf_counter())
+        return True
+
+    async def _play(self, player: Player, game_id: str, item: str, moves: random.Random) -> None:
+        """Play the game to the end, the moves are random empty cells."""
+        try:
+            async with connect(f"{self.ws_url}/games/{game_id}/ws", max_size=None) as websocket:
+                if (await _receive(websocket)).get("type") != "auth":
+                    self.errors["move"] += 1
+                    return
+                # The log of the game is replayed from the start, so the moves made before the socket has joined the
+                # session of the game, e.g. the first move of X, are not missed
+                token_message = {"token": f"Bearer {player.token}", "protocol": self.protocol, "lastEventId": "0-0"}
+                await websocket.send(orjson.dumps(token_message).decode())
+                board = [""] * 9
+                finished = False
+                sent_at = None
+                while not finished:
+                    if sent_at is None and _turn(board) == item:
+                        cell_index = moves.choice([index for index, cell in enumerate(board) if not cell])
+                        sent_at = time.perf_counter()
+                        await websocket.send(orjson.dumps({"type": "makeMove", "cellIndex": cell_index}).decode())
+
+                    data = await _receive(websocket)
+                    match data.get("type", data.get("t")):
+                        case "gameState" | "m":
+                            # The full event and the delta frame of the move
+                            cell_index, moved = data.get("cellIndex", data.get("c")), data.get("item", data.get("i"))
+                            board[cell_index] = moved
+                            finished = data["gameState"]["finished"] if "gameState" in data else "f" in data
+                            if sent_at is not None and moved == item:
+                                self.latencies["move"].add(sent_at, time.perf_counter())
+                                sent_at = None
+                        case "snapshot":
+                            board = data["board"]
+                            finished = data["gameState"]["finished"]
+                        case "Error":
+                            self.errors["move"] += 1
+                            sent_at = None
+                            await websocket.send(orjson.dumps({"type": "resync"}).decode())
+        except (TimeoutError, OSError, ValueError):
+            self.errors["move"] += 1
+
+    def report(self, elapsed: float) -> None:
+        games = len(self.created)
+        print(f"{self.players} players, {self.idle} idle lobby sockets, {games} games in {elapsed:.1f} s")
+        print(f"{'operation':<10} {'count':>8} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name in ("register", "auth", "ws_auth", "create", "join", "move", "lobby"):
+            if (latencies := self.latencies.get(name)) is None or not latencies.samples:
+                continue
+            print(
+                f"{name:<10} {len(latencies.samples):>8} {latencies.throughput():>10,.1f} "
+                f"{latencies.percentile(0.5) * 1000:>9.2f} {latencies.percentile(0.95) * 1000:>9.2f} "
+                f"{latencies.percentile(0.99) * 1000:>9.2f} {max(latencies.samples) * 1000:>9.2f}"
+            )
+        if self.errors:
+            print("errors: " + ", ".join(f"{name} {count}" for name, count in sorted(self.errors.items())))
+
+
+async def _receive(websocket: ClientConnection) -> dict:
+    async with asyncio.timeout(MESSAGE_TIMEOUT):
+        return orjson.loads(await websocket.recv())
+
+
+def _turn(board: list[str]) -> str:
+    return "X" if board.count("X") == board.count("O") else "O"
+
+
+def _added_games(data: dict) -> list[str]:
+    """Ids of the games added to the lobby, by the message of the lobby channel or by the diff frame."""
+    match data.get("type"):
+        case "gameAdded":
+            game = data["game"]
+            # The game is published as the JSON string
+            game = orjson.loads(game) if isinstance(game, (str, bytes)) else game
+            return [game["id"]]
+        case "lobbyDiff":
+            return [game["id"] for game in data["added"]]
+    return []
+
+
+def _serve_fake_redis(host: str, port: int) -> None:
+    from fakeredis import TcpFakeServer
+
+    TcpFakeServer((host, port), server_type="redis").serve_forever()
+
+
+def start_fake_redis() -> multiprocessing.Process:
+    """fakeredis on the host and the port of REDIS_URL."""
+    address = parse_url(settings.REDIS_URL)
+    process = multiprocessing.Process(
+        target=_serve_fake_redis, args=(address.get("host", "127.0.0.1"), int(address.get("port", 6379))), daemon=True
+    )
+    process.start()
+    return process
+
+
+def start_app(url: str, workers: int) -> subprocess.Popen:
+    """uvicorn serving the app on the host and the port of the url."""
+    address = urlsplit(url)
+    env = dict(os.environ)
+    # The tokens are checked by every worker
+    env.setdefault("SECRET_KEY", uuid4().hex)
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", address.hostname, "--port", str(address.port or 80),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        env=env,
+    )
+    deadline = time.monotonic() + SERVE_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The app has exited with the code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/docs", timeout=1.0).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The app has not started")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="app url")
+    parser.add_argument("--players", type=int, default=50, help="players, they play in pairs")
+    parser.add_argument("--games", type=int, default=3, help="games played by every pair one after another")
+    parser.add_argument("--idle", type=int, default=100, help="idle lobby sockets")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent sign-ins and HTTP connections")
+    parser.add_argument("--lobby-feed", choices=("messages", "diff"), default="messages", help="feed of the lobby")
+    parser.add_argument("--protocol", choices=("full", "delta"), default="full", help="protocol of the game sockets")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the moves")
+    parser.add_argument("--serve", action="store_true", help="start the app with uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the app started with --serve")
+    parser.add_argument("--fake-redis", action="store_true", help="start fakeredis on the address of REDIS_URL")
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        if args.fake_redis:
+            processes.append(start_fake_redis())
+        if args.serve:
+            processes.append(start_app(args.url, args.workers))
+        load_test = LoadTest(
+            args.url, args.players, args.games, args.idle, args.concurrency, args.lobby_feed, args.protocol, args.seed
+        )
+        asyncio.run(load_test.run())
+    finally:
+        # The app saves its games before it exits, Redis is stopped after it
+        for process in reversed(processes):
+            process.terminate()
+            if isinstance(process, multiprocessing.Process):
+                process.join(SERVE_TIMEOUT)
+            else:
+                process.wait(SERVE_TIMEOUT)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
+import asyncio
 import logging
-from typing import AsyncGenerator, Coroutine
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import AsyncGenerator, AsyncIterator, Coroutine
 
 from fastapi import Depends
 from fastapi_users.db import SQLAlchemyUserDatabase
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from database.models import Base, User
@@ -11,11 +16,51 @@ from app.settings import settings
 
 logger = logging.getLogger(__name__)
 
-engine = create_async_engine(settings.DATABASE_URL)
+
+def _create_engine(url: str) -> AsyncEngine:
+    database_url = make_url(url)
+    if database_url.get_backend_name() == "sqlite":
+        # Local runs, e.g. the load test, SQLite connections are not pooled
+        return create_async_engine(database_url)
+    options = {
+        "pool_size": settings.POSTGRES_POOL_SIZE,
+        "max_overflow": settings.POSTGRES_MAX_OVERFLOW,
+        "pool_timeout": settings.POSTGRES_POOL_TIMEOUT,
+        "pool_recycle": settings.POSTGRES_POOL_RECYCLE,
+    }
+    if database_url.get_driver_name() == "asyncpg":
+        database_url = database_url.update_query_dict(
+            {"prepared_statement_cache_size": str(settings.POSTGRES_STATEMENT_CACHE_SIZE)}
+        )
+        options["connect_args"] = {"statement_cache_size": settings.POSTGRES_STATEMENT_CACHE_SIZE}
+    return create_async_engine(database_url, **options)
+
+
+engine = _create_engine(settings.DATABASE_URL)
 logger.info("Database connection established")
 Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
 
+class _SessionScope:
+    __slots__ = ("session", "task")
+
+    def __init__(self, session: AsyncSession, task: asyncio.Task | None):
+        self.session = session
+        self.task = task
+
+
+# The scope is copied into the tasks started inside it, they open their own sessions: a session is not shared
+# between concurrent tasks and does not outlive the scope
+_session_scope: ContextVar[_SessionScope | None] = ContextVar("session_scope", default=None)
+
+
+def _current_session() -> AsyncSession | None:
+    scope = _session_scope.get()
+    if scope is None or scope.session is None or scope.task is not asyncio.current_task():
+        return None
+    return scope.session
+
+
 async def create_db_and_tables() -> None:
     logger.info("Creating tables")
     async with engine.begin() as connection:
@@ -23,8 +68,34 @@ async def create_db_and_tables() -> None:
     logger.info("Tables created")
 
 
-async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """Session of a request or of a socket message.
+
+    The operations decorated with `session_connection` inside the scope run in its session instead of opening
+    their own, one connection is taken from the pool for all of them. The transaction is committed when the scope
+    exits and rolled back on an error. A nested scope uses the outer one.
+    """
+    if (session := _current_session()) is not None:
+        yield session
+        return
+
     async with Session() as session:
+        scope = _SessionScope(session, asyncio.current_task())
+        token = _session_scope.set(scope)
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            scope.session = None
+            _session_scope.reset(token)
+
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with session_scope() as session:
         yield session
 
 
@@ -33,14 +104,13 @@ async def get_user_db(session: AsyncSession = Depends(get_async_session)):
     
 
 def session_connection(method: Coroutine):
+    """Pass the session of the current `session_scope` to the operation, a new scope is opened outside of one."""
+
+    @wraps(method)
     async def wrapper(*args, **kwargs):
-        async with Session.begin() as session:
-            try:
-                return await method(*args, session=session, **kwargs)
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
+        if (session := _current_session()) is not None:
+            return await method(*args, session=session, **kwargs)
+        async with session_scope() as session:
+            return await method(*args, session=session, **kwargs)
 
     return wrapper
@@ -1,2 +1,2 @@
 from .base_model import Base
-from .users import User, UserStatistic
+from .users import GameResult, User, UserStatistic
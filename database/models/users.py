@@ -1,9 +1,11 @@
 import uuid
+from datetime import datetime, timezone
 
 from fastapi_users.db import SQLAlchemyBaseUserTableUUID, SQLAlchemyUserDatabase
-from sqlalchemy import Column, ForeignKey, Index, Integer, String, Uuid
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String, Uuid
 from sqlalchemy.orm import relationship
 
+from app.settings import settings
 from database.models.base_model import Base
 
 
@@ -23,7 +25,26 @@ class UserStatistic(Base):
     games_total = Column(Integer, default=0)
     games_win = Column(Integer, default=0)
     games_loose = Column(Integer, default=0)
+    # Glicko rating, see `app.engine.rating`
+    rating = Column(Float, default=settings.RATING_INITIAL, nullable=False)
+    rating_deviation = Column(Float, default=settings.RATING_DEVIATION_INITIAL, nullable=False)
     
     __table_args__ = (
-        Index("idx_user_statistic", 'user_id'),
+        Index("idx_user_statistic", 'user_id', unique=True),
+    )
+
+
+class GameResult(Base):
+    """History of the finished games between two users, the ratings are recomputed from it."""
+
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
+    game_id = Column(Uuid, nullable=False)
+    first_player_id = Column(Uuid, ForeignKey(User.id, ondelete="CASCADE"), nullable=False)
+    second_player_id = Column(Uuid, ForeignKey(User.id, ondelete="CASCADE"), nullable=False)
+    # None for a draw
+    winner_id = Column(Uuid, nullable=True)
+    finished_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        Index("idx_game_result_finished_at", "finished_at", "id"),
     )